@@ -0,0 +1,131 @@
+"""
+Cost of one login with a large user profile
+
+Measures SimpleAuthServer.get_token: time per call, memory allocated
+during the call (tracemalloc peak) and memory retained in the storage
+per login, and the reduction versus deep copies of the entries and the
+response (get_token of the earlier releases).
+
+Run from the root of the repository:
+python -m benchmarks.bench_get_token --user-size 200
+"""
+import argparse
+import copy
+import time
+import tracemalloc
+
+from simple_auth.core.server import SimpleAuthServer
+
+
+def render_user_model(user_size: int):
+
+    class BenchUser:
+        id: int = 1
+
+        def to_storage_dict(self):
+            return dict(
+                id=self.id,
+                name='User name',
+                groups=['group_%s' % i for i in range(user_size)],
+                permissions={'permission_%s' % i: True
+                             for i in range(user_size)})
+
+        @classmethod
+        def get(cls, user_id):
+            user = cls()
+            user.id = user_id
+            return user
+
+    return BenchUser
+
+
+def deep_copy_server(server_type):
+    """
+    get_token of the earlier releases: the entries and the response are
+    deep copies of the record
+
+    :param server_type: SimpleAuthServer class
+
+    :return: class
+    """
+
+    class DeepCopyServer(server_type):
+        def _write(self, key, value):
+            super()._write(key, copy.deepcopy(value))
+
+        def format(self, error=False, msg='', result=None, **kwargs):
+            return super().format(error, msg, copy.deepcopy(result),
+                                  **kwargs)
+
+    return DeepCopyServer
+
+
+def measure(server_type, logins: int) -> dict:
+    """
+    Time and memory of get_token
+
+    :param server_type: SimpleAuthServer class
+    :param logins: number of logins
+
+    :return: us per login, bytes allocated and retained per login
+    """
+    server = server_type()
+    identifiers = []
+    for i in range(logins):
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=i)
+        identifiers.append(identifier)
+
+    # time
+    started = time.perf_counter()
+    for identifier in identifiers[:logins // 2]:
+        server.get_token(identifier=identifier)
+    elapsed = time.perf_counter() - started
+
+    # memory
+    tracemalloc.start()
+    peak = 0
+    retained_before, _ = tracemalloc.get_traced_memory()
+    responses = []
+    for identifier in identifiers[logins // 2:]:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        responses.append(server.get_token(identifier=identifier))
+        _, call_peak = tracemalloc.get_traced_memory()
+        peak += call_peak - current
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    measured_logins = logins - logins // 2
+    return dict(
+        time=elapsed / (logins // 2) * 1e6,
+        allocated=peak / measured_logins,
+        retained=(retained - retained_before) / measured_logins)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--user-size', type=int, default=200,
+                        help='number of groups and permissions of the user')
+    parser.add_argument('--logins', type=int, default=2000)
+    args = parser.parse_args()
+
+    class BenchServer(SimpleAuthServer):
+        user_model = render_user_model(args.user_size)
+
+    current = measure(BenchServer, args.logins)
+    deep_copy = measure(deep_copy_server(BenchServer), args.logins)
+
+    print('{:<42} {:>10} {:>10} {:>10}'.format(
+        'get_token per login', 'current', 'deep copy', 'reduction'))
+    for name, title in (
+            ('time', 'time, us'),
+            ('allocated', 'allocated, bytes (peak during the call)'),
+            ('retained', 'retained, bytes (storage and response)')):
+        print('{:<42} {:>10.0f} {:>10.0f} {:>9.0f}%'.format(
+            title, current[name], deep_copy[name],
+            (1 - current[name] / deep_copy[name]) * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+Throughput and scaling of the full session lifecycle
+
+The storage is filled with live sessions (main, access and update
+entries of one login), then every iteration runs:
+get_identifier -> add_user_data -> get_token -> update_token ->
+get_identifier -> merge_main_tokens
+
+Reported per storage size and step: ops/sec, p50 and p99 latency, and
+memory per live session (RSS of the process, so Redis keeps its memory
+outside and shows ~0). An error response of a step stops the benchmark.
+
+Run from the root of the repository:
+python -m benchmarks.bench_lifecycle --backend dict --sizes 1000 100000
+python -m benchmarks.bench_lifecycle --backend sqlite --json sqlite.json
+
+Results of two commits are compared by the JSON files.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import uuid
+
+from simple_auth.core.server import SimpleAuthServer, DictSessionStorage, \
+    TTLSessionStorage, LockedSessionStorage, StripedSessionStorage, \
+    SessionEntry, SessionAction
+
+STEPS = ('get_identifier', 'add_user_data', 'get_token', 'update_token',
+         'merge_main_tokens')
+
+
+class BenchUser:
+    id: int = 1
+
+    def to_storage_dict(self):
+        return dict(id=self.id, name='User name', level=5, access=[1, 2, 3])
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+def storage_type_of(backend: str, directory: str, size: int,
+                    redis_host: str):
+    """
+    Session storage class of the backend
+
+    :param backend: name of the backend
+    :param directory: directory for files of the storage
+    :param size: number of live sessions
+    :param redis_host: host of Redis
+
+    :return: class
+    """
+    if backend == 'dict':
+        return DictSessionStorage
+    if backend == 'ttl':
+        return TTLSessionStorage
+    if backend == 'locked':
+        return LockedSessionStorage
+    if backend == 'striped':
+        return StripedSessionStorage
+    if backend == 'file':
+        from simple_auth.core.file_storage import FileSessionStorage
+
+        class BenchFileSessionStorage(FileSessionStorage):
+            path = os.path.join(directory, 'sessions_%s.log' % size)
+        return BenchFileSessionStorage
+    if backend == 'sqlite':
+        from simple_auth.core.sqlite_storage import SQLiteSessionStorage
+
+        class BenchSQLiteSessionStorage(SQLiteSessionStorage):
+            path = os.path.join(directory, 'sessions_%s.sqlite3' % size)
+        return BenchSQLiteSessionStorage
+    if backend == 'shm':
+        from simple_auth.core.shm_storage import SharedMemorySessionStorage
+
+        class BenchSharedMemorySessionStorage(SharedMemorySessionStorage):
+            name = 'simple_auth_bench_%s_%s' % (os.getpid(), size)
+            # 3 entries per session, the table is kept half empty
+            slot_count = max(65536, size * 6)
+        return BenchSharedMemorySessionStorage
+    if backend == 'redis':
+        from simple_auth.core.redis_storage import RedisSessionStorage
+
+        class BenchRedisSessionStorage(RedisSessionStorage):
+            host = redis_host
+            key_prefix = 'simple_auth_bench_%s:' % size
+        return BenchRedisSessionStorage
+    raise ValueError('Unknown backend {}'.format(backend))
+
+
+BACKENDS = ('dict', 'ttl', 'locked', 'striped', 'file', 'sqlite', 'shm',
+            'redis')
+
+
+def rss() -> int:
+    """
+    Resident memory of the process
+
+    :return: bytes
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # peak on systems without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def fill(storage, size: int):
+    """
+    Fill the storage with live sessions: main, access and update entries
+    sharing the user and the token like after get_token
+
+    :param storage: session storage
+    :param size: number of sessions
+
+    :return:
+    """
+    timestamp = int(time.time())
+    lock = getattr(storage, 'lock', None)
+    batch = 10000
+
+    for start in range(0, size, batch):
+        # one transaction per batch for the storages which can do it
+        with contextlib.nullcontext() if lock is None else lock():
+            for user_id in range(start, min(start + batch, size)):
+                main_token = str(uuid.uuid4())
+                user = BenchUser.get(user_id).to_storage_dict()
+                token = dict(
+                    access_token=str(uuid.uuid4()),
+                    update_token=str(uuid.uuid4()),
+                    expired_access_token=timestamp + 3600,
+                    expired_update_token=timestamp + 7200)
+                storage.set_trusted(main_token, SessionEntry(
+                    timestamp, timestamp + 7200, main_token,
+                    SessionAction.main))
+                storage.set_trusted(token['access_token'], SessionEntry(
+                    timestamp, timestamp + 3600, main_token,
+                    SessionAction.access, user, token))
+                storage.set_trusted(token['update_token'], SessionEntry(
+                    timestamp, timestamp + 7200, main_token,
+                    SessionAction.update, user, token))
+
+
+def percentile(values: list, fraction: float) -> float:
+    return values[int(fraction * (len(values) - 1))]
+
+
+def run(server, iterations: int) -> dict:
+    """
+    Run the lifecycle and measure every step
+
+    :param server: SimpleAuthServer
+    :param iterations: number of lifecycles
+
+    :return: step -> list of latencies in sec
+    """
+    clock = time.perf_counter
+    samples = {step: [] for step in STEPS}
+
+    def measure(step, method, **kwargs):
+        started = clock()
+        response = method(**kwargs)
+        samples[step].append(clock() - started)
+        if response['error']:
+            raise RuntimeError('{} failed: {}'.format(step, response['msg']))
+        return response
+
+    for i in range(iterations):
+        identifier = measure(
+            'get_identifier', server.get_identifier)['result']['identifier']
+        measure('add_user_data', server.add_user_data,
+                identifier=identifier, user_id=i)
+        token = measure('get_token', server.get_token,
+                        identifier=identifier)['result']['token']
+        # the old access token is consumed by update_token
+        token = measure('update_token', server.update_token,
+                        token=token)['result']['token']
+
+        identifier2 = server.get_identifier()['result']['identifier']
+        measure('merge_main_tokens', server.merge_main_tokens,
+                key1=token['access_token'], key2=identifier2)
+
+    return samples
+
+
+def summary(samples: list) -> dict:
+    latencies = sorted(samples)
+    total = sum(latencies)
+    return dict(
+        ops=len(latencies),
+        ops_per_sec=len(latencies) / total if total else None,
+        p50_us=percentile(latencies, 0.5) * 1e6,
+        p99_us=percentile(latencies, 0.99) * 1e6)
+
+
+def bench_size(backend: str, size: int, iterations: int, directory: str,
+               redis_host: str) -> dict:
+
+    class BenchServer(SimpleAuthServer):
+        session_storage_type = storage_type_of(
+            backend, directory, size, redis_host)
+        user_model = BenchUser
+
+    memory_before = rss()
+    server = BenchServer()
+    started = time.perf_counter()
+    fill(server.session_storage, size)
+    fill_seconds = time.perf_counter() - started
+    memory = rss() - memory_before
+
+    # warm up
+    run(server, min(iterations, 100))
+    samples = run(server, iterations)
+
+    lifecycle = sum(sum(samples[step]) for step in STEPS)
+    result = dict(
+        backend=backend,
+        size=size,
+        fill_seconds=fill_seconds,
+        memory_per_session=memory / size if size else None,
+        lifecycles_per_sec=iterations / lifecycle,
+        steps={step: summary(samples[step]) for step in STEPS})
+
+    storage = server.session_storage
+    for name in ('close', 'unlink'):
+        method = getattr(storage, name, None)
+        if method is not None:
+            method()
+    return result
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result: dict):
+    print('{backend} size={size} fill={fill_seconds:.1f}s '
+          'memory/session={memory_per_session:.0f}B '
+          'lifecycles/s={lifecycles_per_sec:.0f}'.format(**result))
+    for step, values in result['steps'].items():
+        print('  {:<18} {:>10.0f} ops/s  p50 {:>8.1f} us  p99 {:>8.1f} us'
+              .format(step, values['ops_per_sec'], values['p50_us'],
+                      values['p99_us']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backend', choices=BACKENDS, nargs='+',
+                        default=['dict'])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000],
+                        help='live sessions, up to 10000000')
+    parser.add_argument('--iterations', type=int, default=2000,
+                        help='lifecycles per size')
+    parser.add_argument('--redis-host', default='localhost')
+    parser.add_argument('--json', help='file for the results')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in args.backend:
+            for size in args.sizes:
+                result = bench_size(backend, size, args.iterations,
+                                    directory, args.redis_host)
+                print_result(result)
+                results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(dict(
+                commit=commit(),
+                python=platform.python_version(),
+                machine=platform.machine(),
+                iterations=args.iterations,
+                results=results), file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark of SQLiteSessionStorage against DictSessionStorage
+
+The storage is filled with live sessions, then logins run on top of it:
+get_identifier -> add_user_data -> get_token
+
+Run from the root of the repository:
+python -m benchmarks.bench_sqlite_storage --sizes 10000 1000000 10000000
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+import uuid
+
+from simple_auth.core.server import SimpleAuthServer, DictSessionStorage, \
+    SessionEntry, SessionAction
+from simple_auth.core.sqlite_storage import SQLiteSessionStorage
+
+
+class BenchUser:
+    id: int = 1
+
+    def to_storage_dict(self):
+        return dict(id=self.id, name='User name', level=5, access=[1, 2, 3])
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+def fill(storage, size: int):
+    """
+    Fill the storage with live access entries
+
+    :param storage: session storage
+    :param size: number of entries
+
+    :return:
+    """
+    timestamp = int(time.time())
+    user = BenchUser().to_storage_dict()
+    lock = getattr(storage, 'lock', None)
+    batch = 10000
+
+    for start in range(0, size, batch):
+        # one transaction per batch for the storages which can do it
+        with contextlib.nullcontext() if lock is None else lock():
+            for _ in range(start, min(start + batch, size)):
+                storage.set_trusted(str(uuid.uuid4()), SessionEntry(
+                    timestamp=timestamp,
+                    timestamp_expired=timestamp + 3600,
+                    main_token=str(uuid.uuid4()),
+                    action=SessionAction.access,
+                    user=user))
+
+
+def run(storage_type, size: int, logins: int) -> float:
+    """
+    Run logins on a filled storage
+
+    :param storage_type: session storage class
+    :param size: number of live sessions
+    :param logins: number of logins
+
+    :return: logins per second
+    """
+
+    class BenchServer(SimpleAuthServer):
+        session_storage_type = storage_type
+        user_model = BenchUser
+
+    server = BenchServer()
+    fill(server.session_storage, size)
+
+    started = time.perf_counter()
+    for i in range(logins):
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=i)
+        server.get_token(identifier=identifier)
+    elapsed = time.perf_counter() - started
+
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000])
+    parser.add_argument('--logins', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            class BenchSQLiteSessionStorage(SQLiteSessionStorage):
+                path = os.path.join(directory, 'sessions_%s.sqlite3' % size)
+
+            for name, storage_type in (
+                    ('dict', DictSessionStorage),
+                    ('sqlite', BenchSQLiteSessionStorage)):
+                rate = run(storage_type, size, args.logins)
+                print('{:<8} live={:<10} {:>10.0f} logins/s'.format(
+                    name, size, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Multi-thread benchmark of the session storages
+
+Every thread runs the full login:
+get_identifier -> add_user_data -> get_token -> update_token
+
+global_lock (LockedSessionStorage) takes one lock for every operation,
+striped (StripedSessionStorage) takes the locks of the shards. With
+CPython the global lock is faster at every number of threads.
+
+Run from the root of the repository:
+python -m benchmarks.bench_striped_storage --threads 1 2 4 8
+"""
+import argparse
+import threading
+import time
+
+from simple_auth.core.server import SimpleAuthServer, \
+    LockedSessionStorage, StripedSessionStorage
+
+
+class BenchUser:
+    id: int = 1
+
+    def to_storage_dict(self):
+        return dict(id=self.id, name='User name', level=5, access=[1, 2, 3])
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+STORAGES = {
+    'global_lock': LockedSessionStorage,
+    'striped': StripedSessionStorage,
+}
+
+
+def login(server: SimpleAuthServer, user_id: int):
+    identifier = server.get_identifier()['result']['identifier']
+    server.add_user_data(identifier=identifier, user_id=user_id)
+    token = server.get_token(identifier=identifier)['result']['token']
+    server.update_token(token=token)
+
+
+def run(storage_type, thread_count: int, logins: int) -> float:
+    """
+    Run logins in threads
+
+    :param storage_type: session storage class
+    :param thread_count: number of threads
+    :param logins: number of logins per thread
+
+    :return: logins per second
+    """
+
+    class BenchServer(SimpleAuthServer):
+        session_storage_type = storage_type
+        user_model = BenchUser
+
+    server = BenchServer()
+    barrier = threading.Barrier(thread_count + 1)
+
+    def worker(number):
+        barrier.wait()
+        for i in range(logins):
+            login(server, user_id=number * logins + i)
+
+    threads = [threading.Thread(target=worker, args=(number,))
+               for number in range(thread_count)]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return thread_count * logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument('--logins', type=int, default=2000,
+                        help='logins per thread')
+    parser.add_argument('--storage', choices=sorted(STORAGES),
+                        nargs='+', default=sorted(STORAGES))
+    args = parser.parse_args()
+
+    for name in args.storage:
+        for thread_count in args.threads:
+            rate = run(STORAGES[name], thread_count, args.logins)
+            print('{:<12} threads={:<3} {:>10.0f} logins/s'.format(
+                name, thread_count, rate))
+
+
+if __name__ == '__main__':
+    main()
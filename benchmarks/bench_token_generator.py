@@ -0,0 +1,78 @@
+"""
+Generators of identifiers and tokens
+
+Compares str(uuid.uuid4()) (the default of SimpleAuthServer) with
+BufferedUUIDTokenGenerator and URLSafeTokenGenerator: time per token
+and the cost of get_identifier + get_token of one login.
+
+Run from the root of the repository:
+python -m benchmarks.bench_token_generator --tokens 200000
+"""
+import argparse
+import timeit
+import uuid
+
+from simple_auth.core.server import SimpleAuthServer
+from simple_auth.core.token_generator import BufferedUUIDTokenGenerator, \
+    URLSafeTokenGenerator
+
+
+class BenchUser:
+    id: int = 1
+
+    def to_storage_dict(self):
+        return dict(id=self.id)
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+def uuid4_token() -> str:
+    return str(uuid.uuid4())
+
+
+GENERATORS = (
+    ('uuid4', None, uuid4_token),
+    ('buffered uuid4', BufferedUUIDTokenGenerator,
+     BufferedUUIDTokenGenerator()),
+    ('url-safe 22', URLSafeTokenGenerator, URLSafeTokenGenerator()),
+)
+
+
+def bench_logins(generator_type, logins: int) -> float:
+
+    class BenchServer(SimpleAuthServer):
+        user_model = BenchUser
+        token_generator_type = generator_type
+
+    server = BenchServer()
+
+    def login():
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=1)
+        server.get_token(identifier=identifier)
+
+    return min(timeit.repeat(login, number=logins, repeat=3)) / logins
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tokens', type=int, default=200000)
+    parser.add_argument('--logins', type=int, default=20000)
+    args = parser.parse_args()
+
+    print('{:<16} {:>12} {:>12} {:>8}'.format(
+        'generator', 'us/token', 'us/login', 'length'))
+    for name, generator_type, generator in GENERATORS:
+        per_token = min(timeit.repeat(
+            generator, number=args.tokens, repeat=3)) / args.tokens
+        per_login = bench_logins(generator_type, args.logins)
+        print('{:<16} {:>12.3f} {:>12.2f} {:>8}'.format(
+            name, per_token * 1e6, per_login * 1e6, len(generator())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Auth server as an ASGI application
+
+uvicorn examples.example_asgi_server:app --port 5011
+"""
+import json
+import urllib.parse
+
+from simple_auth.core.async_server import AsyncSimpleAuthServer
+from simple_auth.core.dispatcher import CommandDispatcher
+from simple_auth.core.rate_limit import TokenBucketRateLimiter
+
+
+class FakeSimpleAuthUser:
+    id: int = 11
+
+    @property
+    def is_simple_auth_user(self):
+        return True
+
+    def to_storage_dict(self):
+        return dict(
+            id=self.id,
+            name='User name',
+            level=5,
+            access=[1, 2, 3]
+        )
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+class SimpleAuthServer(AsyncSimpleAuthServer):
+    user_model = FakeSimpleAuthUser
+
+
+SERVER = SimpleAuthServer()
+DISPATCHER = CommandDispatcher(
+    SERVER, rate_limiter=TokenBucketRateLimiter())
+
+
+async def read_body(receive) -> bytes:
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_response(send, status: int, body: bytes = b'',
+                        headers: list = None):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers or [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def app(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+
+    server = SERVER
+
+    if scope['path'] == '/':
+        parameters = dict(urllib.parse.parse_qsl(
+            scope['query_string'].decode()))
+        response = await server.add_user_data(
+            identifier=parameters['identifier'],
+            user_id=11
+        )
+        print('index |', response)
+        await send_response(send, 302, headers=[
+            (b'location', parameters['redirect_url'].encode())])
+        return
+
+    if scope['path'] == '/api':
+        try:
+            parameters = json.loads(await read_body(receive))
+        except ValueError:
+            parameters = None
+        client = (scope.get('client') or (None,))[0]
+        result = await DISPATCHER.dispatch_async(parameters, client=client)
+        await send_response(send, 200, json.dumps(result).encode())
+        return
+
+    await send_response(send, 404, b'{}')
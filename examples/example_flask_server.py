@@ -1,6 +1,11 @@
 import flask
 
 from simple_auth.core.server import SimpleAuthServer
+from simple_auth.core.dispatcher import CommandDispatcher
+from simple_auth.core.cache import TTLCache
+from simple_auth.core.rate_limit import TokenBucketRateLimiter
+from simple_auth.core.metrics import MetricsRegistry, CONTENT_TYPE
+from simple_auth.core.shm_storage import SharedMemorySessionStorage
 
 app = flask.Flask(__name__)
 
@@ -31,9 +36,17 @@ class FakeSimpleAuthUser:
 
 class SimpleAuthServer(SimpleAuthServer):
     user_model = FakeSimpleAuthUser
+    # all workers of the host (e.g. gunicorn -w 4) share the sessions,
+    # the segment outlives recycled workers
+    session_storage_type = SharedMemorySessionStorage
+    # profiles of users are read once a minute
+    user_cache_type = TTLCache
+    metrics_type = MetricsRegistry
 
 
 SERVER = SimpleAuthServer()
+DISPATCHER = CommandDispatcher(
+    SERVER, rate_limiter=TokenBucketRateLimiter())
 
 
 @app.route('/')
@@ -52,14 +65,23 @@ def index():
 
 @app.route('/api', methods=['GET', 'POST'])
 def auth_user():
-    server = SERVER
-    parameters = flask.request.json
+    parameters = flask.request.get_json(silent=True)
     print('parameters :', parameters)
-    command = parameters.pop('command')
-    result = getattr(server, command)(**parameters)
+    result = DISPATCHER.dispatch(
+        parameters, client=flask.request.remote_addr)
     print('result :', result)
     return flask.jsonify(result)
 
 
+@app.route('/api/counters')
+def counters():
+    return flask.jsonify(DISPATCHER.counters())
+
+
+@app.route('/metrics')
+def metrics():
+    return flask.Response(SERVER.export_metrics(), content_type=CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     app.run(port=5011)
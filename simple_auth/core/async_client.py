@@ -0,0 +1,395 @@
+"""
+asyncio client side
+
+SimpleAuthAsyncClient has got the surface of SimpleAuthClient with
+coroutines. Requests go through a small HTTP/1.1 keep-alive connection
+pool on asyncio streams, so no additional packages are required
+(like the Redis protocol client of redis_storage).
+
+Pools are shared by all clients of the event loop: one pool per
+scheme, host and port, with max_connections connections at most.
+A cancelled request closes its connection, the pool stays consistent.
+"""
+import asyncio
+import json
+import ssl
+import urllib.parse
+import weakref
+
+from .base import BaseMixin
+from .circuit_breaker import get_circuit_breaker
+from .client import SimpleAuthClient, time_left
+
+
+class HTTPError(Exception):
+    """
+    Wrong answer of the HTTP server
+    """
+
+
+class _Connection:
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncHTTPConnectionPool:
+    """
+    Keep-alive connections to one HTTP server
+    """
+
+    def __init__(self, scheme: str, host: str, port: int,
+                 max_connections: int = 100):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self._idle = []
+        self._slots = asyncio.Semaphore(max_connections)
+        self.opened = 0
+
+    @property
+    def host_header(self) -> str:
+        default_port = 443 if self.scheme == 'https' else 80
+        if self.port == default_port:
+            return self.host
+        return '{}:{}'.format(self.host, self.port)
+
+    async def _connect(self) -> _Connection:
+        ssl_context = None
+        if self.scheme == 'https':
+            ssl_context = ssl.create_default_context()
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port, ssl=ssl_context)
+        self.opened += 1
+        return _Connection(reader, writer)
+
+    @staticmethod
+    async def _read_body(reader: asyncio.StreamReader, headers: dict):
+        """
+        Body of the response
+
+        :return: (body, the connection can be used again)
+        """
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(
+                    b';')[0], 16)
+                if size == 0:
+                    # trailers
+                    while await reader.readuntil(b'\r\n') != b'\r\n':
+                        pass
+                    return b''.join(chunks), True
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+
+        if 'content-length' in headers:
+            return await reader.readexactly(
+                int(headers['content-length'])), True
+
+        return await reader.read(), False
+
+    async def _exchange(self, connection: _Connection, request: bytes):
+        """
+        Send the request and read the response
+
+        :return: (status, body, the connection can be used again)
+        """
+        connection.writer.write(request)
+        await connection.writer.drain()
+
+        reader = connection.reader
+        status_line = await reader.readuntil(b'\r\n')
+        try:
+            version, status = status_line.split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise HTTPError('Wrong status line {!r}'.format(status_line))
+
+        headers = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        body, reusable = await self._read_body(reader, headers)
+        connection_header = headers.get('connection', '').lower()
+        if version == b'HTTP/1.1':
+            reusable = reusable and connection_header != 'close'
+        else:
+            reusable = reusable and connection_header == 'keep-alive'
+        return status, body, reusable
+
+    async def acquire(self):
+        """
+        Wait for a free connection, `send` requests with it and
+        `release` it then
+
+        :return:
+        """
+        await self._slots.acquire()
+
+    def release(self):
+        self._slots.release()
+
+    async def post(self, path: str, data: bytes,
+                   content_type: str = 'application/json',
+                   connect_timeout: float = None):
+        """
+        POST request, waits for a free connection
+
+        :param path: path with the query
+        :param data: body
+        :param content_type: content type of the body
+        :param connect_timeout: sec for a new connection, None - no limit
+
+        :return: (status, body)
+        """
+        async with self._slots:
+            return await self.send(path, data, content_type, connect_timeout)
+
+    async def send(self, path: str, data: bytes,
+                   content_type: str = 'application/json',
+                   connect_timeout: float = None):
+        """
+        POST request with the acquired connection (see `acquire`)
+
+        :param path: path with the query
+        :param data: body
+        :param content_type: content type of the body
+        :param connect_timeout: sec for a new connection, None - no limit
+
+        :return: (status, body)
+        """
+        request = (
+            'POST {} HTTP/1.1\r\n'
+            'Host: {}\r\n'
+            'Content-Type: {}\r\n'
+            'Content-Length: {}\r\n'
+            'Connection: keep-alive\r\n'
+            '\r\n'.format(path, self.host_header, content_type, len(data))
+        ).encode('latin-1') + data
+
+        while True:
+            reused = bool(self._idle)
+            if reused:
+                connection = self._idle.pop()
+            else:
+                connection = await asyncio.wait_for(
+                    self._connect(), connect_timeout)
+            try:
+                status, body, reusable = await self._exchange(
+                    connection, request)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                connection.close()
+                if reused:
+                    # the server has closed the idle connection
+                    continue
+                raise
+            except BaseException:
+                # cancelled or broken in the middle of the response
+                connection.close()
+                raise
+
+            if reusable:
+                self._idle.append(connection)
+            else:
+                connection.close()
+            return status, body
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+# event loop -> {(scheme, host, port, max_connections): pool}
+_pools = weakref.WeakKeyDictionary()
+
+
+def get_pool(url: str, max_connections: int) -> AsyncHTTPConnectionPool:
+    """
+    Shared pool of the running event loop
+
+    :param url: url of the server
+    :param max_connections: max number of connections to the server
+
+    :return: AsyncHTTPConnectionPool
+    """
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    key = (parts.scheme, parts.hostname, port, max_connections)
+
+    pools = _pools.setdefault(asyncio.get_running_loop(), {})
+    pool = pools.get(key)
+    if pool is None:
+        pool = pools[key] = AsyncHTTPConnectionPool(
+            parts.scheme, parts.hostname, port,
+            max_connections=max_connections)
+    return pool
+
+
+def close_pools():
+    """
+    Close idle connections of the pools of the running event loop
+
+    :return:
+    """
+    for pool in _pools.pop(asyncio.get_running_loop(), {}).values():
+        pool.close()
+
+
+class SimpleAuthAsyncClient(BaseMixin):
+    """
+    asyncio version of SimpleAuthClient
+
+    Coroutines of many tasks can run concurrently, a cancelled task
+    cancels its request. The deadline of the scope (client.deadline) is
+    per task.
+    """
+    # max number of connections to the auth server per event loop,
+    # other requests wait for a free connection
+    max_connections = 100
+
+    # sec, see SimpleAuthClient
+    connect_timeout = SimpleAuthClient.connect_timeout
+    read_timeout = SimpleAuthClient.read_timeout
+
+    breaker_failure_threshold = SimpleAuthClient.breaker_failure_threshold
+    breaker_recovery_timeout = SimpleAuthClient.breaker_recovery_timeout
+    validation_cache = None
+    validation_margin = SimpleAuthClient.validation_margin
+
+    get_auth_url = SimpleAuthClient.get_auth_url
+    verify_token = SimpleAuthClient.verify_token
+    is_available = SimpleAuthClient.is_available
+    is_valid_token = SimpleAuthClient.is_valid_token
+    is_valid_token_for_update = SimpleAuthClient.is_valid_token_for_update
+    invalidate_identifier = SimpleAuthClient.invalidate_identifier
+    _timeout = SimpleAuthClient._timeout
+    _is_cached_identifier = SimpleAuthClient._is_cached_identifier
+    _cache_identifier = SimpleAuthClient._cache_identifier
+
+    def __init__(self, url_server_auth: str, token=None,
+                 token_secret: (str, bytes) = None):
+        self.url_server_auth = url_server_auth
+        self.url_server_auth_api = url_server_auth + '/api'
+        self.token = token
+        self.token_secret = token_secret
+        self.circuit_breaker = get_circuit_breaker(
+            self.url_server_auth_api, self.breaker_failure_threshold,
+            self.breaker_recovery_timeout)
+
+        parts = urllib.parse.urlsplit(self.url_server_auth_api)
+        self._path = parts.path or '/'
+        if parts.query:
+            self._path += '?' + parts.query
+
+    async def request(self, **kwargs):
+        """
+        Data transfer method
+
+        :param kwargs: data transfer
+
+        :return:
+        """
+        if self._timeout() is None:
+            return self.format(error=True, msg='Deadline exceeded')
+        if not self.is_available():
+            # fail at once, not after the wait for a connection
+            return self.format(
+                error=True, msg='Auth server is unavailable')
+
+        # the wait for a free connection is local overload, it is
+        # limited by the deadline only and is not a failure of the server
+        pool = get_pool(self.url_server_auth_api, self.max_connections)
+        try:
+            await asyncio.wait_for(pool.acquire(), time_left())
+        except asyncio.TimeoutError:
+            return self.format(error=True, msg='Deadline exceeded')
+
+        try:
+            timeout = self._timeout()
+            if timeout is None:
+                return self.format(error=True, msg='Deadline exceeded')
+            connect_timeout, read_timeout = timeout
+
+            if not self.circuit_breaker.allow():
+                return self.format(
+                    error=True, msg='Auth server is unavailable')
+
+            try:
+                _, body = await asyncio.wait_for(
+                    pool.send(self._path, json.dumps(kwargs).encode(),
+                              connect_timeout=connect_timeout),
+                    connect_timeout + read_timeout)
+                data = json.loads(body)
+            except asyncio.CancelledError:
+                # the task is cancelled, the server is not to blame
+                self.circuit_breaker.cancel()
+                raise
+            except asyncio.TimeoutError:
+                remaining = time_left()
+                if remaining is not None and remaining <= 0:
+                    # the timeout has been cut by the deadline
+                    self.circuit_breaker.cancel()
+                    return self.format(
+                        error=True, msg='Deadline exceeded')
+                self.circuit_breaker.failure()
+            except Exception as e:
+                # no answer or not json (e.g. an error page of a proxy)
+                self.circuit_breaker.failure()
+            else:
+                self.circuit_breaker.success()
+                return data
+        finally:
+            pool.release()
+
+        return self.format(error=True, msg='Transfer data error')
+
+    async def get_identifier(self):
+        return await self.request(command='get_identifier')
+
+    async def get_token(self, identifier: str):
+        response = await self.request(
+            command='get_token', identifier=identifier)
+        if not response.get('error', True):
+            self.invalidate_identifier(identifier)
+        return response
+
+    async def update_token(self, token: dict):
+        return await self.request(command='update_token', token=token)
+
+    async def get_tokens(self, identifiers: list):
+        return await self.request(
+            command='get_tokens', identifiers=identifiers)
+
+    async def check_tokens(self, tokens: list):
+        return await self.request(command='check_tokens', tokens=tokens)
+
+    async def update_tokens(self, tokens: list):
+        return await self.request(command='update_tokens', tokens=tokens)
+
+    async def is_valid_identifier(self, identifier: str):
+        """
+        Check identifier
+
+        :param identifier:
+
+        :return:
+        """
+        if self._is_cached_identifier(identifier):
+            return True
+
+        response = await self.request(
+            command='check_identifier',
+            identifier=identifier
+        )
+        return self._cache_identifier(identifier, response)
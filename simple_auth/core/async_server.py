@@ -0,0 +1,615 @@
+"""
+asyncio server side
+
+AsyncSimpleAuthServer has got the same commands as SimpleAuthServer,
+they are coroutines over an async session storage, so one event loop
+serves many logins while the storage is waiting for the disk or the
+network.
+
+Async session storage protocol (all methods are coroutines):
+
+get(key) - SessionEntry or None
+set(key, value) - write SessionEntry built by the server
+delete(key) - remove the key, True if the key was there
+keys_of_main_token(main_token) - keys of the login lineage (optional)
+has_room(entries) - can the storage take the entries (optional)
+lock(*keys) - async context manager of a multi-step operation
+    (optional), may raise SessionStorageConflict to repeat the operation
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import time
+
+from .base import BaseMixin
+from .server import SimpleAuthServer, SimpleAuthUser, SessionEntry, \
+    SessionAction, SessionStorageConflict, DictSessionStorage
+from .signed_token import verify_token
+from .metrics import measured_async, describe_commands
+
+# (storage, executor) of the locked operation of this task
+_operation = contextvars.ContextVar('simple_auth_operation', default=None)
+
+
+class _KeyLocks:
+    """
+    asyncio locks of keys, a lock lives while somebody uses it
+    """
+
+    def __init__(self):
+        # key -> [lock, number of users]
+        self._locks = {}
+
+    @contextlib.asynccontextmanager
+    async def lock(self, *keys):
+        # the same order for all operations, no deadlocks
+        keys = sorted({key for key in keys if key is not None})
+        items = []
+        for key in keys:
+            item = self._locks.get(key)
+            if item is None:
+                item = self._locks[key] = [asyncio.Lock(), 0]
+            item[1] += 1
+            items.append((key, item))
+
+        acquired = []
+        try:
+            for _, item in items:
+                await item[0].acquire()
+                acquired.append(item[0])
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            for key, item in items:
+                item[1] -= 1
+                if item[1] == 0:
+                    del self._locks[key]
+
+
+class AsyncDictSessionStorage:
+    """
+    Async session storage in memory
+    """
+
+    def __init__(self):
+        self._data = DictSessionStorage()
+        self._key_locks = _KeyLocks()
+
+    def lock(self, *keys):
+        """
+        Lock the keys of a multi-step operation
+
+        :param keys: keys (None is ignored)
+
+        :return: async context manager
+        """
+        return self._key_locks.lock(*keys)
+
+    async def get(self, key: str):
+        value = self._data.get(key)
+        if value is None:
+            return None
+        return SessionEntry.from_value(value)
+
+    async def set(self, key: str, value: SessionEntry):
+        self._data.set_trusted(key, value)
+
+    async def delete(self, key: str) -> bool:
+        return self._data.pop(key, None) is not None
+
+    async def keys_of_main_token(self, main_token: str) -> set:
+        return self._data.keys_of_main_token(main_token)
+
+    def count_by_action(self) -> dict:
+        return self._data.count_by_action()
+
+    def __len__(self):
+        return len(self._data)
+
+
+async def _wait(future):
+    """
+    Result of a call in the thread of a locked operation
+
+    A cancelled task waits for the call as well, so the lock of the
+    storage is never left behind in the thread.
+
+    :param future: future of run_in_executor
+
+    :return: result of the call
+    """
+    cancelled = False
+    while not future.done():
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            cancelled = True
+        except BaseException:
+            pass
+    if cancelled:
+        raise asyncio.CancelledError()
+    return future.result()
+
+
+class AsyncSessionStorageAdapter:
+    """
+    Async interface of a synchronous session storage
+
+    Calls of the storage run in the default executor of the loop, so
+    a slow storage (SQLite, Redis, file) doesn't block the loop.
+
+    Multi-step operations use `lock` of the storage (SQLite transaction,
+    Redis WATCH/MULTI): the lock and all calls of the operation run in
+    one thread of the adapter, as the storages keep the transaction per
+    thread. Storages without `lock` are locked inside the process.
+
+    class SessionStorage(AsyncSessionStorageAdapter):
+        storage_type = SQLiteSessionStorage
+
+    class Server(AsyncSimpleAuthServer):
+        session_storage_type = SessionStorage
+    """
+    storage_type = DictSessionStorage
+    # threads for operations locked by the storage, the other
+    # operations wait for a thread
+    lock_threads = 16
+
+    def __init__(self, storage=None):
+        if storage is None:
+            storage = self.storage_type()
+        self.storage = storage
+        self._key_locks = _KeyLocks()
+        self._idle_executors = []
+        self._lock_threads = None
+
+    async def _run(self, function, *args):
+        operation = _operation.get()
+        if operation is not None and operation[0] is self.storage:
+            # inside the locked operation, in its thread
+            return await _wait(asyncio.get_running_loop().run_in_executor(
+                operation[1], function, *args))
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, function, *args)
+
+    def lock(self, *keys):
+        """
+        Lock the keys of a multi-step operation
+
+        :param keys: keys (None is ignored)
+
+        :return: async context manager
+        """
+        storage_lock = getattr(self.storage, 'lock', None)
+        if storage_lock is None:
+            return self._key_locks.lock(*keys)
+        return self._storage_lock(storage_lock, keys)
+
+    @contextlib.asynccontextmanager
+    async def _storage_lock(self, storage_lock, keys: tuple):
+        operation = _operation.get()
+        if operation is not None and operation[0] is self.storage:
+            # nested lock of the operation
+            yield
+            return
+
+        if self._lock_threads is None:
+            self._lock_threads = asyncio.Semaphore(self.lock_threads)
+
+        async with self._lock_threads:
+            if self._idle_executors:
+                executor = self._idle_executors.pop()
+            else:
+                executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix='AsyncSessionStorageAdapter')
+            token = _operation.set((self.storage, executor))
+            try:
+                async with self._in_thread(
+                        executor, storage_lock(*keys)):
+                    yield
+            finally:
+                _operation.reset(token)
+                self._idle_executors.append(executor)
+
+    @staticmethod
+    @contextlib.asynccontextmanager
+    async def _in_thread(executor, manager):
+        """
+        Enter and exit the context manager in the thread of the executor
+
+        :param executor: executor with one thread
+        :param manager: context manager
+
+        :return: async context manager
+        """
+        loop = asyncio.get_running_loop()
+        entered = loop.run_in_executor(executor, manager.__enter__)
+        try:
+            await _wait(entered)
+        except BaseException as exc:
+            if entered.done() and entered.exception() is None:
+                # the task has been cancelled, the lock has been taken
+                await _wait(loop.run_in_executor(
+                    executor, manager.__exit__, type(exc), exc,
+                    exc.__traceback__))
+            raise
+
+        try:
+            yield
+        except BaseException as exc:
+            if not await _wait(loop.run_in_executor(
+                    executor, manager.__exit__, type(exc), exc,
+                    exc.__traceback__)):
+                raise
+        else:
+            await _wait(loop.run_in_executor(
+                executor, manager.__exit__, None, None, None))
+
+    async def get(self, key: str):
+        value = await self._run(self.storage.get, key)
+        if value is None:
+            return None
+        return SessionEntry.from_value(value)
+
+    async def set(self, key: str, value: SessionEntry):
+        set_trusted = getattr(self.storage, 'set_trusted', None)
+        if set_trusted is None:
+            await self._run(self.storage.__setitem__, key, value)
+        else:
+            await self._run(set_trusted, key, value)
+
+    async def delete(self, key: str) -> bool:
+        return await self._run(self.storage.pop, key, None) is not None
+
+    async def has_room(self, entries: list) -> bool:
+        has_room = getattr(self.storage, 'has_room', None)
+        if has_room is None:
+            return True
+        return await self._run(has_room, entries)
+
+    async def keys_of_main_token(self, main_token: str) -> set:
+        keys_of_main_token = getattr(
+            self.storage, 'keys_of_main_token', None)
+        if keys_of_main_token is not None:
+            return await self._run(keys_of_main_token, main_token)
+
+        def scan():
+            return {key for key, value in list(self.storage.items())
+                    if SessionEntry.from_value(value).main_token ==
+                    main_token}
+
+        return await self._run(scan)
+
+
+class AsyncSimpleAuthServer(BaseMixin):
+    """
+    asyncio version of SimpleAuthServer
+
+    Responses are the same as the responses of SimpleAuthServer
+    """
+    session_storage_type = AsyncDictSessionStorage
+    # sec
+    expired_access_token_delta = 30
+    expired_update_token_delta = 60
+    expired_identifier_delta = 45
+    time_delta = 1
+    # see SimpleAuthServer.token_secret
+    token_secret = None
+
+    user_model = SimpleAuthUser
+    # see SimpleAuthServer.user_cache_type
+    user_cache_type = None
+    user_cache_size = 10000
+    user_cache_ttl = 60
+    # see SimpleAuthServer.token_generator_type
+    token_generator_type = None
+    # see SimpleAuthServer.metrics_type
+    metrics_type = None
+
+    _new_token = SimpleAuthServer._new_token
+    render_token = SimpleAuthServer.render_token
+    _main_entry = staticmethod(SimpleAuthServer._main_entry)
+    _token_entries = SimpleAuthServer._token_entries
+    _user_detail = SimpleAuthServer._user_detail
+    invalidate_user = SimpleAuthServer.invalidate_user
+    user_cache_stats = SimpleAuthServer.user_cache_stats
+    export_metrics = SimpleAuthServer.export_metrics
+
+    def __init__(self):
+        self.session_storage = self.session_storage_type()
+        self.user_cache = None
+        if self.user_cache_type is not None:
+            self.user_cache = self.user_cache_type(
+                maxsize=self.user_cache_size, ttl=self.user_cache_ttl)
+        self.token_generator = None
+        if self.token_generator_type is not None:
+            self.token_generator = self.token_generator_type()
+        self.metrics = None
+        if self.metrics_type is not None:
+            self.metrics = self.metrics_type()
+            describe_commands(self.metrics)
+            self.metrics.add_collector(self._collect_storage_metrics)
+
+    def _collect_storage_metrics(self) -> list:
+        storage = self.session_storage
+        count_by_action = getattr(storage, 'count_by_action', None)
+        if count_by_action is None:
+            return []
+        return [('simple_auth_storage_entries', 'gauge',
+                 'Entries of the session storage by action',
+                 {(('action', action),): count
+                  for action, count in count_by_action().items()})]
+
+    def _lock(self, *keys):
+        """
+        Lock the keys of a multi-step operation if the storage can do it
+
+        :param keys: keys
+
+        :return: async context manager
+        """
+        lock = getattr(self.session_storage, 'lock', None)
+        if lock is None:
+            return contextlib.nullcontext()
+        return lock(*keys)
+
+    async def _has_room(self, entries: list) -> bool:
+        """
+        See SimpleAuthServer._has_room
+
+        :param entries: list of (key, SessionEntry)
+
+        :return: bool
+        """
+        has_room = getattr(self.session_storage, 'has_room', None)
+        return has_room is None or await has_room(entries)
+
+    @measured_async('get_identifier')
+    async def get_identifier(self):
+        identifier = self._new_token()
+        timestamp = int(time.time())
+
+        await self.session_storage.set(identifier, SessionEntry(
+            timestamp=timestamp,
+            timestamp_expired=(timestamp + self.expired_identifier_delta),
+            main_token=self._new_token(),
+            action=SessionAction.identifier
+        ))
+
+        return self.format(result=dict(identifier=identifier))
+
+    @measured_async('add_user_data')
+    async def add_user_data(self, identifier: str, user_id: (int, str)):
+        # the user model is synchronous (database, ORM)
+        user_detail = await asyncio.get_running_loop().run_in_executor(
+            None, self._user_detail, user_id)
+
+        async with self._lock(identifier):
+            entry = await self.session_storage.get(identifier)
+            if entry is not None:
+                entry.user = user_detail
+                if not await self._has_room([(identifier, entry)]):
+                    return self.format(
+                        error=True, msg='The session storage is full')
+                await self.session_storage.set(identifier, entry)
+                return self.format()
+        return self.format(error=True, msg="The identifier is wrong")
+
+    async def _lineage_locked(self, key: str, method):
+        """
+        See SimpleAuthServer._lineage_locked
+
+        :param key: identifier or token
+        :param method: coroutine method of the key
+
+        :return: response of the method
+        """
+        while True:
+            record = await self.session_storage.get(key)
+            main_token = None if record is None else record.main_token
+
+            try:
+                async with self._lock(key, main_token):
+                    record = await self.session_storage.get(key)
+                    # main token has been changed by merge_main_tokens
+                    if record is None or record.main_token == main_token:
+                        return await method(key)
+            except SessionStorageConflict:
+                continue
+
+    @measured_async('get_token')
+    async def get_token(self, identifier: str):
+        """
+        Get token and information about user
+
+        :param identifier:
+
+        :return:
+        """
+        return await self._lineage_locked(identifier, self.__get_token)
+
+    async def __get_token(self, identifier: str):
+        response = await self.check_identifier(identifier=identifier)
+        if response.get('error', True):
+            return response
+
+        record = await self.session_storage.get(identifier)
+        if record.user is None:
+            return self.format(
+                error=True, msg="Have no information about user")
+
+        return await self._issue_token(record, [identifier])
+
+    async def _issue_token(self, record: SessionEntry, used_keys: list):
+        """
+        See SimpleAuthServer._issue_token
+
+        :param record: entry of the login (identifier or update token)
+        :param used_keys: keys which are consumed by the new tokens
+
+        :return: response
+        """
+        storage = self.session_storage
+        access_record, entries = self._token_entries(
+            record, await storage.get(record.main_token))
+
+        if not await self._has_room(entries):
+            return self.format(
+                error=True, msg='The session storage is full')
+
+        for key in used_keys:
+            await storage.delete(key)
+        for key, entry in entries:
+            await storage.set(key, entry)
+
+        return self.format(result=access_record.to_response())
+
+    @measured_async('check_key')
+    async def check_key(self, key: str):
+        """
+        Check key
+
+        :param key: string
+
+        :return:
+        """
+
+        entry = await self.session_storage.get(key)
+        if entry is None:
+            return self.format(error=True, msg="The key is wrong")
+
+        current_time = int(time.time())
+        timestamp_expired = entry.timestamp_expired
+        if timestamp_expired is None:
+            timestamp_expired = current_time - 1
+        if timestamp_expired - current_time < self.time_delta:
+            return self.format(
+                error=True, msg="This key has expired")
+
+        return self.format(result=dict(key=key))
+
+    @measured_async('check_identifier')
+    async def check_identifier(self, identifier: str):
+        """
+        Check identifier
+
+        :param identifier: string
+
+        :return:
+        """
+        response = await self.check_key(key=identifier)
+        if response.get('error', True):
+            response['msg'] = response.get('msg', '').replace(
+                'The key', 'The identifier')
+            return response
+
+        entry = await self.session_storage.get(identifier)
+        if entry is None or entry.action != SessionAction.identifier:
+            return self.format(error=True, msg="The identifier is wrong")
+
+        return self.format(result=dict(
+            identifier=identifier,
+            expired_identifier=entry.timestamp_expired))
+
+    @measured_async('check_token')
+    async def check_token(self, token: dict):
+        if self.token_secret is not None:
+            # signed access token, the storage is not used
+            claims = verify_token(
+                self.token_secret, token.get('access_token'))
+            if claims is None:
+                return self.format(
+                    error=True, msg='Access token have n\'t found')
+            return self.format(result=claims)
+
+        entry = await self.session_storage.get(token.get('access_token'))
+        if entry is not None and entry.user is not None:
+            return self.format()
+        return self.format(error=True, msg='Access token have n\'t found')
+
+    @measured_async('update_token')
+    async def update_token(self, token: dict):
+        """
+        See SimpleAuthServer.update_token
+
+        :param token: token with update_token
+
+        :return: the same response as get_token
+        """
+        return await self._lineage_locked(
+            token.get('update_token'), self.__update_token)
+
+    async def __update_token(self, update_token: str):
+        response = await self.check_key(key=update_token)
+        if response.get('error', True):
+            response['msg'] = response.get('msg', '').replace(
+                'The key', 'The update token')
+            return response
+
+        record = await self.session_storage.get(update_token)
+        if record.action != SessionAction.update:
+            return self.format(error=True, msg="The update token is wrong")
+
+        used_keys = [update_token]
+        access_token = (record.token or {}).get('access_token')
+        if self.token_secret is None and access_token is not None:
+            used_keys.append(access_token)
+        return await self._issue_token(record, used_keys)
+
+    @measured_async('revoke_main_token')
+    async def revoke_main_token(self, main_token: str):
+        """
+        Remove the login lineage: the main token, its identifiers,
+        access and update tokens
+
+        :param main_token: main token
+
+        :return:
+        """
+        storage = self.session_storage
+        while True:
+            keys = await storage.keys_of_main_token(main_token)
+            try:
+                async with self._lock(main_token, *keys):
+                    removed = 0
+                    for key in keys:
+                        entry = await storage.get(key)
+                        if entry is not None and \
+                                entry.main_token == main_token:
+                            await storage.delete(key)
+                            removed += 1
+                    return self.format(result=dict(removed=removed))
+            except SessionStorageConflict:
+                continue
+
+    @measured_async('merge_main_tokens')
+    async def merge_main_tokens(self, key1: str, key2: str):
+
+        while True:
+            try:
+                async with self._lock(key1, key2):
+                    return await self.__merge_main_tokens(key1, key2)
+            except SessionStorageConflict:
+                continue
+
+    async def __merge_main_tokens(self, key1: str, key2: str):
+        response = await self.check_key(key1)
+        if response.get('error', True):
+            response['msg'] = response.get('msg', '').replace(
+                'The key', 'The key1')
+            return response
+
+        response = await self.check_key(key2)
+        if response.get('error', True):
+            response['msg'] = response.get('msg', '').replace(
+                'The key', 'The key2')
+            return response
+
+        main_token = (await self.session_storage.get(key1)).main_token
+        entry = await self.session_storage.get(key2)
+        entry.main_token = main_token
+        await self.session_storage.set(key2, entry)
+
+        return self.format()
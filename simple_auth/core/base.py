@@ -1,6 +1,3 @@
-import copy
-
-
 class BaseMixin:
     """
     Base mixin
@@ -15,10 +12,11 @@ class BaseMixin:
         :param error: has error or not
         :param msg: message (usually using for error description )
         :param result: request result
-        :param kwargs: additional arguments
+        :param kwargs: additional arguments (not copied, the response
+            refers to the same objects)
         :return:
         """
-        response = copy.deepcopy(kwargs)
+        response = dict(kwargs)
         response.update({
             'result': result,
             'error': error,
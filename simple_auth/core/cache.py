@@ -0,0 +1,94 @@
+"""
+Cache with TTL and LRU eviction
+
+Used by the server for profiles of users (user_model.get and
+to_storage_dict), so a login of a known user doesn't query the database,
+and by the client for answers of the auth server.
+"""
+import collections
+import threading
+import time
+
+
+class TTLCache:
+    """
+    Thread-safe cache: an item lives `ttl` seconds, the least recently
+    used item is removed when the cache has got `maxsize` items
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (time of expiry, value), the last is the most recent
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Value of the key
+
+        :param key: key
+        :param default: value if the key is missed or expired
+
+        :return: value
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None):
+        """
+        Add the value
+
+        :param key: key
+        :param value: value
+        :param ttl: sec, shorter life of the item (not longer than
+            the ttl of the cache)
+
+        :return:
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key) -> bool:
+        """
+        Remove the key
+
+        :param key: key
+
+        :return: True if the key was in the cache
+        """
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        Counters of the cache
+
+        :return: dict(hits, misses, evictions, size)
+        """
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        evictions=self.evictions, size=len(self._data))
+
+    def __len__(self):
+        return len(self._data)
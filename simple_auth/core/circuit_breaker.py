@@ -0,0 +1,108 @@
+"""
+Circuit breaker of requests to the auth server
+
+closed - requests go to the server, consecutive failures are counted
+open - after failure_threshold failures requests fail at once
+    for recovery_timeout seconds
+half-open - then one request probes the server: success closes
+    the breaker, failure opens it again
+"""
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+clock = time.monotonic
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker
+    """
+
+    def __init__(self, failure_threshold: int = 5,
+                 recovery_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Can a request go to the server
+
+        :return: bool
+        """
+        if self.state == CLOSED:
+            return True
+
+        with self._lock:
+            if self.state == OPEN and \
+                    clock() - self._opened_at >= self.recovery_timeout:
+                # this request is the probe, others wait for its result
+                self.state = HALF_OPEN
+                return True
+            return self.state == CLOSED
+
+    def success(self):
+        if self.state == CLOSED and self.failures == 0:
+            return
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self._opened_at = clock()
+
+    def cancel(self):
+        """
+        The request has been cancelled without an answer: not a failure,
+        but the probe of the half-open breaker goes to the next request
+
+        :return:
+        """
+        if self.state != HALF_OPEN:
+            return
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+                self._opened_at = clock() - self.recovery_timeout
+
+
+# url -> CircuitBreaker, shared by all clients of the process
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url: str, failure_threshold: int,
+                        recovery_timeout: float) -> CircuitBreaker:
+    """
+    Shared circuit breaker of the url
+
+    :param url: url of the server
+    :param failure_threshold: failures to open the breaker
+    :param recovery_timeout: sec before the probe
+
+    :return: CircuitBreaker
+    """
+    breaker = _breakers.get(url)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(url, CircuitBreaker(
+                failure_threshold=failure_threshold,
+                recovery_timeout=recovery_timeout))
+    return breaker
+
+
+def reset_circuit_breakers():
+    with _breakers_lock:
+        _breakers.clear()
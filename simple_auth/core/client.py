@@ -8,22 +8,238 @@ response_type=
 state=
 """
 import requests
+import contextlib
+import contextvars
+import http.cookiejar
 import json
+import os
+import threading
 import urllib
 import time
 
 from .base import BaseMixin
+from .circuit_breaker import get_circuit_breaker
+from .signed_token import verify_token
+
+clock = time.monotonic
+
+# clock() time by which requests of the current scope have to finish
+_deadline = contextvars.ContextVar('simple_auth_deadline', default=None)
+
+
+@contextlib.contextmanager
+def deadline_at(timestamp: float):
+    """
+    Requests to the auth server in the scope have to finish by the time
+
+    Scopes are per thread and per asyncio task, a nested scope keeps
+    the earlier deadline.
+
+    :param timestamp: clock() time, None - no deadline
+
+    :return: context manager, the value is the deadline of the scope
+    """
+    current = _deadline.get()
+    if timestamp is None or (current is not None and current < timestamp):
+        timestamp = current
+    token = _deadline.set(timestamp)
+    try:
+        yield timestamp
+    finally:
+        _deadline.reset(token)
+
+
+def time_left():
+    """
+    Time left to the deadline of the scope
+
+    :return: sec or None if the scope has got no deadline
+    """
+    timestamp = _deadline.get()
+    if timestamp is None:
+        return None
+    return timestamp - clock()
+
+
+def deadline(budget: float):
+    """
+    Budget of all requests to the auth server in the scope (e.g. of one
+    page): timeouts are cut to the remaining time, once the budget is
+    spent requests fail with 'Deadline exceeded' without a network call
+
+    with deadline(0.5):
+        response = client.get_token(identifier=identifier)
+
+    :param budget: sec, None - no budget
+
+    :return: context manager
+    """
+    return deadline_at(None if budget is None else clock() + budget)
+
+
+# (pool_connections, pool_maxsize, pool_block) -> requests.Session,
+# sessions are shared by all clients of the process
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(pool_connections: int, pool_maxsize: int,
+                pool_block: bool) -> requests.Session:
+    """
+    Shared session with keep-alive connections
+
+    :param pool_connections: number of hosts with kept connections
+    :param pool_maxsize: max number of kept connections to one host
+    :param pool_block: wait for a free connection instead of opening
+        a connection which is not kept
+
+    The session is shared by all users of the process, so it doesn't
+    keep cookies: a cookie of one request would be sent with requests
+    of the others.
+
+    :return: requests.Session
+    """
+    key = (pool_connections, pool_maxsize, pool_block)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            # cookies of responses are not kept for any domain
+            session.cookies.set_policy(
+                http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize, pool_block=pool_block)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+    return session
+
+
+def close_sessions():
+    """
+    Close the shared sessions and their connections
+
+    :return:
+    """
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+class _Flight:
+    """
+    Request in progress, other threads wait for its response; the
+    response of the completed request is shared until `expires_at`
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        # clock() time, None - the flight is in progress
+        self.expires_at = None
+
+    def wait(self):
+        self.done.wait()
+
+
+# (url, update token) -> _Flight of update_token
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _drop_expired_flights():
+    # under _flights_lock: completed flights after their grace period
+    current = clock()
+    for key, flight in list(_flights.items()):
+        if flight.expires_at is not None and flight.expires_at <= current:
+            del _flights[key]
+
+
+def _reset_after_fork():
+    # connections and requests of the parent are not used by
+    # forked workers
+    _sessions.clear()
+    _flights.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 class SimpleAuthClient(BaseMixin):
     """
     Class for auth
-    """
 
-    def __init__(self, url_server_auth: str, token=None):
+    Requests go through a session shared by all clients of the process,
+    connections to the auth server are kept alive.
+    """
+    # number of hosts with kept connections
+    pool_connections = 10
+    # max number of kept connections to one host (threads of the app)
+    pool_maxsize = 10
+    # wait for a free connection when pool_maxsize connections are busy
+    pool_block = False
+
+    # sec
+    connect_timeout = 3.05
+    read_timeout = 10
+
+    # consecutive failures which open the circuit breaker
+    breaker_failure_threshold = 5
+    # sec, requests fail at once, then one request probes the server
+    breaker_recovery_timeout = 30
+
+    # TTLCache of identifiers checked by the server, shared by the
+    # clients of all auth servers; an answer lives until the expiry of
+    # the identifier minus the margin at most. None - every check is
+    # a request
+    validation_cache = None
+    # sec, the server rejects an identifier time_delta sec before its
+    # expiry, keep it in sync with time_delta of the server
+    validation_margin = 1
+    # sec, a call with the update token which has just been used gets
+    # the new token of that update (until the new access token expires)
+    update_token_grace = 5
+
+    def __init__(self, url_server_auth: str, token=None,
+                 token_secret: (str, bytes) = None):
         self.url_server_auth = url_server_auth
         self.url_server_auth_api = url_server_auth + '/api'
         self.token = token
+        # token_secret of the server for signed access tokens
+        self.token_secret = token_secret
+        self.circuit_breaker = get_circuit_breaker(
+            self.url_server_auth_api, self.breaker_failure_threshold,
+            self.breaker_recovery_timeout)
+
+    def is_available(self) -> bool:
+        """
+        The circuit breaker of the auth server is not open
+
+        :return: bool
+        """
+        return self.circuit_breaker.state != 'open'
+
+    def _timeout(self):
+        """
+        (connect, read) timeouts limited by the deadline of the scope
+
+        :return: tuple or None if the deadline has passed
+        """
+        remaining = time_left()
+        if remaining is None:
+            return self.connect_timeout, self.read_timeout
+        if remaining <= 0:
+            return None
+        return (min(self.connect_timeout, remaining),
+                min(self.read_timeout, remaining))
 
     def request(self, **kwargs):
         """
@@ -34,12 +250,31 @@ class SimpleAuthClient(BaseMixin):
         :return:
         """
 
+        timeout = self._timeout()
+        if timeout is None:
+            return self.format(error=True, msg='Deadline exceeded')
+
+        if not self.circuit_breaker.allow():
+            return self.format(
+                error=True, msg='Auth server is unavailable')
+
         try:
-            response = requests.post(url=self.url_server_auth_api, json=kwargs)
+            session = get_session(
+                self.pool_connections, self.pool_maxsize, self.pool_block)
+            response = session.post(
+                url=self.url_server_auth_api, json=kwargs, timeout=timeout)
             data = json.loads(response.text)
-            return data
         except Exception as e:
-            pass
+            remaining = time_left()
+            if remaining is not None and remaining <= 0:
+                # the timeout has been cut by the deadline
+                self.circuit_breaker.cancel()
+                return self.format(error=True, msg='Deadline exceeded')
+            # no answer or not json (e.g. an error page of a proxy)
+            self.circuit_breaker.failure()
+        else:
+            self.circuit_breaker.success()
+            return data
 
         return self.format(error=True, msg='Transfer data error')
 
@@ -69,12 +304,124 @@ class SimpleAuthClient(BaseMixin):
             identifier=identifier
         )
 
+        if not response.get('error', True):
+            # the identifier has been redeemed
+            self.invalidate_identifier(identifier)
+
         return response
 
     def update_token(self, token: dict):
+        """
+        Update the token
+
+        The update token can be used once, so concurrent calls with
+        the same update token make one request and share its response,
+        calls within update_token_grace sec after it get the response
+        as well
+
+        :param token: token
+
+        :return: response, the same object for the concurrent calls
+        """
+        update_token = token.get('update_token') \
+            if isinstance(token, dict) else None
+        if not isinstance(update_token, str):
+            return self.request(command='update_token', token=token)
+
+        key = (self.url_server_auth_api, update_token)
+        with _flights_lock:
+            flight = _flights.get(key)
+            if flight is not None and flight.expires_at is not None:
+                if flight.expires_at > clock():
+                    # the update token has just been used
+                    return flight.response
+                flight = None
+            is_leader = flight is None
+            if is_leader:
+                _drop_expired_flights()
+                flight = _flights[key] = _Flight()
+
+        if not is_leader:
+            flight.wait()
+            if flight.response is None:
+                # the request of the leader has raised
+                return self.format(error=True, msg='Transfer data error')
+            return flight.response
+
+        grace = 0
+        try:
+            flight.response = self.request(
+                command='update_token',
+                token=token
+            )
+            grace = self._update_grace(flight.response)
+        finally:
+            with _flights_lock:
+                if grace > 0:
+                    flight.expires_at = clock() + grace
+                else:
+                    del _flights[key]
+            flight.done.set()
+
+        return flight.response
+
+    def _update_grace(self, response: dict) -> float:
+        """
+        How long the response of update_token is shared with the calls
+        which come with the used update token
+
+        :param response: response of update_token
+
+        :return: sec, 0 - the response is not shared
+        """
+        if response.get('error', True):
+            return 0
+        try:
+            expired = response['result']['token']['expired_access_token']
+            return min(self.update_token_grace, expired - time.time())
+        except (KeyError, TypeError):
+            return 0
+
+    def get_tokens(self, identifiers: list):
+        """
+        Get tokens for many identifiers in one request
+
+        :param identifiers: list of identifiers
+
+        :return: response, result is the list of responses for every
+            identifier
+        """
+        response = self.request(
+            command='get_tokens',
+            identifiers=identifiers
+        )
+        return response
+
+    def check_tokens(self, tokens: list):
+        """
+        Check many tokens in one request
+
+        :param tokens: list of tokens
+
+        :return: response, result is the list of responses for every token
+        """
+        response = self.request(
+            command='check_tokens',
+            tokens=tokens
+        )
+        return response
+
+    def update_tokens(self, tokens: list):
+        """
+        Update many tokens in one request
+
+        :param tokens: list of tokens
+
+        :return: response, result is the list of responses for every token
+        """
         response = self.request(
-            command='update_token',
-            token=token
+            command='update_tokens',
+            tokens=tokens
         )
         return response
 
@@ -87,12 +434,56 @@ class SimpleAuthClient(BaseMixin):
         :return:
         """
 
+        if self._is_cached_identifier(identifier):
+            return True
+
         response = self.request(
             command='check_identifier',
             identifier=identifier
         )
 
-        return not response.get('error', True)
+        return self._cache_identifier(identifier, response)
+
+    def _is_cached_identifier(self, identifier: str) -> bool:
+        cache = self.validation_cache
+        return cache is not None and bool(
+            cache.get((self.url_server_auth_api, identifier)))
+
+    def _cache_identifier(self, identifier: str, response: dict) -> bool:
+        """
+        Keep the positive answer of check_identifier until the server
+        rejects the identifier (its expiry minus validation_margin)
+
+        :param identifier:
+        :param response: response of check_identifier
+
+        :return: the identifier is valid
+        """
+        is_valid = not response.get('error', True)
+        if is_valid and self.validation_cache is not None:
+            expired = (response.get('result') or {}).get(
+                'expired_identifier')
+            if expired is not None:
+                ttl = expired - self.validation_margin - time.time()
+                if ttl > 0:
+                    self.validation_cache.set(
+                        (self.url_server_auth_api, identifier), True,
+                        ttl=ttl)
+        return is_valid
+
+    def invalidate_identifier(self, identifier: str) -> bool:
+        """
+        Remove the answer of the server about the identifier from
+        the validation cache
+
+        :param identifier:
+
+        :return: True if the answer was in the cache
+        """
+        if self.validation_cache is None:
+            return False
+        return self.validation_cache.invalidate(
+            (self.url_server_auth_api, identifier))
 
     @staticmethod
     def is_valid_token(token: dict):
@@ -116,6 +507,22 @@ class SimpleAuthClient(BaseMixin):
 
         return True
 
+    def verify_token(self, token: dict):
+        """
+        Check the signed access token without request to the server
+
+        :param token: token
+
+        :return: claims of the token (user_id, exp, main_token) or None
+        """
+        if self.token_secret is None:
+            raise ValueError('token_secret of the client is not set')
+
+        if not isinstance(token, dict):
+            token = dict()
+
+        return verify_token(self.token_secret, token.get('access_token'))
+
     @staticmethod
     def is_valid_token_for_update(token: dict):
         """
@@ -0,0 +1,168 @@
+"""
+Dispatcher of the commands of the `/api` endpoint
+
+The routing table (command -> method of the server and the schema of its
+parameters) is built once, so a wrong request is rejected by one dict
+lookup and the schema check, before the server touches the storage.
+
+dispatcher = CommandDispatcher(server)
+
+@app.route('/api', methods=['POST'])
+def api():
+    return flask.jsonify(dispatcher.dispatch(flask.request.json))
+"""
+import threading
+
+import schema
+
+from .base import BaseMixin
+
+
+class CommandRejected(Exception):
+    """
+    The request is rejected by the dispatcher
+    """
+
+    def __init__(self, response: dict):
+        super().__init__(response.get('msg'))
+        self.response = response
+
+
+# tokens of check_token and update_token, the other items of the token
+# of the client are passed as they are
+ACCESS_TOKEN = {'access_token': str, schema.Optional(str): object}
+UPDATE_TOKEN = {'update_token': str, schema.Optional(str): object}
+
+
+class CommandDispatcher(BaseMixin):
+    """
+    Allow-list of the commands with validators of parameters
+    and counters of calls
+    """
+    # command -> parameters
+    commands = {
+        'get_identifier': {},
+        'check_identifier': {'identifier': str},
+        'get_token': {'identifier': str},
+        'check_token': {'token': ACCESS_TOKEN},
+        'update_token': {'token': UPDATE_TOKEN},
+        'get_tokens': {'identifiers': [str]},
+        'check_tokens': {'tokens': [ACCESS_TOKEN]},
+        'update_tokens': {'tokens': [UPDATE_TOKEN]},
+        'merge_main_tokens': {'key1': str, 'key2': str},
+        'revoke_main_token': {'main_token': str},
+    }
+
+    def __init__(self, server, rate_limiter=None):
+        """
+        :param server: SimpleAuthServer or AsyncSimpleAuthServer
+        :param rate_limiter: e.g. TokenBucketRateLimiter, None - no limit
+        """
+        self.server = server
+        self.rate_limiter = rate_limiter
+        # command -> (method of the server, schema of parameters),
+        # commands missed in the server are not routed
+        self.routes = {
+            command: (getattr(server, command), schema.Schema(parameters))
+            for command, parameters in self.commands.items()
+            if hasattr(server, command)}
+
+        self._lock = threading.Lock()
+        self._counters = {
+            command: dict(calls=0, errors=0, rejected=0, limited=0)
+            for command in self.routes}
+        self._unknown = 0
+
+    def _count(self, command: str, counter: str):
+        with self._lock:
+            if command is None:
+                self._unknown += 1
+            else:
+                self._counters[command][counter] += 1
+
+    def _reject(self, command: str, msg: str):
+        self._count(command, 'rejected')
+        raise CommandRejected(self.format(error=True, msg=msg))
+
+    def route(self, parameters: dict, client=None):
+        """
+        Find the method of the command, check the rate limit of
+        the client and parameters
+
+        :param parameters: request, {'command': name, **parameters}
+        :param client: client for the rate limiter (e.g. address)
+
+        :return: (command, method, parameters of the method),
+            CommandRejected if the request is wrong
+        """
+        if not isinstance(parameters, dict):
+            self._reject(None, 'The request is wrong')
+
+        parameters = dict(parameters)
+        command = parameters.pop('command', None)
+        route = self.routes.get(command) if isinstance(command, str) \
+            else None
+        if route is None:
+            self._reject(None, 'The command is unknown')
+
+        if self.rate_limiter is not None and \
+                not self.rate_limiter.allow(client, command):
+            self._count(command, 'limited')
+            raise CommandRejected(self.format(
+                error=True, msg='Too many requests'))
+
+        method, parameters_schema = route
+        if not parameters_schema.is_valid(parameters):
+            self._reject(command, 'The parameters of the command are wrong')
+
+        return command, method, parameters
+
+    def _result(self, command: str, response: dict) -> dict:
+        self._count(command, 'calls')
+        if not isinstance(response, dict) or response.get('error', True):
+            self._count(command, 'errors')
+        return response
+
+    def dispatch(self, parameters: dict, client=None) -> dict:
+        """
+        Run the command of the request
+
+        :param parameters: request, {'command': name, **parameters}
+        :param client: client for the rate limiter (e.g. address)
+
+        :return: response
+        """
+        try:
+            command, method, parameters = self.route(parameters, client)
+        except CommandRejected as e:
+            return e.response
+        return self._result(command, method(**parameters))
+
+    async def dispatch_async(self, parameters: dict, client=None) -> dict:
+        """
+        Run the command of the request on AsyncSimpleAuthServer
+
+        :param parameters: request, {'command': name, **parameters}
+        :param client: client for the rate limiter (e.g. address)
+
+        :return: response
+        """
+        try:
+            command, method, parameters = self.route(parameters, client)
+        except CommandRejected as e:
+            return e.response
+        return self._result(command, await method(**parameters))
+
+    def counters(self) -> dict:
+        """
+        Counters of the commands: calls, errors (responses with error),
+        rejected requests and requests over the rate limit; 'unknown' is
+        the number of requests with an unknown command
+
+        :return: dict
+        """
+        with self._lock:
+            counters = {command: dict(values)
+                        for command, values in self._counters.items()}
+            counters['unknown'] = self._unknown
+        return counters
@@ -0,0 +1,322 @@
+"""
+Session storage in a text file
+
+The file is an append-only log of json lines:
+{"k": key, "v": entry} - the key is set
+{"k": key, "d": 1} - the key is deleted
+
+On start the log is read through mmap to rebuild the index in memory.
+Expired entries are swept from the index like in TTLSessionStorage.
+Records are fsync-ed in groups, the log is compacted in background
+when it has got too many dead (overwritten, deleted and expired)
+records.
+"""
+import collections.abc
+import json
+import mmap
+import os
+import threading
+import time
+
+from .server import TTLSessionStorage, SessionEntry
+
+
+class _Index(TTLSessionStorage):
+    """
+    Index of the live entries of the log
+    """
+
+    def _current_time(self) -> int:
+        return int(time.time())
+
+
+class FileSessionStorage(collections.abc.MutableMapping):
+    """
+    Append-only file session storage
+
+    Use it with SimpleAuthServer:
+
+    class SessionStorage(FileSessionStorage):
+        path = '/var/lib/simple_auth/sessions.log'
+
+    class Server(SimpleAuthServer):
+        session_storage_type = SessionStorage
+    """
+    path = 'simple_auth_sessions.log'
+
+    # fsync the log after this number of records ...
+    fsync_batch_size = 100
+    # ... or after this number of seconds
+    fsync_interval = 1.0
+
+    # compact the log when records / live entries is more than ratio
+    compaction_ratio = 4
+    # and the log has got at least this number of dead records
+    compaction_min_records = 1000
+
+    # run fsync and compaction in a background thread
+    background = True
+
+    def __init__(self, path: str = None):
+        if path is not None:
+            self.path = path
+
+        self._index = _Index()
+        self._lock = threading.RLock()
+        self._records = 0
+        self._pending = 0
+        self._last_fsync = time.time()
+
+        self._load()
+        self._file = open(self.path, 'ab')
+
+        self._closed = threading.Event()
+        self._thread = None
+        if self.background:
+            self._thread = threading.Thread(
+                target=self._background, name='FileSessionStorage',
+                daemon=True)
+            self._thread.start()
+
+    # log
+
+    @staticmethod
+    def _dump_set(key: str, value: SessionEntry) -> bytes:
+        return json.dumps(
+            {'k': key, 'v': value.to_dict()},
+            separators=(',', ':')).encode() + b'\n'
+
+    @staticmethod
+    def _dump_delete(key: str) -> bytes:
+        return json.dumps(
+            {'k': key, 'd': 1}, separators=(',', ':')).encode() + b'\n'
+
+    def _load(self):
+        """
+        Rebuild the index from the log
+
+        A broken tail (the process died during the write) is cut off
+
+        :return:
+        """
+        if not os.path.exists(self.path):
+            return
+
+        current_time = int(time.time())
+        index = self._index
+        valid_size = 0
+
+        with open(self.path, 'r+b') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for line in iter(mm.readline, b''):
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+
+                    valid_size += len(line)
+                    self._records += 1
+                    key = record['k']
+                    if 'd' in record:
+                        index.pop(key, None)
+                        continue
+
+                    entry = SessionEntry.from_dict(record['v'])
+                    if entry.timestamp_expired < current_time:
+                        index.pop(key, None)
+                        continue
+                    index.set_trusted(key, entry)
+
+            file.truncate(valid_size)
+
+    def _append(self, data: bytes):
+        with self._lock:
+            self._file.write(data)
+            self._records += 1
+            self._pending += 1
+            if self._pending >= self.fsync_batch_size:
+                self._fsync()
+
+    def _fsync(self):
+        with self._lock:
+            self._file.flush()
+            if self._pending:
+                os.fsync(self._file.fileno())
+            self._pending = 0
+            self._last_fsync = time.time()
+
+    def flush(self):
+        """
+        Write all records to the disk
+
+        :return:
+        """
+        self._fsync()
+
+    def _background(self):
+        while not self._closed.wait(self.fsync_interval):
+            if self._pending and \
+                    time.time() - self._last_fsync >= self.fsync_interval:
+                self._fsync()
+            self.sweep()
+            if self.need_compaction():
+                self.compact()
+
+    def sweep(self) -> int:
+        """
+        Remove expired entries from the index (writes sweep a batch as
+        well), their records become dead
+
+        Writers wait only for one batch of sweep_batch_size entries.
+
+        :return: number of removed entries
+        """
+        removed = 0
+        while True:
+            with self._lock:
+                removed += self._index.sweep()
+                if not self._index.has_expired():
+                    return removed
+
+    @property
+    def dead_records(self) -> int:
+        """
+        Records of the log which are not needed: every live entry has
+        got one record, the others are overwritten, deleted or expired
+
+        :return: number
+        """
+        return self._records - len(self._index)
+
+    def need_compaction(self) -> bool:
+        return (self.dead_records >= self.compaction_min_records and
+                self._records > self.compaction_ratio * len(self._index))
+
+    def compact(self):
+        """
+        Rewrite the log without expired and overwritten records
+
+        Writers are blocked only at the beginning and at the end:
+        records made during the compaction are copied from the tail
+        of the old log.
+
+        :return:
+        """
+        compact_path = self.path + '.compact'
+
+        with self._lock:
+            self._file.flush()
+            offset = self._file.tell()
+            snapshot = list(self._index.items())
+
+        current_time = int(time.time())
+        records = 0
+        expired = []
+        with open(compact_path, 'wb') as file:
+            for key, entry in snapshot:
+                if entry.timestamp_expired < current_time:
+                    expired.append((key, entry))
+                    continue
+                file.write(self._dump_set(key, entry))
+                records += 1
+
+            with self._lock:
+                self._file.flush()
+                with open(self.path, 'rb') as log:
+                    log.seek(offset)
+                    for line in log:
+                        file.write(line)
+                        records += 1
+
+                file.flush()
+                os.fsync(file.fileno())
+                os.replace(compact_path, self.path)
+
+                self._file.close()
+                self._file = open(self.path, 'ab')
+                self._records = records
+                self._pending = 0
+
+                for key, entry in expired:
+                    # the key may have been written during the compaction
+                    if self._index.get(key) is entry and \
+                            entry.timestamp_expired < current_time:
+                        del self._index[key]
+
+    def close(self):
+        """
+        Stop the background thread and close the log
+
+        :return:
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if not self._file.closed:
+                self._fsync()
+                self._file.close()
+
+    def keys_of_main_token(self, main_token: str) -> set:
+        """
+        Keys of the login lineage
+
+        :param main_token: main token
+
+        :return: set of keys
+        """
+        return self._index.keys_of_main_token(main_token)
+
+    def count_by_action(self) -> dict:
+        """
+        Number of entries per action
+
+        :return: dict, action name -> number
+        """
+        return self._index.count_by_action()
+
+    # mapping
+
+    def __getitem__(self, key):
+        return self._index[key]
+
+    def get(self, key, default=None):
+        return self._index.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._index[key] = value
+            self._append(self._dump_set(key, self._index[key]))
+
+    def set_trusted(self, key, value):
+        """
+        Write an entry without validation
+        (only for entries built by the server)
+
+        :param key: key
+        :param value: valid SessionEntry
+
+        :return:
+        """
+        with self._lock:
+            self._index.set_trusted(key, value)
+            self._append(self._dump_set(key, value))
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._index[key]
+            self._append(self._dump_delete(key))
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def __len__(self):
+        return len(self._index)
@@ -3,7 +3,7 @@ import time
 
 import flask
 
-from .client import SimpleAuthClient
+from .client import SimpleAuthClient, deadline_at, clock
 
 
 def check_auth_identifier():
@@ -18,6 +18,12 @@ def check_auth_identifier():
     flask.g.pop('user', None)
     flask.g.pop('auth_token', None)
 
+    if not client.is_available():
+        # the circuit breaker is open: keep the identifier for later
+        flask.g.auth_redirect = flask.current_app.config.get(
+            'URL_IF_AUTH_SERVER_UNAVAILABLE')
+        return
+
     if client.is_valid_identifier(identifier=flask.g.auth_identifier):
         response = client.get_token(identifier=flask.g.auth_identifier)
         if response.get('error', True):
@@ -54,13 +60,23 @@ def check_auth_token():
 
     flask.g.pop('auth_identifier', None)
 
+    token_secret = flask.current_app.config.get('AUTH_TOKEN_SECRET')
+
     client = SimpleAuthClient(
-        url_server_auth=url_server_auth)
+        url_server_auth=url_server_auth, token_secret=token_secret)
+
+    if token_secret is not None:
+        # signed access token is checked locally
+        is_valid_token = client.verify_token(
+            token=flask.g.auth_token) is not None
+    else:
+        is_valid_token = client.is_valid_token(token=flask.g.auth_token)
 
-    if client.is_valid_token(token=flask.g.auth_token):
+    if is_valid_token:
         if flask.g.get('user'):
             return
     elif client.is_valid_token_for_update(token=flask.g.auth_token):
+        # concurrent requests of the user share one update
         response = client.update_token(token=flask.g.auth_token)
         if not response.get('error', True):
             new_token = response.get('result', {}).get('token')
@@ -172,22 +188,39 @@ def available_for_anonymous_user(f):
     return wrapper
 
 
+def page_deadline():
+    """
+    Deadline of the requests to the auth server of the page:
+    AUTH_DEADLINE_BUDGET sec (None - no deadline) from the first call,
+    kept on flask.g
+
+    :return: context manager of client.deadline_at
+    """
+    if flask.g.get('auth_deadline') is None:
+        budget = flask.current_app.config.get('AUTH_DEADLINE_BUDGET')
+        if budget is not None:
+            flask.g.auth_deadline = clock() + budget
+    return deadline_at(flask.g.get('auth_deadline'))
+
+
 def control_auth(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         is_only_for_auth_users = getattr(f, 'is_only_for_auth_users', False)
 
-        load_before_view()
+        # the auth helpers and the view share the budget of the page
+        with page_deadline():
+            load_before_view()
 
-        if is_only_for_auth_users:
-            url_redirect = flask.g.get('auth_redirect')
+            if is_only_for_auth_users:
+                url_redirect = flask.g.get('auth_redirect')
 
-            if url_redirect:
-                load_after_view()
-                return flask.redirect(url_redirect)
+                if url_redirect:
+                    load_after_view()
+                    return flask.redirect(url_redirect)
 
-        result = f(*args, **kwargs)
-        load_after_view()
+            result = f(*args, **kwargs)
+            load_after_view()
 
         return result
     return wrapper
@@ -0,0 +1,285 @@
+"""
+Metrics of the auth server in the Prometheus text format
+
+No client library is required: MetricsRegistry keeps counters and
+histograms in dicts, gauges are read by collectors at export time.
+
+class Server(SimpleAuthServer):
+    metrics_type = MetricsRegistry
+
+@app.route('/metrics')
+def metrics():
+    return flask.Response(SERVER.export_metrics(),
+                          content_type=CONTENT_TYPE)
+"""
+import bisect
+import contextvars
+import functools
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+clock = time.perf_counter
+
+# a command is being measured in this thread / task, commands called by
+# it (check_identifier of get_token, items of a batch) are measured in
+# the nested histogram, so the outer commands are counted once
+_measuring = contextvars.ContextVar('simple_auth_measuring', default=False)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: tuple, extra: tuple = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, _escape(value))
+        for name, value in labels) + '}'
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of counters, histograms and gauge collectors
+
+    Labels are tuples of (name, value) pairs.
+    """
+    # sec, upper bounds of histogram buckets
+    buckets = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+               0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.5)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (type, help)
+        self._descriptions = {}
+        # name -> {labels: value}
+        self._counters = {}
+        # name -> {labels: [count per bucket ..., count of +Inf, sum]}
+        self._histograms = {}
+        # functions () -> [(name, type, help, {labels: value}), ...]
+        self._collectors = []
+
+    def describe(self, name: str, kind: str, text: str):
+        self._descriptions[name] = (kind, text)
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        """
+        Increase the counter
+
+        :param name: name of the counter
+        :param labels: labels
+        :param value: increment
+
+        :return:
+        """
+        with self._lock:
+            values = self._counters.setdefault(name, {})
+            values[labels] = values.get(labels, 0) + value
+
+    def observe(self, name: str, value: float, labels: tuple = ()):
+        """
+        Add the value to the histogram
+
+        :param name: name of the histogram
+        :param value: value, e.g. duration in sec
+        :param labels: labels
+
+        :return:
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            try:
+                counts = self._histograms[name][labels]
+            except KeyError:
+                counts = self._histograms.setdefault(name, {})[labels] = \
+                    [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def add_collector(self, collector):
+        """
+        Add a function which returns gauges at export time
+
+        :param collector: function () -> [(name, type, help,
+            {labels: value}), ...]
+
+        :return:
+        """
+        self._collectors.append(collector)
+
+    def value(self, name: str, labels: tuple = ()):
+        """
+        Value of the counter or (count, sum) of the histogram
+
+        :param name: name
+        :param labels: labels
+
+        :return: number, tuple or None
+        """
+        with self._lock:
+            if name in self._histograms:
+                counts = self._histograms[name].get(labels)
+                if counts is None:
+                    return None
+                return sum(counts[:-1]), counts[-1]
+            return self._counters.get(name, {}).get(labels)
+
+    def _header(self, lines: list, name: str, kind: str, text: str):
+        lines.append('# HELP {} {}'.format(name, text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+
+    def export(self) -> str:
+        """
+        All metrics in the Prometheus text format
+
+        :return: string
+        """
+        lines = []
+        with self._lock:
+            counters = {name: dict(values)
+                        for name, values in self._counters.items()}
+            histograms = {name: {labels: list(counts)
+                                 for labels, counts in values.items()}
+                          for name, values in self._histograms.items()}
+
+        for name, values in sorted(counters.items()):
+            kind, text = self._descriptions.get(name, ('counter', name))
+            self._header(lines, name, kind, text)
+            for labels, value in sorted(values.items()):
+                lines.append('{}{} {}'.format(
+                    name, _labels(labels), _number(value)))
+
+        for name, values in sorted(histograms.items()):
+            kind, text = self._descriptions.get(name, ('histogram', name))
+            self._header(lines, name, kind, text)
+            for labels, counts in sorted(values.items()):
+                total = 0
+                for bound, count in zip(
+                        self.buckets + (float('inf'),), counts):
+                    total += count
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _labels(labels, (('le', _number(bound)),)),
+                        total))
+                lines.append('{}_sum{} {}'.format(
+                    name, _labels(labels), _number(counts[-1])))
+                lines.append('{}_count{} {}'.format(
+                    name, _labels(labels), total))
+
+        for collector in self._collectors:
+            for name, kind, text, values in collector():
+                self._header(lines, name, kind, text)
+                for labels, value in sorted(values.items()):
+                    lines.append('{}{} {}'.format(
+                        name, _labels(labels), _number(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+COMMAND_SECONDS = 'simple_auth_command_duration_seconds'
+COMMAND_ERRORS = 'simple_auth_command_errors_total'
+# commands called by other commands
+NESTED_COMMAND_SECONDS = 'simple_auth_nested_command_duration_seconds'
+NESTED_COMMAND_ERRORS = 'simple_auth_nested_command_errors_total'
+
+
+def _record(metrics: MetricsRegistry, labels: tuple, started: float,
+            response, nested: bool = False):
+    if nested:
+        seconds, errors = NESTED_COMMAND_SECONDS, NESTED_COMMAND_ERRORS
+    else:
+        seconds, errors = COMMAND_SECONDS, COMMAND_ERRORS
+    metrics.observe(seconds, clock() - started, labels)
+    if isinstance(response, dict) and response.get('error'):
+        metrics.inc(errors, labels + (
+            ('reason', response.get('msg', '')),))
+
+
+def measured(command: str):
+    """
+    Decorator of a command of the server: latency and error reasons
+    (nothing is done if the server has got no metrics)
+
+    Commands called by another command are recorded in the nested
+    metrics (NESTED_COMMAND_SECONDS, NESTED_COMMAND_ERRORS).
+
+    :param command: name of the command
+
+    :return: decorator
+    """
+
+    labels = (('command', command),)
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+            nested = _measuring.get()
+            token = _measuring.set(True)
+            try:
+                started = clock()
+                response = method(self, *args, **kwargs)
+            finally:
+                _measuring.reset(token)
+            _record(metrics, labels, started, response, nested)
+            return response
+        return wrapper
+
+    return decorator
+
+
+def measured_async(command: str):
+    """
+    `measured` for coroutines of AsyncSimpleAuthServer
+
+    :param command: name of the command
+
+    :return: decorator
+    """
+
+    labels = (('command', command),)
+
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return await method(self, *args, **kwargs)
+            nested = _measuring.get()
+            token = _measuring.set(True)
+            try:
+                started = clock()
+                response = await method(self, *args, **kwargs)
+            finally:
+                _measuring.reset(token)
+            _record(metrics, labels, started, response, nested)
+            return response
+        return wrapper
+
+    return decorator
+
+
+def describe_commands(metrics: MetricsRegistry):
+    metrics.describe(COMMAND_SECONDS, 'histogram',
+                     'Latency of commands of the auth server')
+    metrics.describe(COMMAND_ERRORS, 'counter',
+                     'Error responses of commands by reason')
+    metrics.describe(NESTED_COMMAND_SECONDS, 'histogram',
+                     'Latency of commands called by other commands')
+    metrics.describe(NESTED_COMMAND_ERRORS, 'counter',
+                     'Error responses of commands called by other '
+                     'commands by reason')
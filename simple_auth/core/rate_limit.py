@@ -0,0 +1,74 @@
+"""
+Token bucket rate limiting of clients of the auth server
+
+Every (client, command) pair has got a bucket: `burst` requests at once,
+then `rate` requests per second. A bucket is two numbers, buckets of
+idle clients are removed when there are more than max_buckets.
+
+class RateLimiter(TokenBucketRateLimiter):
+    limits = {'get_identifier': (5, 20)}
+
+dispatcher = CommandDispatcher(server, rate_limiter=RateLimiter())
+dispatcher.dispatch(flask.request.json, client=flask.request.remote_addr)
+"""
+import collections
+import threading
+import time
+
+
+class TokenBucketRateLimiter:
+    """
+    Thread-safe token bucket limiter keyed by client and command
+    """
+    # command -> (rate - requests per sec, burst - size of the bucket)
+    limits = {
+        'get_identifier': (5, 20),
+    }
+    # limit of other commands, None - no limit
+    default_limit = (50, 100)
+    # max number of buckets in memory, the least recently used bucket
+    # is removed (it is full again for the next request)
+    max_buckets = 100000
+
+    def __init__(self):
+        # (client, command) -> [tokens, time of the last update]
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def limit(self, command: str):
+        return self.limits.get(command, self.default_limit)
+
+    def allow(self, client, command: str) -> bool:
+        """
+        Take one token of the bucket
+
+        :param client: client (e.g. address or client_id)
+        :param command: command
+
+        :return: False if the client is over the limit
+        """
+        limit = self.limit(command)
+        if limit is None:
+            return True
+        rate, burst = limit
+
+        key = (client, command)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+                if len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,385 @@
+"""
+Session storage in Redis
+
+Has got own small client of the Redis protocol (RESP), so no additional
+packages are required. Entries are kept as json strings with the native
+expiry of Redis (EXPIREAT timestamp_expired).
+
+`lock` makes an optimistic transaction: the locked keys are watched and
+read in one round trip, writes are buffered and sent as one MULTI/EXEC
+pipeline. If another process has changed the keys, EXEC is aborted and
+SessionStorageConflict makes the server repeat the operation.
+All commands of the transaction go through its own connection, other
+keys read in the transaction are watched as well.
+"""
+import collections.abc
+import contextlib
+import json
+import queue
+import socket
+import threading
+
+from .server import SessionEntry, SessionStorageConflict, \
+    validate_session_storage_entry
+
+
+class RedisError(Exception):
+    """
+    Error reply of the Redis server
+    """
+
+
+class RedisConnection:
+    """
+    One connection to the Redis server
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = None):
+        self.socket = socket.create_connection((host, port), timeout=timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.socket.makefile('rb')
+
+    @staticmethod
+    def encode(command: (list, tuple)) -> bytes:
+        parts = [b'*%d\r\n' % len(command)]
+        for argument in command:
+            if isinstance(argument, str):
+                argument = argument.encode()
+            elif isinstance(argument, int):
+                argument = b'%d' % argument
+            parts.append(b'$%d\r\n%s\r\n' % (len(argument), argument))
+        return b''.join(parts)
+
+    def read_reply(self):
+        line = self.file.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection to Redis is closed')
+
+        kind, data = line[:1], line[1:-2]
+        if kind == b'+':
+            return data.decode()
+        if kind == b'-':
+            return RedisError(data.decode())
+        if kind == b':':
+            return int(data)
+        if kind == b'$':
+            length = int(data)
+            if length < 0:
+                return None
+            return self.file.read(length + 2)[:-2].decode()
+        if kind == b'*':
+            length = int(data)
+            if length < 0:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise ConnectionError('Wrong reply from Redis: {!r}'.format(line))
+
+    def execute(self, *commands) -> list:
+        """
+        Send commands in one pipeline
+
+        :param commands: commands, every command is a tuple of arguments
+
+        :return: replies
+        """
+        self.socket.sendall(b''.join(map(self.encode, commands)))
+        replies = [self.read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+class RedisConnectionPool:
+    """
+    Thread-safe pool of connections to the Redis server
+    """
+    connection_class = RedisConnection
+
+    def __init__(self, host: str = 'localhost', port: int = 6379,
+                 db: int = 0, max_connections: int = 10,
+                 timeout: float = None):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def _connect(self) -> RedisConnection:
+        connection = self.connection_class(
+            self.host, self.port, timeout=self.timeout)
+        if self.db:
+            connection.execute(('SELECT', self.db))
+        return connection
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Take a connection from the pool
+        (wait if all max_connections are busy)
+
+        :return: RedisConnection
+        """
+        self._slots.acquire()
+        try:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+
+            broken = False
+            try:
+                yield connection
+            except (OSError, ConnectionError):
+                broken = True
+                raise
+            finally:
+                if broken:
+                    connection.close()
+                else:
+                    self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    def execute(self, *commands) -> list:
+        with self.connection() as connection:
+            return connection.execute(*commands)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class _Transaction:
+
+    def __init__(self, connection: RedisConnection, values: dict):
+        self.connection = connection
+        # watched key -> SessionEntry or None, with the buffered writes
+        self.values = values
+        self.commands = []
+        self.watching = bool(values)
+
+
+class RedisSessionStorage(collections.abc.MutableMapping):
+    """
+    Redis session storage
+
+    Use it with SimpleAuthServer:
+
+    class SessionStorage(RedisSessionStorage):
+        host = 'redis.local'
+
+    class Server(SimpleAuthServer):
+        session_storage_type = SessionStorage
+    """
+    host = 'localhost'
+    port = 6379
+    db = 0
+    max_connections = 10
+    # sec, socket timeout
+    timeout = 5.0
+    key_prefix = 'simple_auth:'
+    # sets main_token -> keys of the login lineage (Redis 7+ is required
+    # for EXPIREAT with NX/GT)
+    main_token_key_prefix = 'simple_auth_main_token:'
+
+    def __init__(self, pool: RedisConnectionPool = None):
+        if pool is None:
+            pool = RedisConnectionPool(
+                host=self.host, port=self.port, db=self.db,
+                max_connections=self.max_connections, timeout=self.timeout)
+        self.pool = pool
+        self._local = threading.local()
+
+    def _key(self, key: str) -> str:
+        return self.key_prefix + key
+
+    @staticmethod
+    def _load(value: str):
+        if value is None:
+            return None
+        return SessionEntry.from_dict(json.loads(value))
+
+    def _main_token_key(self, main_token: str) -> str:
+        return self.main_token_key_prefix + main_token
+
+    def _set_commands(self, key: str, value: SessionEntry) -> list:
+        redis_key = self._key(key)
+        main_token_key = self._main_token_key(value.main_token)
+        return [
+            ('SET', redis_key,
+             json.dumps(value.to_dict(), separators=(',', ':'))),
+            ('EXPIREAT', redis_key, value.timestamp_expired),
+            # the set of the lineage lives as long as its last key
+            ('SADD', main_token_key, key),
+            ('EXPIREAT', main_token_key, value.timestamp_expired, 'NX'),
+            ('EXPIREAT', main_token_key, value.timestamp_expired, 'GT'),
+        ]
+
+    def _transaction(self):
+        return getattr(self._local, 'transaction', None)
+
+    @contextlib.contextmanager
+    def lock(self, *keys):
+        """
+        Run a multi-step operation in one optimistic transaction
+
+        :param keys: keys of the operation (None is ignored)
+
+        :return:
+        """
+        if self._transaction() is not None:
+            yield
+            return
+
+        keys = list(dict.fromkeys(key for key in keys if key is not None))
+        redis_keys = [self._key(key) for key in keys]
+
+        with self.pool.connection() as connection:
+            if redis_keys:
+                _, values = connection.execute(
+                    ('WATCH', *redis_keys), ('MGET', *redis_keys))
+            else:
+                values = []
+
+            transaction = _Transaction(
+                connection, dict(zip(keys, map(self._load, values))))
+            self._local.transaction = transaction
+            try:
+                yield
+            except BaseException:
+                if transaction.watching:
+                    connection.execute(('UNWATCH',))
+                raise
+            finally:
+                self._local.transaction = None
+
+            if not transaction.commands:
+                if transaction.watching:
+                    connection.execute(('UNWATCH',))
+                return
+
+            replies = connection.execute(
+                ('MULTI',), *transaction.commands, ('EXEC',))
+            if replies[-1] is None:
+                raise SessionStorageConflict()
+
+    def _execute(self, *commands) -> list:
+        """
+        Run commands on the connection of the transaction of the thread
+        (a second connection of the pool may never come) or on a
+        connection of the pool
+
+        :param commands: commands
+
+        :return: replies
+        """
+        transaction = self._transaction()
+        if transaction is None:
+            return self.pool.execute(*commands)
+        return transaction.connection.execute(*commands)
+
+    def close(self):
+        self.pool.close()
+
+    def keys_of_main_token(self, main_token: str) -> set:
+        """
+        Keys of the login lineage
+
+        Keys moved to another lineage by merge_main_tokens can be
+        in the set too, the server checks main_token of every entry
+
+        :param main_token: main token
+
+        :return: set of keys
+        """
+        return set(self._execute(
+            ('SMEMBERS', self._main_token_key(main_token)))[0])
+
+    # mapping
+
+    def __getitem__(self, key):
+        transaction = self._transaction()
+        if transaction is None:
+            value = self._load(self.pool.execute(('GET', self._key(key)))[0])
+        else:
+            if key not in transaction.values:
+                # the operation depends on the key, EXEC is aborted if
+                # the key is changed
+                redis_key = self._key(key)
+                _, value = transaction.connection.execute(
+                    ('WATCH', redis_key), ('GET', redis_key))
+                transaction.values[key] = self._load(value)
+                transaction.watching = True
+            value = transaction.values[key]
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, key, value):
+        if isinstance(value, SessionEntry):
+            value = value.to_dict()
+        value = validate_session_storage_entry(value)
+        self.set_trusted(key, SessionEntry.from_dict(value))
+
+    def set_trusted(self, key, value):
+        """
+        Write an entry without validation
+        (only for entries built by the server)
+
+        :param key: key
+        :param value: valid SessionEntry
+
+        :return:
+        """
+        commands = self._set_commands(key, value)
+        transaction = self._transaction()
+        if transaction is None:
+            self.pool.execute(*commands)
+            return
+        transaction.values[key] = value
+        transaction.commands.extend(commands)
+
+    def __delitem__(self, key):
+        main_token = self[key].main_token
+
+        commands = [
+            ('DEL', self._key(key)),
+            ('SREM', self._main_token_key(main_token), key),
+        ]
+        transaction = self._transaction()
+        if transaction is None:
+            self.pool.execute(*commands)
+            return
+        transaction.values[key] = None
+        transaction.commands.extend(commands)
+
+    def __iter__(self):
+        cursor = '0'
+        prefix_length = len(self.key_prefix)
+        while True:
+            cursor, keys = self._execute(
+                ('SCAN', cursor, 'MATCH', self.key_prefix + '*',
+                 'COUNT', 1000))[0]
+            for key in keys:
+                yield key[prefix_length:]
+            if cursor == '0':
+                return
+
+    def __len__(self):
+        return sum(1 for _ in self)
@@ -7,11 +7,17 @@ token is a dictionary not string (!)
 """
 
 import time
-import copy
+import enum
+import heapq
+import threading
+import contextlib
+import collections.abc
 
 import schema
 
 from .base import BaseMixin
+from .metrics import measured, describe_commands
+from .signed_token import sign_token, verify_token
 import uuid
 
 
@@ -26,11 +32,577 @@ schema_session_storage_entry = schema.Schema({
 })
 
 
+class SessionStorageConflict(Exception):
+    """
+    The keys locked by `lock` of a storage have been changed by another
+    process, the operation has been rolled back and has to be repeated
+    """
+
+
+session_storage_entry_actions = frozenset((
+    'access', 'update', 'main', 'identifier'))
+_session_storage_entry_required_keys = frozenset((
+    'timestamp', 'timestamp_expired', 'main_token', 'action'))
+_session_storage_entry_keys = _session_storage_entry_required_keys | {
+    'user', 'token'}
+
+
+def validate_session_storage_entry(value):
+    """
+    Fast version of schema_session_storage_entry.validate
+
+    Valid entries are checked by hand, anything else goes to the schema,
+    so an invalid entry raises the same schema.SchemaError
+
+    :param value: session storage entry
+
+    :return: validated copy of the entry
+    """
+    if type(value) is dict:
+        keys = value.keys()
+        if keys <= _session_storage_entry_keys \
+                and keys >= _session_storage_entry_required_keys \
+                and isinstance(value['timestamp'], int) \
+                and isinstance(value['timestamp_expired'], int) \
+                and isinstance(value['main_token'], str) \
+                and isinstance(value['action'], str) \
+                and value['action'] in session_storage_entry_actions \
+                and isinstance(value.get('user', {}), dict) \
+                and isinstance(value.get('token', {}), dict):
+            return dict(value)
+
+    return schema_session_storage_entry.validate(data=value)
+
+
+class SessionAction(enum.IntEnum):
+    identifier = 0
+    main = 1
+    access = 2
+    update = 3
+
+
+class SessionEntry:
+    """
+    Session storage entry
+
+    Compact record used by the server and the storages instead of a dict.
+    `to_dict` gives the old dict shape, the item access is kept
+    for compatibility.
+    """
+    __slots__ = ('timestamp', 'timestamp_expired', 'main_token', 'action',
+                 'user', 'token')
+
+    def __init__(self, timestamp: int, timestamp_expired: int,
+                 main_token: str, action: SessionAction,
+                 user: dict = None, token: dict = None):
+        self.timestamp = timestamp
+        self.timestamp_expired = timestamp_expired
+        self.main_token = main_token
+        self.action = action
+        self.user = user
+        self.token = token
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """
+        Make entry from dict without validation
+        (missed fields are None)
+
+        :param data: entry in the dict shape
+
+        :return: SessionEntry
+        """
+        return cls(
+            timestamp=data.get('timestamp'),
+            timestamp_expired=data.get('timestamp_expired'),
+            main_token=data.get('main_token'),
+            action=SessionAction.__members__.get(data.get('action')),
+            user=data.get('user'),
+            token=data.get('token'))
+
+    @classmethod
+    def from_value(cls, value):
+        """
+        Make entry from value of a storage
+
+        :param value: SessionEntry or dict
+
+        :return: SessionEntry
+        """
+        if isinstance(value, cls):
+            return value
+        return cls.from_dict(value)
+
+    def to_dict(self) -> dict:
+        """
+        Entry in the dict shape
+
+        :return: dict
+        """
+        data = dict(
+            timestamp=self.timestamp,
+            timestamp_expired=self.timestamp_expired,
+            main_token=self.main_token,
+            action=None if self.action is None else self.action.name)
+        if self.user is not None:
+            data['user'] = self.user
+        if self.token is not None:
+            data['token'] = self.token
+        return data
+
+    def to_response(self) -> dict:
+        """
+        Entry in the dict shape without internal fields, user and token
+        are copies (shallow), the caller may change them
+
+        :return: dict
+        """
+        data = self.to_dict()
+        del data['main_token']
+        del data['action']
+        for key in ('user', 'token'):
+            if key in data:
+                data[key] = dict(data[key])
+        return data
+
+    def __getitem__(self, key):
+        try:
+            return self.to_dict()[key]
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        if key == 'action':
+            value = SessionAction[value]
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return getattr(self, key, None) is not None \
+            if key in self.__slots__ else False
+
+    def get(self, key, default=None):
+        return self.to_dict().get(key, default)
+
+    def __eq__(self, other):
+        if isinstance(other, SessionEntry):
+            return all(getattr(self, name) == getattr(other, name)
+                       for name in self.__slots__)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.to_dict())
+
+
 class DictSessionStorage(dict):
+    """
+    Session storage in memory
+
+    Keeps the index main_token -> keys of the login lineage and
+    the number of entries per action
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(DictSessionStorage, self).__init__()
+        self._main_token_keys = {}
+        self._key_main_token = {}
+        self._action_counts = dict.fromkeys(SessionAction, 0)
+        # initial entries are validated like any write
+        self.update(*args, **kwargs)
+
+    def _add_to_index(self, key, value):
+        self._key_main_token[key] = value.main_token
+        self._main_token_keys.setdefault(value.main_token, set()).add(key)
+        counts = self._action_counts
+        counts[value.action] = counts.get(value.action, 0) + 1
+
+    def _remove_from_index(self, key, value):
+        # the entry may have been changed in place, so the main token
+        # is taken from the index
+        main_token = self._key_main_token.pop(key)
+        keys = self._main_token_keys[main_token]
+        keys.discard(key)
+        if not keys:
+            del self._main_token_keys[main_token]
+        action = SessionEntry.from_value(value).action
+        self._action_counts[action] -= 1
 
     def __setitem__(self, key, value):
-        value = schema_session_storage_entry.validate(data=value)
-        return super(DictSessionStorage, self).__setitem__(key, value)
+        if isinstance(value, SessionEntry):
+            value = value.to_dict()
+        value = validate_session_storage_entry(value)
+        return self.set_trusted(key, SessionEntry.from_dict(value))
+
+    def set_trusted(self, key, value):
+        """
+        Write an entry without validation
+        (only for entries built by the server)
+
+        :param key: key
+        :param value: valid SessionEntry
+
+        :return:
+        """
+        if key in self._key_main_token:
+            self._remove_from_index(key, super().__getitem__(key))
+        super(DictSessionStorage, self).__setitem__(key, value)
+        self._add_to_index(key, value)
+
+    def __delitem__(self, key):
+        value = super(DictSessionStorage, self).__getitem__(key)
+        super(DictSessionStorage, self).__delitem__(key)
+        self._remove_from_index(key, value)
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        key, value = super(DictSessionStorage, self).popitem()
+        self._remove_from_index(key, value)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        self._main_token_keys.clear()
+        self._key_main_token.clear()
+        self._action_counts = dict.fromkeys(SessionAction, 0)
+        return super(DictSessionStorage, self).clear()
+
+    def count_by_action(self) -> dict:
+        """
+        Number of entries per action
+
+        :return: dict, action name -> number
+        """
+        return {action.name: count
+                for action, count in self._action_counts.items()
+                if action is not None}
+
+    def keys_of_main_token(self, main_token: str) -> set:
+        """
+        Keys of the login lineage
+
+        :param main_token: main token
+
+        :return: set of keys
+        """
+        return set(self._main_token_keys.get(main_token, ()))
+
+
+class TTLSessionStorage(DictSessionStorage):
+    """
+    Session storage which forgets expired entries
+
+    Every write puts (timestamp_expired, key) into a heap and removes
+    a bounded batch of expired entries, so the size of the storage follows
+    the number of live sessions. `sweep` can be called by a timer as well.
+    """
+    # max number of heap entries processed by one sweep
+    sweep_batch_size = 100
+
+    def __init__(self, *args, **kwargs):
+        self._expiry_heap = []
+        # action -> number of entries removed by sweep
+        self._expired_counts = dict.fromkeys(SessionAction, 0)
+        super(TTLSessionStorage, self).__init__(*args, **kwargs)
+
+    def set_trusted(self, key, value):
+        super(TTLSessionStorage, self).set_trusted(key, value)
+        heapq.heappush(
+            self._expiry_heap, (value.timestamp_expired, key))
+        self.sweep()
+
+    def clear(self):
+        self._expiry_heap.clear()
+        return super(TTLSessionStorage, self).clear()
+
+    def _current_time(self) -> int:
+        return int(time.time())
+
+    def sweep(self, limit: int = None) -> int:
+        """
+        Remove expired entries
+
+        :param limit: max number of heap entries to process
+            (sweep_batch_size by default)
+
+        :return: number of removed entries
+        """
+        if limit is None:
+            limit = self.sweep_batch_size
+
+        heap = self._expiry_heap
+        current_time = self._current_time()
+        removed = 0
+
+        while heap and limit > 0 and heap[0][0] < current_time:
+            limit -= 1
+            timestamp_expired, key = heapq.heappop(heap)
+            value = self.get(key)
+            # the key may have been removed or rewritten with a new expiry
+            if value is None or value.timestamp_expired != timestamp_expired:
+                continue
+            del self[key]
+            self._expired_counts[value.action] += 1
+            removed += 1
+
+        # drop stale heap entries left by rewritten and removed keys
+        if len(heap) > 2 * len(self) + self.sweep_batch_size:
+            self._expiry_heap = [
+                (timestamp_expired, key)
+                for timestamp_expired, key in heap
+                if key in self and
+                self[key].timestamp_expired == timestamp_expired]
+            heapq.heapify(self._expiry_heap)
+
+        return removed
+
+    def has_expired(self) -> bool:
+        """
+        Has the storage got entries for sweep
+
+        :return: bool
+        """
+        heap = self._expiry_heap
+        return bool(heap) and heap[0][0] < self._current_time()
+
+    def count_expired_by_action(self) -> dict:
+        """
+        Number of entries removed by sweep per action (expired
+        identifiers were never redeemed)
+
+        :return: dict, action name -> number
+        """
+        return {action.name: count
+                for action, count in self._expired_counts.items()}
+
+
+class LockedSessionStorage(DictSessionStorage):
+    """
+    Session storage for multi-threaded servers
+
+    One reentrant lock is held by every operation and by the multi-step
+    operations of the server (`lock`). Can be combined with
+    TTLSessionStorage:
+
+    class Storage(LockedSessionStorage, TTLSessionStorage):
+        pass
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._global_lock = threading.RLock()
+        super(LockedSessionStorage, self).__init__(*args, **kwargs)
+
+    def lock(self, *keys):
+        """
+        Lock the storage for a multi-step operation
+
+        :param keys: keys (all keys are locked)
+
+        :return: context manager
+        """
+        return self._global_lock
+
+    def __getitem__(self, key):
+        with self._global_lock:
+            return super(LockedSessionStorage, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        with self._global_lock:
+            return super(LockedSessionStorage, self).get(key, default)
+
+    def __contains__(self, key):
+        with self._global_lock:
+            return super(LockedSessionStorage, self).__contains__(key)
+
+    def __iter__(self):
+        with self._global_lock:
+            return iter(list(super(LockedSessionStorage, self).keys()))
+
+    def set_trusted(self, key, value):
+        with self._global_lock:
+            super(LockedSessionStorage, self).set_trusted(key, value)
+
+    def __delitem__(self, key):
+        with self._global_lock:
+            super(LockedSessionStorage, self).__delitem__(key)
+
+    def pop(self, key, *default):
+        with self._global_lock:
+            return super(LockedSessionStorage, self).pop(key, *default)
+
+    def clear(self):
+        with self._global_lock:
+            return super(LockedSessionStorage, self).clear()
+
+    def count_by_action(self) -> dict:
+        with self._global_lock:
+            return super(LockedSessionStorage, self).count_by_action()
+
+    def keys_of_main_token(self, main_token: str) -> set:
+        with self._global_lock:
+            return super(LockedSessionStorage, self).keys_of_main_token(
+                main_token)
+
+
+class StripedSessionStorage(collections.abc.MutableMapping):
+    """
+    Lock-striped session storage for multi-threaded servers
+
+    Keys are sharded by hash. Every shard has got two locks:
+    a data lock held only during one operation with the shard, and
+    a transaction lock which the server takes via `lock` for the keys of
+    a multi-step operation. Transaction locks are taken in the order
+    of shards, data locks never wait for other locks, so they can't
+    deadlock.
+
+    The operations under the locks are short and hold the GIL, so
+    threads don't run them in parallel anyway: with CPython this storage
+    is slower than LockedSessionStorage at every number of threads
+    (benchmarks/bench_striped_storage.py). Use LockedSessionStorage
+    unless the benchmark shows a gain on the target interpreter.
+    """
+    shard_count = 16
+    shard_type = DictSessionStorage
+
+    def __init__(self):
+        self._shards = [self.shard_type() for _ in range(self.shard_count)]
+        self._data_locks = [
+            threading.Lock() for _ in range(self.shard_count)]
+        self._transaction_locks = [
+            threading.RLock() for _ in range(self.shard_count)]
+
+    def _shard_index(self, key) -> int:
+        return hash(key) % self.shard_count
+
+    def __getitem__(self, key):
+        index = self._shard_index(key)
+        with self._data_locks[index]:
+            return self._shards[index][key]
+
+    def get(self, key, default=None):
+        index = self._shard_index(key)
+        with self._data_locks[index]:
+            return self._shards[index].get(key, default)
+
+    def __contains__(self, key):
+        index = self._shard_index(key)
+        with self._data_locks[index]:
+            return key in self._shards[index]
+
+    def __setitem__(self, key, value):
+        index = self._shard_index(key)
+        with self._data_locks[index]:
+            self._shards[index][key] = value
+
+    def set_trusted(self, key, value):
+        """
+        Write an entry without validation
+        (only for entries built by the server)
+
+        :param key: key
+        :param value: valid SessionEntry
+
+        :return:
+        """
+        index = self._shard_index(key)
+        with self._data_locks[index]:
+            self._shards[index].set_trusted(key, value)
+
+    def __delitem__(self, key):
+        index = self._shard_index(key)
+        with self._data_locks[index]:
+            del self._shards[index][key]
+
+    def __iter__(self):
+        for index, shard in enumerate(self._shards):
+            with self._data_locks[index]:
+                keys = list(shard)
+            yield from keys
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def clear(self):
+        for index, shard in enumerate(self._shards):
+            with self._data_locks[index]:
+                shard.clear()
+
+    def _sum_of_shards(self, method: str) -> dict:
+        counts = {}
+        for index, shard in enumerate(self._shards):
+            with self._data_locks[index]:
+                shard_counts = getattr(shard, method)()
+            for action, count in shard_counts.items():
+                counts[action] = counts.get(action, 0) + count
+        return counts
+
+    def count_by_action(self) -> dict:
+        """
+        Number of entries per action
+
+        :return: dict, action name -> number
+        """
+        return self._sum_of_shards('count_by_action')
+
+    def count_expired_by_action(self) -> dict:
+        """
+        Number of expired entries per action (shards with sweep)
+
+        :return: dict, action name -> number
+        """
+        if not hasattr(self.shard_type, 'count_expired_by_action'):
+            return {}
+        return self._sum_of_shards('count_expired_by_action')
+
+    def keys_of_main_token(self, main_token: str) -> set:
+        """
+        Keys of the login lineage
+
+        :param main_token: main token
+
+        :return: set of keys
+        """
+        keys = set()
+        for index, shard in enumerate(self._shards):
+            with self._data_locks[index]:
+                keys.update(shard.keys_of_main_token(main_token))
+        return keys
+
+    @contextlib.contextmanager
+    def lock(self, *keys):
+        """
+        Lock shards of the keys for a multi-step operation
+
+        :param keys: keys (None is ignored)
+
+        :return:
+        """
+        indexes = sorted({
+            self._shard_index(key) for key in keys if key is not None})
+        with contextlib.ExitStack() as stack:
+            for index in indexes:
+                stack.enter_context(self._transaction_locks[index])
+            yield
 
 
 class SimpleAuthUser:
@@ -56,49 +628,309 @@ class SimpleAuthServer(BaseMixin):
     expired_update_token_delta = 60
     expired_identifier_delta = 45
     time_delta = 1
+    # max number of items in one batch command
+    max_batch_size = 1000
+    # secret of signed access tokens: access tokens are checked without
+    # the session storage, only update tokens are kept in it.
+    # A revoked login keeps its access tokens until they expire.
+    token_secret = None
 
     user_model = SimpleAuthUser
+    # cache of profiles of users (to_storage_dict), e.g. cache.TTLCache,
+    # None - no cache
+    user_cache_type = None
+    user_cache_size = 10000
+    # sec
+    user_cache_ttl = 60
+    # generator of identifiers and tokens (see token_generator),
+    # None - str(uuid.uuid4())
+    token_generator_type = None
+    # registry of metrics (see metrics.MetricsRegistry), None - off
+    metrics_type = None
 
     def __init__(self):
         self.session_storage = self.session_storage_type()
+        self.metrics = None
+        if self.metrics_type is not None:
+            self.metrics = self.metrics_type()
+            describe_commands(self.metrics)
+            self.metrics.add_collector(self._collect_storage_metrics)
+        self.user_cache = None
+        if self.user_cache_type is not None:
+            self.user_cache = self.user_cache_type(
+                maxsize=self.user_cache_size, ttl=self.user_cache_ttl)
+        self.token_generator = None
+        if self.token_generator_type is not None:
+            self.token_generator = self.token_generator_type()
+
+    def _collect_storage_metrics(self) -> list:
+        """
+        Gauges and counters of the session storage for the metrics
+
+        Only counts which storages keep up to date on writes are
+        exported (count_by_action, count_entries,
+        count_expired_by_action), a scrape never scans the storage.
+
+        :return: list of (name, type, help, {labels: value})
+        """
+        storage = self.session_storage
+        metrics = []
+
+        count_by_action = getattr(storage, 'count_by_action', None)
+        count_entries = getattr(storage, 'count_entries', None)
+        if count_by_action is not None:
+            metrics.append((
+                'simple_auth_storage_entries', 'gauge',
+                'Entries of the session storage by action',
+                {(('action', action),): count
+                 for action, count in count_by_action().items()}))
+        elif count_entries is not None:
+            metrics.append((
+                'simple_auth_storage_entries', 'gauge',
+                'Entries of the session storage',
+                {(): count_entries()}))
+
+        count_expired = getattr(storage, 'count_expired_by_action', None)
+        if count_expired is not None:
+            metrics.append((
+                'simple_auth_storage_expired_total', 'counter',
+                'Entries removed after expiry by action '
+                '(identifiers were not redeemed)',
+                {(('action', action),): count
+                 for action, count in count_expired().items()}))
+        return metrics
+
+    def export_metrics(self) -> str:
+        """
+        Metrics in the Prometheus text format
+
+        :return: string (empty if the metrics are off)
+        """
+        if self.metrics is None:
+            return ''
+        return self.metrics.export()
+
+    def _new_token(self) -> str:
+        """
+        New random identifier or token
+
+        :return: string
+        """
+        if self.token_generator is None:
+            return str(uuid.uuid4())
+        return self.token_generator()
+
+    def _read(self, key: str):
+        """
+        Read an entry
+
+        :param key: key
+
+        :return: SessionEntry or None
+        """
+        value = self.session_storage.get(key)
+        if value is None:
+            return None
+        return SessionEntry.from_value(value)
+
+    def _lock(self, *keys):
+        """
+        Lock the keys of a multi-step operation if the storage can do it
 
+        :param keys: keys
+
+        :return: context manager
+        """
+        lock = getattr(self.session_storage, 'lock', None)
+        if lock is None:
+            return contextlib.nullcontext()
+        return lock(*keys)
+
+    def _has_room(self, entries: list) -> bool:
+        """
+        Can the storage take the entries (storages with fixed capacity
+        have got `has_room`), checked before anything is changed
+
+        :param entries: list of (key, SessionEntry)
+
+        :return: bool
+        """
+        has_room = getattr(self.session_storage, 'has_room', None)
+        return has_room is None or has_room(entries)
+
+    @staticmethod
+    def _main_entry(main_token: str, timestamp_expired: int,
+                    entry: SessionEntry = None):
+        """
+        Entry of the main token with the new expiry
+
+        :param main_token: main token
+        :param timestamp_expired: expiry of the login
+        :param entry: current entry of the main token or None
+
+        :return: SessionEntry
+        """
+        if entry is None:
+            return SessionEntry(
+                timestamp=int(time.time()),
+                main_token=main_token,
+                timestamp_expired=timestamp_expired,
+                action=SessionAction.main
+            )
+        return SessionEntry(
+            timestamp=entry.timestamp,
+            timestamp_expired=timestamp_expired,
+            main_token=main_token,
+            action=SessionAction.main,
+            user=entry.user,
+            token=entry.token)
+
+    def _write(self, key: str, value: SessionEntry):
+        """
+        Write an entry built by the server
+
+        Storages with `set_trusted` skip the validation of such entries
+
+        :param key: key
+        :param value: session storage entry
+
+        :return:
+        """
+        set_trusted = getattr(self.session_storage, 'set_trusted', None)
+        if set_trusted is None:
+            self.session_storage[key] = value
+        else:
+            set_trusted(key, value)
+
+    @measured('get_identifier')
     def get_identifier(self):
-        identifier = str(uuid.uuid4())
+        identifier = self._new_token()
         timestamp = int(time.time())
 
         response = dict(
             identifier=identifier
         )
-        self.session_storage[identifier] = dict(
+        self._write(identifier, SessionEntry(
             timestamp=timestamp,
             timestamp_expired=(timestamp + self.expired_identifier_delta),
-            main_token=str(uuid.uuid4()),
-            action='identifier'
-        )
+            main_token=self._new_token(),
+            action=SessionAction.identifier
+        ))
 
         return self.format(result=response)
 
-    def add_user_data(self, identifier: str, user_id: (int, str)):
-        user = self.user_model.get(user_id)
-        user_detail = user.to_storage_dict()
+    def _user_detail(self, user_id: (int, str)) -> dict:
+        """
+        Profile of the user for the storage, from the cache if it is on
+
+        Sessions get their own copy (shallow) of the cached profile
+
+        :param user_id: id of the user
 
-        if identifier in self.session_storage:
-            self.session_storage[identifier]['user'] = user_detail
+        :return: dict
+        """
+        if self.user_cache is not None:
+            user_detail = self.user_cache.get(user_id)
+            if user_detail is not None:
+                return dict(user_detail)
+
+        user_detail = self.user_model.get(user_id).to_storage_dict()
+        if self.user_cache is not None:
+            self.user_cache.set(user_id, user_detail)
+            return dict(user_detail)
+        return user_detail
+
+    def invalidate_user(self, user_id: (int, str)):
+        """
+        Remove the profile of the user from the cache (call it when
+        the user has been changed)
+
+        :param user_id: id of the user
+
+        :return:
+        """
+        if self.user_cache is not None:
+            self.user_cache.invalidate(user_id)
+        return self.format()
+
+    def user_cache_stats(self):
+        """
+        Hits and misses of the cache of profiles
+
+        :return: response, result is the stats or None without cache
+        """
+        if self.user_cache is None:
+            return self.format()
+        return self.format(result=self.user_cache.stats())
+
+    @measured('add_user_data')
+    def add_user_data(self, identifier: str, user_id: (int, str)):
+        user_detail = self._user_detail(user_id)
+
+        entry = self._read(identifier)
+        if entry is not None:
+            entry.user = user_detail
+            if not self._has_room([(identifier, entry)]):
+                return self.format(
+                    error=True, msg='The session storage is full')
+            self._write(identifier, entry)
             return self.format()
         return self.format(error=True, msg="The identifier is wrong")
 
-    def render_token(self):
+    def render_token(self, user: dict = None, main_token: str = None):
+        """
+        Make new access and update tokens
+
+        :param user: user of the token (for signed access tokens)
+        :param main_token: main token of the login (for signed access
+            tokens)
+
+        :return: token
+        """
         timestamp = int(time.time())
         expired_access_token = timestamp + self.expired_access_token_delta
         expired_update_token = timestamp + self.expired_update_token_delta
 
+        if self.token_secret is not None and user is not None:
+            access_token = sign_token(
+                self.token_secret, user.get('id'), expired_access_token,
+                main_token)
+        else:
+            access_token = self._new_token()
+
         return dict(
-            access_token=str(uuid.uuid4()),
-            update_token=str(uuid.uuid4()),
+            access_token=access_token,
+            update_token=self._new_token(),
             expired_access_token=expired_access_token,
             expired_update_token=expired_update_token
         )
 
+    def _lineage_locked(self, key: str, method):
+        """
+        Call the method under the lock of the key and its main token
+
+        The operation is repeated when merge_main_tokens has changed
+        the main token of the key or the storage has got a conflict.
+
+        :param key: identifier or token
+        :param method: method of the key
+
+        :return: response of the method
+        """
+        while True:
+            record = self._read(key)
+            main_token = None if record is None else record.main_token
+
+            try:
+                with self._lock(key, main_token):
+                    record = self._read(key)
+                    # main token has been changed by merge_main_tokens
+                    if record is None or record.main_token == main_token:
+                        return method(key)
+            except SessionStorageConflict:
+                continue
+
+    @measured('get_token')
     def get_token(self, identifier: str):
         """
         Get token and information about user
@@ -107,61 +939,88 @@ class SimpleAuthServer(BaseMixin):
 
         :return:
         """
+        return self._lineage_locked(identifier, self.__get_token)
 
+    def __get_token(self, identifier: str):
         response = self.check_identifier(identifier=identifier)
         if response.get('error', True):
             return response
 
-        if 'user' not in self.session_storage[identifier]:
+        record = self._read(identifier)
+        if record.user is None:
             return self.format(
                 error=True, msg="Have no information about user")
 
-        token = self.render_token()
-        record = copy.deepcopy(self.session_storage[identifier])
+        return self._issue_token(record, [identifier])
 
-        del self.session_storage[identifier]
-        record['token'] = token
+    def _token_entries(self, record: SessionEntry,
+                       main_record: SessionEntry = None):
+        """
+        New access and update tokens of the login and the entries to
+        write (shared by SimpleAuthServer and AsyncSimpleAuthServer)
 
-        access_token = token['access_token']
-        update_token = token['update_token']
+        :param record: entry of the login (identifier or update token)
+        :param main_record: current entry of the main token or None
 
-        record['timestamp_expired'] = token['expired_access_token']
-        record['action'] = 'access'
-        self.session_storage[access_token] = copy.deepcopy(record)
+        :return: (entry of the access token, list of (key, SessionEntry))
+        """
+        token = self.render_token(
+            user=record.user, main_token=record.main_token)
+
+        # entries share the user and token dicts, they are not changed
+        # after this point
+        access_record = SessionEntry(
+            timestamp=record.timestamp,
+            timestamp_expired=token['expired_access_token'],
+            main_token=record.main_token,
+            action=SessionAction.access,
+            user=record.user,
+            token=token)
+
+        entries = []
+        if self.token_secret is None:
+            entries.append((token['access_token'], access_record))
+        entries.append((token['update_token'], SessionEntry(
+            timestamp=record.timestamp,
+            timestamp_expired=token['expired_update_token'],
+            main_token=record.main_token,
+            action=SessionAction.update,
+            user=record.user,
+            token=token)))
+        entries.append((record.main_token, self._main_entry(
+            record.main_token, token['expired_update_token'],
+            main_record)))
+        return access_record, entries
+
+    def _issue_token(self, record: SessionEntry, used_keys: list):
+        """
+        New access and update tokens of the login, the used keys are
+        removed
 
-        record['timestamp_expired'] = token['expired_update_token']
-        record['action'] = 'update'
-        self.session_storage[update_token] = copy.deepcopy(record)
+        :param record: entry of the login (identifier or update token)
+        :param used_keys: keys which are consumed by the new tokens
 
-        main_token = record['main_token']
-        if main_token in self.session_storage:
-            # update main token
-            data_token = self.session_storage[main_token]
-            data_token['timestamp_expired'] = token['expired_update_token']
-            self.session_storage[main_token] = data_token
-        else:
-            # create new token
-            data_token = dict(
-                timestamp=int(time.time()),
-                main_token=main_token,
-                timestamp_expired=token['expired_update_token'],
-                action='main'
-            )
-            self.session_storage[main_token] = data_token
+        :return: response
+        """
+        access_record, entries = self._token_entries(
+            record, self._read(record.main_token))
 
-        # remove the main token
-        data_access_token = copy.deepcopy(
-            self.session_storage[access_token])
+        if not self._has_room(entries):
+            return self.format(
+                error=True, msg='The session storage is full')
 
-        del data_access_token['main_token']
-        del data_access_token['action']
+        for key in used_keys:
+            self.session_storage.pop(key, None)
+        for key, entry in entries:
+            self._write(key, entry)
 
-        return self.format(result=data_access_token)
+        return self.format(result=access_record.to_response())
 
     def check_user(self, user_id: dict):
         # TODO add method
         return self.format()
 
+    @measured('check_key')
     def check_key(self, key: str):
         """
         Check key
@@ -171,19 +1030,22 @@ class SimpleAuthServer(BaseMixin):
         :return:
         """
 
-        if key not in self.session_storage:
+        entry = self._read(key)
+        if entry is None:
             return self.format(error=True, msg="The key is wrong")
 
         current_time = int(time.time())
         timestamp_default = current_time - 1
-        timestamp_expired = self.session_storage[key].get(
-            'timestamp_expired', timestamp_default)
+        timestamp_expired = entry.timestamp_expired
+        if timestamp_expired is None:
+            timestamp_expired = timestamp_default
         if timestamp_expired - current_time < self.time_delta:
             return self.format(
                 error=True, msg="This key has expired")
 
         return self.format(result=dict(key=key))
 
+    @measured('check_identifier')
     def check_identifier(self, identifier: str):
         """
         Check identifier
@@ -198,37 +1060,181 @@ class SimpleAuthServer(BaseMixin):
                 'The key', 'The identifier')
             return response
 
-        expected_action = 'identifier'
-        action = self.session_storage[identifier].get(
-            'action', '')
+        expected_action = SessionAction.identifier
+        entry = self._read(identifier)
 
-        if expected_action != action:
+        if expected_action != entry.action:
             return self.format(error=True, msg="The identifier is wrong")
 
-        return self.format(result=dict(identifier=identifier))
+        return self.format(result=dict(
+            identifier=identifier,
+            expired_identifier=entry.timestamp_expired))
 
+    @measured('check_token')
     def check_token(self, token: dict):
+        if self.token_secret is not None:
+            # signed access token, the storage is not used
+            claims = verify_token(
+                self.token_secret, token.get('access_token'))
+            if claims is None:
+                return self.format(
+                    error=True, msg='Access token have n\'t found')
+            return self.format(result=claims)
+
         # TODO add method
-        key = token.get('access_token')
-        if key in self.session_storage:
-            if 'user' in self.session_storage[key]:
-                return self.format()
+        entry = self._read(token.get('access_token'))
+        if entry is not None and entry.user is not None:
+            return self.format()
         return self.format(error=True, msg='Access token have n\'t found')
 
+    @measured('update_token')
     def update_token(self, token: dict):
-        # How can we check user_data:
-        response = self.get_token(token.get('update_token'))
+        """
+        Redeem the update token: it is consumed with the access token of
+        the pair, a new pair of the same login is issued
+
+        :param token: token with update_token
+
+        :return: the same response as get_token
+        """
+        return self._lineage_locked(
+            token.get('update_token'), self.__update_token)
+
+    def __update_token(self, update_token: str):
+        response = self.check_key(key=update_token)
+        if response.get('error', True):
+            response['msg'] = response.get('msg', '').replace(
+                'The key', 'The update token')
+            return response
 
-        return response
+        record = self._read(update_token)
+        if record.action != SessionAction.update:
+            return self.format(error=True, msg="The update token is wrong")
+
+        used_keys = [update_token]
+        access_token = (record.token or {}).get('access_token')
+        if self.token_secret is None and access_token is not None:
+            used_keys.append(access_token)
+        return self._issue_token(record, used_keys)
 
     def __update_main_token(self, key: str, main_token: str):
-        data = self.session_storage[key]
-        data['main_token'] = main_token
-        self.session_storage[key] = data
+        data = self._read(key)
+        data.main_token = main_token
+        self._write(key, data)
         return
 
+    def _batch(self, method, name: str, items: list, item_type: type):
+        """
+        Call the method for every item
+
+        :param method: method for one item
+        :param name: name of the parameter of the method
+        :param items: list of items
+        :param item_type: expected type of an item
+
+        :return: list of responses in the same order
+        """
+        if not isinstance(items, list):
+            return self.format(error=True, msg="The batch has to be a list")
+
+        if len(items) > self.max_batch_size:
+            return self.format(error=True, msg="The batch is too big")
+
+        result = []
+        for item in items:
+            if isinstance(item, item_type):
+                result.append(method(**{name: item}))
+            else:
+                result.append(self.format(
+                    error=True, msg="The item of the batch is wrong"))
+        return self.format(result=result)
+
+    @measured('get_tokens')
+    def get_tokens(self, identifiers: list):
+        """
+        get_token for many identifiers
+
+        :param identifiers: list of identifiers
+
+        :return: list of responses of get_token
+        """
+        return self._batch(self.get_token, 'identifier', identifiers, str)
+
+    @measured('check_tokens')
+    def check_tokens(self, tokens: list):
+        """
+        check_token for many tokens
+
+        :param tokens: list of tokens
+
+        :return: list of responses of check_token
+        """
+        return self._batch(self.check_token, 'token', tokens, dict)
+
+    @measured('update_tokens')
+    def update_tokens(self, tokens: list):
+        """
+        update_token for many tokens
+
+        :param tokens: list of tokens
+
+        :return: list of responses of update_token
+        """
+        return self._batch(self.update_token, 'token', tokens, dict)
+
+    def _keys_of_main_token(self, main_token: str) -> set:
+        """
+        Keys of the login lineage (scan of the storage if the storage
+        has got no index)
+
+        :param main_token: main token
+
+        :return: set of keys
+        """
+        keys_of_main_token = getattr(
+            self.session_storage, 'keys_of_main_token', None)
+        if keys_of_main_token is not None:
+            return keys_of_main_token(main_token)
+
+        return {key for key, value in self.session_storage.items()
+                if SessionEntry.from_value(value).main_token == main_token}
+
+    @measured('revoke_main_token')
+    def revoke_main_token(self, main_token: str):
+        """
+        Remove the login lineage: the main token, its identifiers,
+        access and update tokens
+
+        :param main_token: main token
+
+        :return:
+        """
+        while True:
+            keys = self._keys_of_main_token(main_token)
+            try:
+                with self._lock(main_token, *keys):
+                    removed = 0
+                    for key in keys:
+                        entry = self._read(key)
+                        if entry is not None and \
+                                entry.main_token == main_token:
+                            del self.session_storage[key]
+                            removed += 1
+                    return self.format(result=dict(removed=removed))
+            except SessionStorageConflict:
+                continue
+
+    @measured('merge_main_tokens')
     def merge_main_tokens(self, key1: str, key2: str) -> None:
 
+        while True:
+            try:
+                with self._lock(key1, key2):
+                    return self.__merge_main_tokens(key1, key2)
+            except SessionStorageConflict:
+                continue
+
+    def __merge_main_tokens(self, key1: str, key2: str):
         response = self.check_key(key1)
         if response.get('error', True):
             response['msg'] = response.get('msg', '').replace(
@@ -241,15 +1247,7 @@ class SimpleAuthServer(BaseMixin):
                 'The key', 'The key2')
             return response
 
-        main_token = self.session_storage[key1]['main_token']
+        main_token = self._read(key1).main_token
         self.__update_main_token(key2, main_token)
 
         return self.format()
-
-
-
-
-
-
-
-
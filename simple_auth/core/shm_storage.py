@@ -0,0 +1,398 @@
+"""
+Session storage in shared memory
+
+All worker processes of the host (e.g. gunicorn workers) see the same
+sessions. The storage is a fixed-slot open-addressing hash table in
+a multiprocessing.shared_memory segment, processes are synchronized by
+flock of a lock file (POSIX only).
+
+Deleted and expired slots are marked as deleted (tombstones). When the
+tombstones are more than a half of the slots which are not used, the
+table is rehashed in place, so misses don't scan the whole table.
+
+Segment: header, counters, then slot_count slots of slot_size bytes
+header: magic, slot_count, slot_size
+counters: number of used slots, number of deleted slots
+slot: state, length of key, length of value, timestamp_expired,
+      key and value (json) bytes
+"""
+import collections.abc
+import contextlib
+import fcntl
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import weakref
+import zlib
+from multiprocessing import resource_tracker, shared_memory
+
+from .server import SessionEntry, validate_session_storage_entry
+
+_header = struct.Struct('<8sQQ')
+_counters = struct.Struct('<QQ')
+_slot_header = struct.Struct('<BHIq')
+_magic = b'SIMPAUT2'
+
+_SLOT_EMPTY = 0
+_SLOT_USED = 1
+_SLOT_DELETED = 2
+
+# id -> storage of this process (mappings are not hashable)
+_storages = weakref.WeakValueDictionary()
+
+
+def _reopen_lock_files():
+    # flock belongs to the open file description, a forked worker needs
+    # its own description to be excluded from the parent and other workers
+    for storage in list(_storages.values()):
+        storage._open_lock_file()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reopen_lock_files)
+
+
+class SessionStorageFull(Exception):
+    """
+    All slots of the shared memory storage are used
+    """
+
+
+class SharedMemorySessionStorage(collections.abc.MutableMapping):
+    """
+    Shared memory session storage
+
+    The segment is created by the first process and attached by others,
+    create the server before fork (gunicorn --preload) or in every
+    worker, both work. The segment outlives the processes (a recycled
+    worker doesn't remove the sessions), `unlink` removes it.
+
+    Use it with SimpleAuthServer:
+
+    class SessionStorage(SharedMemorySessionStorage):
+        name = 'my_auth_sessions'
+
+    class Server(SimpleAuthServer):
+        session_storage_type = SessionStorage
+    """
+    name = 'simple_auth_sessions'
+    slot_count = 65536
+    # bytes per slot, key and json of the entry have to fit
+    slot_size = 512
+
+    def __init__(self, name: str = None):
+        if name is not None:
+            self.name = name
+
+        self._lock_file = None
+        self._open_lock_file()
+        _storages[id(self)] = self
+
+        with self.lock():
+            self._open()
+
+    def _open_lock_file(self):
+        """
+        Open the lock file for this process (after fork as well)
+
+        :return:
+        """
+        if self._lock_file is not None:
+            if self._lock_file.closed:
+                return
+            # the description of the parent, its lock stays with the parent
+            self._lock_file.close()
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._lock_file = open(os.path.join(
+            tempfile.gettempdir(), self.name + '.lock'), 'a+b')
+
+    def _open(self):
+        size = _header.size + _counters.size + \
+            self.slot_count * self.slot_size
+        try:
+            self._shm = shared_memory.SharedMemory(
+                name=self.name, create=True, size=size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+            magic, self.slot_count, self.slot_size = \
+                _header.unpack_from(self._shm.buf, 0)
+            if magic != _magic:
+                raise ValueError(
+                    'Shared memory {} is not a session storage'.format(
+                        self.name))
+        else:
+            _header.pack_into(
+                self._shm.buf, 0, _magic, self.slot_count, self.slot_size)
+            _counters.pack_into(self._shm.buf, _header.size, 0, 0)
+        # the resource tracker would remove the segment when the process
+        # exits (the creator as well), the segment is removed by `unlink`
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+
+        self._buf = self._shm.buf
+        self._data_size = self.slot_size - _slot_header.size
+
+    @contextlib.contextmanager
+    def lock(self, *keys):
+        """
+        Lock the storage for all processes and threads
+
+        :param keys: keys of the operation (the whole storage is locked)
+
+        :return:
+        """
+        with self._thread_lock:
+            if self._depth == 0:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        """
+        Detach the segment from the process
+
+        :return:
+        """
+        self._buf = None
+        self._shm.close()
+        self._lock_file.close()
+
+    def unlink(self):
+        """
+        Remove the segment (for all processes)
+
+        :return:
+        """
+        # SharedMemory.unlink unregisters the segment from the tracker
+        resource_tracker.register(self._shm._name, 'shared_memory')
+        self._shm.unlink()
+
+    # hash table
+
+    def _offset(self, slot: int) -> int:
+        return _header.size + _counters.size + slot * self.slot_size
+
+    def _counts(self):
+        """
+        :return: (number of used slots, number of deleted slots)
+        """
+        return _counters.unpack_from(self._buf, _header.size)
+
+    def _add_counts(self, used: int, deleted: int):
+        used_count, deleted_count = self._counts()
+        _counters.pack_into(self._buf, _header.size,
+                            used_count + used, deleted_count + deleted)
+
+    def count_entries(self) -> int:
+        """
+        Number of used slots from the counters, without a scan
+        (expired entries are counted until they are removed)
+
+        :return: number
+        """
+        with self.lock():
+            return self._counts()[0]
+
+    def _maybe_rehash(self):
+        used, deleted = self._counts()
+        if deleted and deleted * 2 > self.slot_count - used:
+            self._rehash()
+
+    def _rehash(self):
+        """
+        Rewrite the live entries without tombstones and expired entries
+
+        :return:
+        """
+        buf = self._buf
+        current_time = int(time.time())
+        live = []
+        for slot in range(self.slot_count):
+            offset = self._offset(slot)
+            state, key_length, value_length, timestamp_expired = \
+                _slot_header.unpack_from(buf, offset)
+            if state == _SLOT_USED and timestamp_expired >= current_time:
+                start = offset + _slot_header.size
+                live.append((
+                    bytes(buf[start:start + key_length]),
+                    bytes(buf[offset:start + key_length + value_length])))
+            buf[offset] = _SLOT_EMPTY
+
+        for key, data in live:
+            slot = zlib.crc32(key) % self.slot_count
+            while buf[self._offset(slot)] != _SLOT_EMPTY:
+                slot = (slot + 1) % self.slot_count
+            offset = self._offset(slot)
+            buf[offset:offset + len(data)] = data
+
+        _counters.pack_into(buf, _header.size, len(live), 0)
+
+    def _probe(self, key: bytes):
+        """
+        Slots of the key: the slot with the key (or None) and the first
+        free slot of the chain (or None)
+
+        :param key: key
+
+        :return: (slot of the key, free slot)
+        """
+        buf = self._buf
+        current_time = int(time.time())
+        free = None
+        slot = zlib.crc32(key) % self.slot_count
+
+        for _ in range(self.slot_count):
+            offset = self._offset(slot)
+            state, key_length, _, timestamp_expired = \
+                _slot_header.unpack_from(buf, offset)
+
+            if state == _SLOT_EMPTY:
+                if free is None:
+                    free = slot
+                return None, free
+
+            if state == _SLOT_USED:
+                start = offset + _slot_header.size
+                if timestamp_expired < current_time:
+                    # expired entries are removed on the way
+                    buf[offset] = _SLOT_DELETED
+                    state = _SLOT_DELETED
+                    self._add_counts(-1, 1)
+                elif buf[start:start + key_length] == key:
+                    return slot, free
+
+            if state == _SLOT_DELETED and free is None:
+                free = slot
+
+            slot = (slot + 1) % self.slot_count
+
+        return None, free
+
+    def _read_slot(self, slot: int):
+        offset = self._offset(slot)
+        _, key_length, value_length, _ = \
+            _slot_header.unpack_from(self._buf, offset)
+        start = offset + _slot_header.size + key_length
+        return bytes(self._buf[start:start + value_length])
+
+    # mapping
+
+    def __getitem__(self, key):
+        with self.lock():
+            slot, _ = self._probe(key.encode())
+            if slot is None:
+                raise KeyError(key)
+            value = self._read_slot(slot)
+        return SessionEntry.from_dict(json.loads(value))
+
+    def __contains__(self, key):
+        with self.lock():
+            return self._probe(key.encode())[0] is not None
+
+    def __setitem__(self, key, value):
+        if isinstance(value, SessionEntry):
+            value = value.to_dict()
+        value = validate_session_storage_entry(value)
+        self.set_trusted(key, SessionEntry.from_dict(value))
+
+    @staticmethod
+    def _encode(key: str, value: SessionEntry):
+        return key.encode(), json.dumps(
+            value.to_dict(), separators=(',', ':')).encode()
+
+    def has_room(self, entries: list) -> bool:
+        """
+        Can the entries be written: they fit into slots and there are
+        enough free slots for the new keys. The server checks it before
+        a multi-step operation changes anything.
+
+        :param entries: list of (key, SessionEntry)
+
+        :return: bool
+        """
+        with self.lock():
+            self._maybe_rehash()
+            new_keys = 0
+            for key, value in entries:
+                key_bytes, value_bytes = self._encode(key, value)
+                if len(key_bytes) + len(value_bytes) > self._data_size:
+                    return False
+                if self._probe(key_bytes)[0] is None:
+                    new_keys += 1
+
+            used, _ = self._counts()
+            if self.slot_count - used >= new_keys:
+                return True
+            # used slots may have expired entries
+            self._rehash()
+            used, _ = self._counts()
+            return self.slot_count - used >= new_keys
+
+    def set_trusted(self, key, value):
+        """
+        Write an entry without validation
+        (only for entries built by the server)
+
+        :param key: key
+        :param value: valid SessionEntry
+
+        :return:
+        """
+        key_bytes, value_bytes = self._encode(key, value)
+        if len(key_bytes) + len(value_bytes) > self._data_size:
+            raise ValueError(
+                'The entry is bigger than slot_size of the storage')
+
+        with self.lock():
+            self._maybe_rehash()
+            slot, free = self._probe(key_bytes)
+            if slot is None:
+                if free is None:
+                    raise SessionStorageFull()
+                slot = free
+                if self._buf[self._offset(slot)] == _SLOT_DELETED:
+                    self._add_counts(1, -1)
+                else:
+                    self._add_counts(1, 0)
+
+            offset = self._offset(slot)
+            _slot_header.pack_into(
+                self._buf, offset, _SLOT_USED, len(key_bytes),
+                len(value_bytes), value.timestamp_expired)
+            start = offset + _slot_header.size
+            data = key_bytes + value_bytes
+            self._buf[start:start + len(data)] = data
+
+    def __delitem__(self, key):
+        with self.lock():
+            slot, _ = self._probe(key.encode())
+            if slot is None:
+                raise KeyError(key)
+            self._buf[self._offset(slot)] = _SLOT_DELETED
+            self._add_counts(-1, 1)
+            self._maybe_rehash()
+
+    def __iter__(self):
+        keys = []
+        current_time = int(time.time())
+        with self.lock():
+            buf = self._buf
+            for slot in range(self.slot_count):
+                offset = self._offset(slot)
+                state, key_length, _, timestamp_expired = \
+                    _slot_header.unpack_from(buf, offset)
+                if state == _SLOT_USED and timestamp_expired >= current_time:
+                    start = offset + _slot_header.size
+                    keys.append(bytes(buf[start:start + key_length]).decode())
+        return iter(keys)
+
+    def __len__(self):
+        return sum(1 for _ in self)
@@ -0,0 +1,86 @@
+"""
+Signed access tokens
+
+The access token carries the user id, the expiry and the main token and
+is signed by HMAC-SHA256, so the token is checked without the session
+storage: by the server or by the client with the same secret.
+
+token: base64url(json of claims) + '.' + base64url(signature)
+claims: {"user_id": .., "exp": .., "main_token": ..}
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _secret_bytes(secret: (str, bytes)) -> bytes:
+    if isinstance(secret, str):
+        return secret.encode()
+    return secret
+
+
+def _signature(secret: (str, bytes), payload: str) -> str:
+    return _encode(hmac.new(
+        _secret_bytes(secret), payload.encode(), hashlib.sha256).digest())
+
+
+def sign_token(secret: (str, bytes), user_id: (int, str),
+               timestamp_expired: int, main_token: str) -> str:
+    """
+    Make the signed access token
+
+    :param secret: secret of the server
+    :param user_id: id of the user
+    :param timestamp_expired: expiry of the token
+    :param main_token: main token of the login
+
+    :return: access token
+    """
+    payload = _encode(json.dumps(
+        dict(user_id=user_id, exp=timestamp_expired, main_token=main_token),
+        separators=(',', ':')).encode())
+    return '{}.{}'.format(payload, _signature(secret, payload))
+
+
+def verify_token(secret: (str, bytes), access_token: str,
+                 current_time: int = None):
+    """
+    Check the signature and the expiry of the access token
+
+    :param secret: secret of the server
+    :param access_token: access token
+    :param current_time: timestamp, now by default
+
+    :return: claims (dict) or None if the token is wrong or expired
+    """
+    if not isinstance(access_token, str) or access_token.count('.') != 1:
+        return None
+
+    payload, signature = access_token.split('.')
+    if not hmac.compare_digest(
+            signature.encode(), _signature(secret, payload).encode()):
+        return None
+
+    try:
+        claims = json.loads(_decode(payload))
+    except ValueError:
+        return None
+
+    if current_time is None:
+        current_time = int(time.time())
+    if not isinstance(claims, dict) or \
+            not isinstance(claims.get('exp'), int) or \
+            claims['exp'] <= current_time:
+        return None
+
+    return claims
@@ -0,0 +1,282 @@
+"""
+Binary snapshot of a session storage for warm restarts
+
+File: magic, then blocks (type, length of body, body)
+
+'P' payloads: json array of user and token dicts, every payload is
+    written once and referenced by number (entries of one login share
+    them)
+'U' entries with UUID key and main token: fixed-size records,
+    UUIDs are stored as 16 bytes
+'S' entries with other keys: length-prefixed utf-8 keys
+
+Restore reads the file block by block and skips expired entries.
+"""
+import contextlib
+import gc
+import json
+import os
+import struct
+import time
+
+from .server import SessionEntry, SessionAction
+
+_magic = b'SASNAP01'
+_block = struct.Struct('<cQ')
+_count = struct.Struct('<I')
+# key, main_token, timestamp, timestamp_expired, action, user, token
+_uuid_entry = struct.Struct('<16s16sqqBii')
+_string_entry = struct.Struct('<qqBii')
+_string_length = struct.Struct('<H')
+
+_actions = list(SessionAction)
+
+# entries per block
+block_size = 65536
+
+
+def _uuid_bytes(value: str):
+    """
+    16 bytes of the UUID in the canonical form or None
+
+    :param value: string
+
+    :return: bytes or None
+    """
+    if len(value) != 36 or value[8] != '-' or value[13] != '-' or \
+            value[18] != '-' or value[23] != '-' or value != value.lower():
+        return None
+    try:
+        return bytes.fromhex(
+            value[:8] + value[9:13] + value[14:18] + value[19:23] +
+            value[24:])
+    except ValueError:
+        return None
+
+
+def _uuid_string(value: bytes) -> str:
+    value = value.hex()
+    return '{}-{}-{}-{}-{}'.format(
+        value[:8], value[8:12], value[12:16], value[16:20], value[20:])
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    # millions of new objects make the cyclic gc run again and again
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+class _Writer:
+
+    def __init__(self, file):
+        self.file = file
+        self.payload_ids = {}
+        self.object_ids = {}
+        self.payloads = []
+        self.uuid_entries = []
+        self.string_entries = []
+        self.count = 0
+
+    def payload_id(self, value) -> int:
+        if value is None:
+            return -1
+        # entries of one login share the same dict
+        known = self.object_ids.get(id(value))
+        if known is not None and known[0] is value:
+            return known[1]
+
+        data = json.dumps(value, separators=(',', ':'))
+        payload_id = self.payload_ids.get(data)
+        if payload_id is None:
+            payload_id = len(self.payload_ids)
+            self.payload_ids[data] = payload_id
+            self.payloads.append(data)
+        self.object_ids[id(value)] = (value, payload_id)
+        return payload_id
+
+    def add(self, key: str, entry: SessionEntry):
+        user = self.payload_id(entry.user)
+        token = self.payload_id(entry.token)
+        action = _actions.index(entry.action)
+
+        key_bytes = _uuid_bytes(key)
+        main_token_bytes = _uuid_bytes(entry.main_token)
+        if key_bytes is not None and main_token_bytes is not None:
+            self.uuid_entries.append(_uuid_entry.pack(
+                key_bytes, main_token_bytes, entry.timestamp,
+                entry.timestamp_expired, action, user, token))
+        else:
+            key_bytes = key.encode()
+            main_token_bytes = entry.main_token.encode()
+            self.string_entries.append(b''.join((
+                _string_length.pack(len(key_bytes)), key_bytes,
+                _string_length.pack(len(main_token_bytes)), main_token_bytes,
+                _string_entry.pack(
+                    entry.timestamp, entry.timestamp_expired, action,
+                    user, token))))
+
+        self.count += 1
+        if len(self.uuid_entries) + len(self.string_entries) >= block_size:
+            self.flush()
+
+    def write_block(self, block_type: bytes, items: list, count: int = None):
+        if count is None:
+            count = len(items)
+        body = _count.pack(count) + b''.join(items)
+        self.file.write(_block.pack(block_type, len(body)))
+        self.file.write(body)
+
+    def flush(self):
+        # payloads go before the entries which refer to them
+        if self.payloads:
+            data = '[' + ','.join(self.payloads) + ']'
+            self.write_block(b'P', [data.encode()], len(self.payloads))
+            self.payloads = []
+        if self.uuid_entries:
+            self.write_block(b'U', self.uuid_entries)
+            self.uuid_entries = []
+        if self.string_entries:
+            self.write_block(b'S', self.string_entries)
+            self.string_entries = []
+
+
+def dump_session_storage(storage, file) -> int:
+    """
+    Write the snapshot of the storage
+
+    :param storage: session storage
+    :param file: binary file
+
+    :return: number of entries
+    """
+    file.write(_magic)
+    writer = _Writer(file)
+    with _gc_paused():
+        for key in list(storage):
+            value = storage.get(key)
+            if value is None:
+                continue
+            writer.add(key, SessionEntry.from_value(value))
+        writer.flush()
+    return writer.count
+
+
+def load_session_storage(file, storage) -> int:
+    """
+    Restore entries from the snapshot, expired entries are skipped
+
+    :param file: binary file
+    :param storage: session storage
+
+    :return: number of restored entries
+    """
+    if file.read(len(_magic)) != _magic:
+        raise ValueError('The file is not a snapshot of a session storage')
+
+    write = getattr(storage, 'set_trusted', None) or storage.__setitem__
+    current_time = int(time.time())
+
+    with _gc_paused():
+        return _load_blocks(file, write, current_time)
+
+
+def _load_blocks(file, write, current_time: int) -> int:
+    # payload number -> user or token dict
+    payloads = []
+    main_tokens = {}
+    restored = 0
+
+    while True:
+        header = file.read(_block.size)
+        if not header:
+            break
+        block_type, length = _block.unpack(header)
+        body = memoryview(file.read(length))
+        count, = _count.unpack_from(body)
+
+        if block_type == b'P':
+            # one json.loads for the whole block
+            payloads.extend(json.loads(bytes(body[_count.size:])))
+
+        elif block_type == b'U':
+            records = _uuid_entry.iter_unpack(body[_count.size:])
+            for key, main_token, timestamp, timestamp_expired, action, \
+                    user, token in records:
+                if timestamp_expired < current_time:
+                    continue
+                main_token_string = main_tokens.get(main_token)
+                if main_token_string is None:
+                    main_token_string = main_tokens[main_token] = \
+                        _uuid_string(main_token)
+                write(_uuid_string(key), SessionEntry(
+                    timestamp, timestamp_expired, main_token_string,
+                    _actions[action],
+                    None if user < 0 else payloads[user],
+                    None if token < 0 else payloads[token]))
+                restored += 1
+
+        elif block_type == b'S':
+            offset = _count.size
+            for _ in range(count):
+                size, = _string_length.unpack_from(body, offset)
+                offset += _string_length.size
+                key = bytes(body[offset:offset + size]).decode()
+                offset += size
+                size, = _string_length.unpack_from(body, offset)
+                offset += _string_length.size
+                main_token = bytes(body[offset:offset + size]).decode()
+                offset += size
+                timestamp, timestamp_expired, action, user, token = \
+                    _string_entry.unpack_from(body, offset)
+                offset += _string_entry.size
+                if timestamp_expired < current_time:
+                    continue
+                write(key, SessionEntry(
+                    timestamp, timestamp_expired, main_token,
+                    _actions[action],
+                    None if user < 0 else payloads[user],
+                    None if token < 0 else payloads[token]))
+                restored += 1
+
+        else:
+            raise ValueError('Unknown block {!r} in the snapshot'.format(
+                block_type))
+
+    return restored
+
+
+def save_snapshot(storage, path: str) -> int:
+    """
+    Write the snapshot of the storage to the file atomically
+
+    :param storage: session storage
+    :param path: path of the snapshot
+
+    :return: number of entries
+    """
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        count = dump_session_storage(storage, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+    return count
+
+
+def restore_snapshot(storage, path: str) -> int:
+    """
+    Restore entries from the snapshot file
+
+    :param storage: session storage
+    :param path: path of the snapshot
+
+    :return: number of restored entries
+    """
+    with open(path, 'rb') as file:
+        return load_session_storage(file, storage)
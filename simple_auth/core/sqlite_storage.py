@@ -0,0 +1,198 @@
+"""
+Session storage in SQLite
+
+The database is used in WAL mode, every thread has got own connection.
+`lock` opens one transaction for a multi-step operation of the server,
+so get_token is one commit. Expired entries are purged in batches
+by writes.
+"""
+import collections.abc
+import contextlib
+import itertools
+import json
+import sqlite3
+import threading
+import time
+
+from .server import SessionEntry, validate_session_storage_entry
+
+
+class SQLiteSessionStorage(collections.abc.MutableMapping):
+    """
+    SQLite session storage
+
+    Use it with SimpleAuthServer:
+
+    class SessionStorage(SQLiteSessionStorage):
+        path = '/var/lib/simple_auth/sessions.sqlite3'
+
+    class Server(SimpleAuthServer):
+        session_storage_type = SessionStorage
+    """
+    path = 'simple_auth_sessions.sqlite3'
+    # sec, how long to wait for the lock of the database
+    timeout = 5.0
+    # every purge_every-th write removes up to purge_batch_size expired
+    # entries (like the sweep of TTLSessionStorage), 0 - purge_expired
+    # has to be called by a timer
+    purge_every = 100
+    purge_batch_size = 100
+
+    sql_create = (
+        'CREATE TABLE IF NOT EXISTS session_storage ('
+        'key TEXT PRIMARY KEY, '
+        'timestamp_expired INTEGER NOT NULL, '
+        'main_token TEXT, '
+        'value TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS session_storage_timestamp_expired '
+        'ON session_storage (timestamp_expired)',
+        'CREATE INDEX IF NOT EXISTS session_storage_main_token '
+        'ON session_storage (main_token)',
+    )
+    sql_select = 'SELECT value FROM session_storage WHERE key = ?'
+    sql_contains = 'SELECT 1 FROM session_storage WHERE key = ?'
+    sql_upsert = (
+        'INSERT INTO session_storage '
+        '(key, timestamp_expired, main_token, value) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT (key) DO UPDATE SET '
+        'timestamp_expired = excluded.timestamp_expired, '
+        'main_token = excluded.main_token, value = excluded.value')
+    sql_delete = 'DELETE FROM session_storage WHERE key = ?'
+    sql_keys = 'SELECT key FROM session_storage'
+    sql_keys_of_main_token = (
+        'SELECT key FROM session_storage WHERE main_token = ?')
+    sql_count = 'SELECT COUNT(*) FROM session_storage'
+    sql_purge = (
+        'DELETE FROM session_storage WHERE key IN ('
+        'SELECT key FROM session_storage WHERE timestamp_expired < ? '
+        'LIMIT ?)')
+
+    def __init__(self, path: str = None):
+        if path is not None:
+            self.path = path
+
+        self._local = threading.local()
+        self._writes = itertools.count(1)
+        connection = self._connection()
+        for sql in self.sql_create:
+            connection.execute(sql)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # isolation_level=None: transactions are opened by `lock`
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None,
+                check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.depth = 0
+        return connection
+
+    @contextlib.contextmanager
+    def lock(self, *keys):
+        """
+        Run a multi-step operation in one transaction
+
+        :param keys: keys of the operation (the whole database is locked)
+
+        :return:
+        """
+        connection = self._connection()
+        if self._local.depth == 0:
+            connection.execute('BEGIN IMMEDIATE')
+        self._local.depth += 1
+        try:
+            yield
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                connection.execute('ROLLBACK')
+            raise
+        else:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                connection.execute('COMMIT')
+
+    def close(self):
+        """
+        Close the connection of the current thread
+
+        :return:
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def purge_expired(self, limit: int = 1000) -> int:
+        """
+        Remove expired entries
+
+        :param limit: max number of removed entries
+
+        :return: number of removed entries
+        """
+        cursor = self._connection().execute(
+            self.sql_purge, (int(time.time()), limit))
+        return cursor.rowcount
+
+    def keys_of_main_token(self, main_token: str) -> set:
+        """
+        Keys of the login lineage
+
+        :param main_token: main token
+
+        :return: set of keys
+        """
+        rows = self._connection().execute(
+            self.sql_keys_of_main_token, (main_token,)).fetchall()
+        return {row[0] for row in rows}
+
+    # mapping
+
+    def __getitem__(self, key):
+        row = self._connection().execute(self.sql_select, (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return SessionEntry.from_dict(json.loads(row[0]))
+
+    def __contains__(self, key):
+        return self._connection().execute(
+            self.sql_contains, (key,)).fetchone() is not None
+
+    def __setitem__(self, key, value):
+        if isinstance(value, SessionEntry):
+            value = value.to_dict()
+        value = validate_session_storage_entry(value)
+        self.set_trusted(key, SessionEntry.from_dict(value))
+
+    def set_trusted(self, key, value):
+        """
+        Write an entry without validation
+        (only for entries built by the server)
+
+        :param key: key
+        :param value: valid SessionEntry
+
+        :return:
+        """
+        self._connection().execute(self.sql_upsert, (
+            key, value.timestamp_expired, value.main_token,
+            json.dumps(value.to_dict(), separators=(',', ':'))))
+        if self.purge_every and \
+                next(self._writes) % self.purge_every == 0:
+            self.purge_expired(limit=self.purge_batch_size)
+
+    def __delitem__(self, key):
+        cursor = self._connection().execute(self.sql_delete, (key,))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def __iter__(self):
+        rows = self._connection().execute(self.sql_keys).fetchall()
+        return (row[0] for row in rows)
+
+    def __len__(self):
+        return self._connection().execute(self.sql_count).fetchone()[0]
@@ -0,0 +1,112 @@
+"""
+Generators of identifiers and tokens
+
+SimpleAuthServer uses str(uuid.uuid4()) by default. The generators here
+read random bytes from os.urandom in bulk (one system call for many
+tokens) and render the tokens in batches:
+
+BufferedUUIDTokenGenerator - the same 36-character UUID4 strings
+URLSafeTokenGenerator - 22-character URL-safe strings (132 random bits)
+
+class Server(SimpleAuthServer):
+    token_generator_type = URLSafeTokenGenerator
+"""
+import base64
+import os
+import threading
+import weakref
+
+# generators of the process, the buffers are dropped after fork
+_generators = weakref.WeakSet()
+
+
+def _clear_after_fork():
+    for generator in list(_generators):
+        generator.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_clear_after_fork)
+
+
+class BufferedTokenGenerator:
+    """
+    Base class: tokens rendered from one os.urandom call
+
+    Forked processes never share tokens: the buffer is dropped in
+    the child.
+    """
+    # random bytes of one token
+    token_bytes = 16
+    # tokens per os.urandom call
+    buffer_tokens = 1024
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = []
+        _generators.add(self)
+
+    def buffer_size(self) -> int:
+        return self.token_bytes * self.buffer_tokens
+
+    def render(self, data: bytes) -> list:
+        """
+        Tokens of the random bytes
+
+        :param data: buffer_size() random bytes
+
+        :return: list of tokens
+        """
+        raise NotImplementedError()
+
+    def clear(self):
+        self._tokens = []
+
+    def __call__(self) -> str:
+        try:
+            # list.pop is atomic, no lock is needed
+            return self._tokens.pop()
+        except IndexError:
+            pass
+
+        with self._lock:
+            if not self._tokens:
+                self._tokens = self.render(os.urandom(self.buffer_size()))
+            return self._tokens.pop()
+
+
+class BufferedUUIDTokenGenerator(BufferedTokenGenerator):
+    """
+    UUID4 strings, the same format as str(uuid.uuid4())
+    """
+
+    def render(self, data: bytes) -> list:
+        data = data.hex()
+        # version 4, variant RFC 4122
+        variant = {digit: '89ab'[int(digit, 16) & 3]
+                   for digit in '0123456789abcdef'}
+        return ['{}-{}-4{}-{}{}-{}'.format(
+            data[i:i + 8], data[i + 8:i + 12], data[i + 13:i + 16],
+            variant[data[i + 16]], data[i + 17:i + 20], data[i + 20:i + 32])
+            for i in range(0, len(data), 32)]
+
+
+class URLSafeTokenGenerator(BufferedTokenGenerator):
+    """
+    22-character URL-safe strings (132 random bits)
+
+    The whole buffer is encoded by base64url at once and cut into
+    tokens, every character carries 6 random bits.
+    """
+    token_length = 22
+
+    def buffer_size(self) -> int:
+        # 4 characters per 3 bytes, no padding
+        groups = -(-self.token_length * self.buffer_tokens // 4)
+        return groups * 3
+
+    def render(self, data: bytes) -> list:
+        data = base64.urlsafe_b64encode(data).decode()
+        length = self.token_length
+        return [data[i:i + length]
+                for i in range(0, length * self.buffer_tokens, length)]
@@ -0,0 +1,253 @@
+"""
+Test simple_auth.core.async_client
+
+"""
+import asyncio
+import json
+
+import unittest
+
+from simple_auth.core.async_client import SimpleAuthAsyncClient, \
+    get_pool, close_pools
+from simple_auth.core.circuit_breaker import reset_circuit_breakers
+from simple_auth.core.client import deadline
+
+
+class FakeAuthServer:
+    """
+    HTTP/1.1 server answering {'error': False, 'result': parameters}
+    """
+
+    def __init__(self, chunked=False, delay=0):
+        self.chunked = chunked
+        self.delay = delay
+        self.connections = 0
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.server = None
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    await reader.readuntil(b'\r\n')
+                except asyncio.IncompleteReadError:
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readuntil(b'\r\n')
+                    if line == b'\r\n':
+                        break
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parameters = json.loads(await reader.readexactly(
+                    int(headers['content-length'])))
+
+                self.requests += 1
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                try:
+                    await asyncio.sleep(self.delay)
+                finally:
+                    self.active -= 1
+
+                body = json.dumps(dict(
+                    error=False, msg='', result=parameters)).encode()
+                if self.chunked:
+                    writer.write(
+                        b'HTTP/1.1 200 OK\r\n'
+                        b'Transfer-Encoding: chunked\r\n\r\n' +
+                        b'%x\r\n%s\r\n0\r\n\r\n' % (len(body), body))
+                else:
+                    writer.write(
+                        b'HTTP/1.1 200 OK\r\n'
+                        b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self.handle, '127.0.0.1', 0)
+        return 'http://127.0.0.1:{}/auth'.format(
+            self.server.sockets[0].getsockname()[1])
+
+    async def stop(self):
+        self.server.close()
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        reset_circuit_breakers()
+
+    def tearDown(self):
+        reset_circuit_breakers()
+
+    def run_with_server(self, coroutine, **kwargs):
+        async def main():
+            server = FakeAuthServer(**kwargs)
+            url = await server.start()
+            try:
+                return await coroutine(server, url)
+            finally:
+                close_pools()
+                await server.stop()
+        return asyncio.run(main())
+
+    def test_commands(self):
+        """
+        Test the surface of SimpleAuthClient
+
+        :return:
+        """
+        async def check(server, url):
+            client = SimpleAuthAsyncClient(url)
+            self.assertEqual(
+                await client.get_identifier(),
+                dict(error=False, msg='',
+                     result=dict(command='get_identifier')))
+            self.assertEqual(
+                (await client.get_token('identifier'))['result'],
+                dict(command='get_token', identifier='identifier'))
+            self.assertEqual(
+                (await client.update_token(dict(a=1)))['result'],
+                dict(command='update_token', token=dict(a=1)))
+            self.assertTrue(await client.is_valid_identifier('identifier'))
+            self.assertEqual(
+                client.get_auth_url('identifier', 'http://site/page'),
+                url + '?identifier=identifier&'
+                      'redirect_url=http%3A%2F%2Fsite%2Fpage')
+            # one kept connection
+            self.assertEqual(server.connections, 1)
+
+        self.run_with_server(check)
+        self.run_with_server(check, chunked=True)
+
+    def test_concurrent_requests(self):
+        """
+        Test many requests in flight share the pool
+
+        :return:
+        """
+        class Client(SimpleAuthAsyncClient):
+            max_connections = 5
+
+        async def check(server, url):
+            client = Client(url)
+            responses = await asyncio.gather(*(
+                client.get_token(str(i)) for i in range(50)))
+            self.assertEqual(
+                [response['result']['identifier']
+                 for response in responses],
+                [str(i) for i in range(50)])
+            self.assertEqual(server.requests, 50)
+            self.assertEqual(server.max_active, 5)
+            self.assertEqual(server.connections, 5)
+            self.assertEqual(
+                get_pool(client.url_server_auth_api, 5).opened, 5)
+
+        self.run_with_server(check, delay=0.01)
+
+    def test_cancellation(self):
+        """
+        Test a cancelled request releases its connection
+
+        :return:
+        """
+        class Client(SimpleAuthAsyncClient):
+            max_connections = 1
+            breaker_failure_threshold = 1
+
+        async def check(server, url):
+            client = Client(url)
+            task = asyncio.ensure_future(client.get_identifier())
+            while not server.active:
+                await asyncio.sleep(0.001)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            # not a failure of the server
+            self.assertTrue(client.is_available())
+            pool = get_pool(client.url_server_auth_api, 1)
+            self.assertEqual(pool._idle, [])
+
+            server.delay = 0
+            response = await client.get_identifier()
+            self.assertFalse(response['error'])
+            self.assertEqual(server.connections, 2)
+
+        self.run_with_server(check, delay=10)
+
+    def test_timeout(self):
+        """
+        Test timeout and circuit breaker
+
+        :return:
+        """
+        class Client(SimpleAuthAsyncClient):
+            connect_timeout = 0.05
+            read_timeout = 0.05
+            breaker_failure_threshold = 1
+
+        async def check(server, url):
+            client = Client(url)
+            self.assertEqual(
+                await client.get_identifier(),
+                dict(error=True, msg='Transfer data error', result=None))
+            self.assertFalse(client.is_available())
+            self.assertEqual(
+                await client.get_identifier(),
+                dict(error=True, msg='Auth server is unavailable',
+                     result=None))
+
+        self.run_with_server(check, delay=10)
+
+
+    def test_pool_wait(self):
+        """
+        Test the wait for a free connection is not a timeout of the server
+
+        :return:
+        """
+        class Client(SimpleAuthAsyncClient):
+            max_connections = 1
+            connect_timeout = 0.2
+            read_timeout = 0.2
+            breaker_failure_threshold = 1
+
+        async def check(server, url):
+            client = Client(url)
+            # 5 requests one by one take longer than the timeouts
+            responses = await asyncio.gather(*(
+                client.get_token(str(i)) for i in range(5)))
+            self.assertEqual(
+                [response['error'] for response in responses], [False] * 5)
+            self.assertTrue(client.is_available())
+
+            # the deadline of the scope limits the wait
+            async def with_deadline(identifier):
+                with deadline(0.15):
+                    return await client.get_token(identifier)
+
+            responses = await asyncio.gather(*(
+                with_deadline(str(i)) for i in range(3)))
+            self.assertEqual(
+                [response['msg'] for response in responses],
+                ['', 'Deadline exceeded', 'Deadline exceeded'])
+            # the second request has been sent, its timeout has been cut
+            self.assertTrue(client.is_available())
+            self.assertEqual(server.requests, 7)
+
+        self.run_with_server(check, delay=0.1)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
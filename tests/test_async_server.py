@@ -0,0 +1,334 @@
+"""
+Test simple_auth.core.async_server
+
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+import unittest
+from unittest import mock
+
+from simple_auth.core.async_server import AsyncSimpleAuthServer, \
+    AsyncSessionStorageAdapter
+from simple_auth.core.server import SessionAction, SessionEntry, \
+    SessionStorageConflict
+from simple_auth.core.shm_storage import SharedMemorySessionStorage
+from simple_auth.core.sqlite_storage import SQLiteSessionStorage
+
+
+class FakeSimpleAuthUser:
+    id: int = 10
+
+    @property
+    def is_simple_auth_user(self):
+        return True
+
+    def to_storage_dict(self):
+        return dict(
+            id=self.id,
+            name='User name',
+            level=5,
+            access=[1, 2, 3]
+        )
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+class SimpleAuthServer(AsyncSimpleAuthServer):
+    user_model = FakeSimpleAuthUser
+
+
+async def login(server, user_id):
+    identifier = (await server.get_identifier())['result']['identifier']
+    await server.add_user_data(identifier=identifier, user_id=user_id)
+    return await server.get_token(identifier=identifier)
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_workflow(self):
+        """
+        get_identifier, get_token, check_token, merge_main_tokens,
+        revoke_main_token
+
+        :return:
+        """
+
+        async def workflow():
+            server = SimpleAuthServer()
+
+            identifier = (await server.get_identifier())['result'][
+                'identifier']
+            self.assertEqual(
+                await server.get_token(identifier=identifier),
+                {'error': True, 'msg': 'Have no information about user',
+                 'result': None})
+
+            await server.add_user_data(identifier=identifier, user_id=3)
+            main_token = (await server.session_storage.get(
+                identifier)).main_token
+            response = await server.get_token(identifier=identifier)
+            self.assertFalse(response['error'])
+            self.assertEqual(response['result']['user']['id'], 3)
+            token = response['result']['token']
+
+            self.assertEqual(
+                (await server.get_token(identifier=identifier))['msg'],
+                'The identifier is wrong')
+            self.assertFalse(
+                (await server.check_token(token=token))['error'])
+            self.assertTrue((await server.check_token(
+                token={'access_token': 'wrong'}))['error'])
+
+            # the update token is redeemed once for a new pair
+            response = await server.update_token(token=token)
+            self.assertFalse(response['error'])
+            self.assertTrue((await server.check_token(token=token))['error'])
+            self.assertEqual(
+                (await server.update_token(token=token))['msg'],
+                'The update token is wrong')
+            token = response['result']['token']
+            self.assertEqual(
+                (await server.session_storage.get(
+                    token['update_token'])).main_token,
+                main_token)
+
+            identifier2 = (await server.get_identifier())['result'][
+                'identifier']
+            self.assertFalse((await server.merge_main_tokens(
+                key1=token['access_token'], key2=identifier2))['error'])
+            self.assertEqual(
+                (await server.merge_main_tokens(
+                    key1='wrong', key2=identifier2))['msg'],
+                'The key1 is wrong')
+
+            response = await server.revoke_main_token(main_token=main_token)
+            # main, access, update tokens and identifier2
+            self.assertEqual(response['result'], {'removed': 4})
+            self.assertEqual(len(server.session_storage), 0)
+
+        asyncio.run(workflow())
+
+    def test_concurrent_logins(self):
+        """
+        Many logins in one event loop
+
+        :return:
+        """
+
+        async def logins():
+            server = SimpleAuthServer()
+            responses = await asyncio.gather(
+                *[login(server, user_id) for user_id in range(1000)])
+            self.assertEqual(
+                [response['result']['user']['id']
+                 for response in responses],
+                list(range(1000)))
+            # access, update and main tokens of every login
+            self.assertEqual(len(server.session_storage), 3000)
+
+        asyncio.run(logins())
+
+    def test_conflict(self):
+        """
+        get_token is repeated after SessionStorageConflict
+
+        :return:
+        """
+
+        async def conflict():
+            server = SimpleAuthServer()
+            identifier = (await server.get_identifier())['result'][
+                'identifier']
+            await server.add_user_data(identifier=identifier, user_id=1)
+
+            lock = server.session_storage.lock
+            conflicts = [SessionStorageConflict()]
+
+            def lock_with_conflict(*keys):
+                if conflicts:
+                    raise conflicts.pop()
+                return lock(*keys)
+
+            with mock.patch.object(
+                    server.session_storage, 'lock', lock_with_conflict):
+                response = await server.get_token(identifier=identifier)
+            self.assertFalse(response['error'])
+
+        asyncio.run(conflict())
+
+    def test_storage_adapter(self):
+        """
+        AsyncSessionStorageAdapter over SQLiteSessionStorage
+
+        :return:
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        class SessionStorage(AsyncSessionStorageAdapter):
+            def __init__(self):
+                super().__init__(SQLiteSessionStorage(
+                    os.path.join(directory, 'sessions.sqlite3')))
+
+        class SQLiteSimpleAuthServer(SimpleAuthServer):
+            session_storage_type = SessionStorage
+
+        async def logins():
+            server = SQLiteSimpleAuthServer()
+            responses = await asyncio.gather(
+                *[login(server, user_id) for user_id in range(20)])
+            token = responses[0]['result']['token']
+            entry = await server.session_storage.get(token['update_token'])
+            self.assertEqual(entry.action, SessionAction.update)
+            self.assertFalse(
+                (await server.check_token(token=token))['error'])
+
+            response = await server.revoke_main_token(
+                main_token=entry.main_token)
+            self.assertEqual(response['result'], {'removed': 3})
+            self.assertEqual(len(server.session_storage.storage), 57)
+
+        asyncio.run(logins())
+
+    def test_storage_adapter_lock(self):
+        """
+        AsyncSessionStorageAdapter runs the operation in the transaction
+        of SQLiteSessionStorage
+
+        :return:
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        adapter = AsyncSessionStorageAdapter(SQLiteSessionStorage(
+            os.path.join(directory, 'sessions.sqlite3')))
+        entry = SessionEntry(timestamp=100, timestamp_expired=2 ** 40,
+                             main_token='main_token',
+                             action=SessionAction.identifier)
+
+        async def operations():
+            with self.assertRaises(RuntimeError):
+                async with adapter.lock('key_1'):
+                    await adapter.set('key_1', entry)
+                    async with adapter.lock('key_2'):
+                        await adapter.set('key_2', entry)
+                    self.assertEqual(await adapter.get('key_2'), entry)
+                    raise RuntimeError()
+            # rolled back
+            self.assertIsNone(await adapter.get('key_1'))
+
+            async with adapter.lock('key_1'):
+                await adapter.set('key_1', entry)
+
+            # a cancelled operation leaves neither the lock nor changes
+            async def cancelled():
+                async with adapter.lock('key_3'):
+                    await adapter.set('key_3', entry)
+                    await asyncio.sleep(10)
+
+            task = asyncio.ensure_future(cancelled())
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            async with adapter.lock('key_4'):
+                await adapter.set('key_4', entry)
+            self.assertEqual(sorted(await adapter._run(list, adapter.storage)),
+                             ['key_1', 'key_4'])
+
+        asyncio.run(operations())
+
+    def test_storage_full(self):
+        """
+        get_token and update_token change nothing when the new entries
+        don't fit into SharedMemorySessionStorage
+
+        :return:
+        """
+        class SharedMemoryStorage(SharedMemorySessionStorage):
+            slot_count = 6
+            slot_size = 512
+
+        shm_storage = SharedMemoryStorage(
+            name='test_simple_auth_%s' % uuid.uuid4().hex[:8])
+        self.addCleanup(shm_storage.close)
+        self.addCleanup(shm_storage.unlink)
+
+        class SessionStorage(AsyncSessionStorageAdapter):
+            def __init__(self):
+                super().__init__(shm_storage)
+
+        class Server(SimpleAuthServer):
+            session_storage_type = SessionStorage
+
+        async def full():
+            server = Server()
+            token = (await login(server, 1))['result']['token']
+
+            identifier = (await server.get_identifier())['result'][
+                'identifier']
+            await server.add_user_data(identifier=identifier, user_id=2)
+            # main token, access and update tokens, identifier and
+            # the spare slot
+            identifier2 = (await server.get_identifier())['result'][
+                'identifier']
+            self.assertEqual(
+                await server.get_token(identifier=identifier),
+                {'error': True, 'msg': 'The session storage is full',
+                 'result': None})
+            self.assertIsNotNone(await server.session_storage.get(
+                identifier))
+
+            # the new main token doesn't fit with the new pair
+            await server.session_storage.delete(identifier2)
+            self.assertEqual(
+                (await server.get_token(identifier=identifier))['msg'],
+                'The session storage is full')
+            self.assertIsNotNone(await server.session_storage.get(
+                identifier))
+
+            # the update token keeps the main token of the login
+            response = await server.update_token(token=token)
+            self.assertFalse(response['error'])
+
+        asyncio.run(full())
+
+    def test_user_detail_in_executor(self):
+        """
+        The synchronous user model doesn't block the event loop
+
+        :return:
+        """
+        threads = []
+
+        class User(FakeSimpleAuthUser):
+            @classmethod
+            def get(cls, user_id):
+                threads.append(threading.current_thread())
+                return super().get(user_id)
+
+        class Server(SimpleAuthServer):
+            user_model = User
+
+        async def login_user():
+            response = await login(Server(), 5)
+            self.assertEqual(response['result']['user']['id'], 5)
+
+        asyncio.run(login_user())
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
@@ -0,0 +1,111 @@
+"""
+Test simple_auth.core.cache
+
+"""
+import unittest
+from unittest import mock
+
+from simple_auth.core.cache import TTLCache
+from simple_auth.core.server import SimpleAuthServer
+
+
+class FakeSimpleAuthUser:
+    id: int = 10
+
+    def to_storage_dict(self):
+        return dict(id=self.id)
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+class MyTestCase(unittest.TestCase):
+
+    @mock.patch('simple_auth.core.cache.time')
+    def test_ttl_cache(self, mock_time):
+        """
+        Test TTLCache: expiry, LRU eviction, stats
+
+        :return:
+        """
+        mock_time.monotonic = lambda: 100
+        cache = TTLCache(maxsize=2, ttl=10)
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # 'b' is the least recently used
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+        self.assertTrue(cache.invalidate('c'))
+        self.assertFalse(cache.invalidate('c'))
+
+        mock_time.monotonic = lambda: 110
+        self.assertEqual(cache.get('a', 'default'), 'default')
+
+        self.assertEqual(cache.stats(), {
+            'hits': 2, 'misses': 2, 'evictions': 1, 'size': 0})
+
+        # ttl of the item is not longer than ttl of the cache
+        cache.set('d', 4, ttl=5)
+        cache.set('e', 5, ttl=60)
+        mock_time.monotonic = lambda: 115
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.get('e'), 5)
+        mock_time.monotonic = lambda: 120
+        self.assertIsNone(cache.get('e'))
+
+    def test_user_cache(self):
+        """
+        SimpleAuthServer.add_user_data with the cache of profiles
+
+        :return:
+        """
+
+        class CachedSimpleAuthServer(SimpleAuthServer):
+            user_model = FakeSimpleAuthUser
+            user_cache_type = TTLCache
+
+        server = CachedSimpleAuthServer()
+
+        with mock.patch.object(
+                FakeSimpleAuthUser, 'get',
+                wraps=FakeSimpleAuthUser.get) as mock_get:
+            for _ in range(3):
+                identifier = server.get_identifier()['result']['identifier']
+                server.add_user_data(identifier=identifier, user_id=5)
+            self.assertEqual(mock_get.call_count, 1)
+
+            server.invalidate_user(user_id=5)
+            identifier = server.get_identifier()['result']['identifier']
+            server.add_user_data(identifier=identifier, user_id=5)
+            self.assertEqual(mock_get.call_count, 2)
+
+        self.assertEqual(server.session_storage[identifier].user, {'id': 5})
+        self.assertEqual(
+            server.user_cache_stats()['result'],
+            {'hits': 2, 'misses': 2, 'evictions': 0, 'size': 1})
+
+        # sessions don't share the cached profile
+        server.session_storage[identifier].user['id'] = 6
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=5)
+        self.assertEqual(server.session_storage[identifier].user, {'id': 5})
+        self.assertIsNot(server.session_storage[identifier].user,
+                         server.user_cache.get(5))
+
+        server = SimpleAuthServer()
+        self.assertIsNone(server.user_cache)
+        self.assertIsNone(server.user_cache_stats()['result'])
+        self.assertFalse(server.invalidate_user(user_id=5)['error'])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
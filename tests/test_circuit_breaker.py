@@ -0,0 +1,199 @@
+"""
+Test simple_auth.core.circuit_breaker
+
+"""
+import json
+
+import unittest
+from unittest import mock
+
+from simple_auth.core.circuit_breaker import CircuitBreaker, \
+    reset_circuit_breakers
+from simple_auth.core.client import SimpleAuthClient, close_sessions, \
+    deadline
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        close_sessions()
+        reset_circuit_breakers()
+
+    def tearDown(self):
+        reset_circuit_breakers()
+
+    @mock.patch('simple_auth.core.circuit_breaker.clock')
+    def test_circuit_breaker(self, mock_clock):
+        """
+        Test CircuitBreaker states
+
+        :return:
+        """
+        mock_clock.return_value = 100
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10)
+
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+        # one probe
+        mock_clock.return_value = 110
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+        mock_clock.return_value = 120
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertTrue(breaker.allow())
+
+    @mock.patch('simple_auth.core.circuit_breaker.clock')
+    def test_cancel(self, mock_clock):
+        """
+        Test the cancelled probe goes to the next request
+
+        :return:
+        """
+        mock_clock.return_value = 100
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+        breaker.cancel()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(breaker.failures, 0)
+
+        breaker.failure()
+        mock_clock.return_value = 110
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.cancel()
+        self.assertEqual(breaker.state, 'open')
+        self.assertEqual(breaker.failures, 1)
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, 'closed')
+
+    @mock.patch('simple_auth.core.circuit_breaker.clock')
+    @mock.patch('simple_auth.core.client.requests')
+    def test_client(self, mock_requests, mock_clock):
+        """
+        SimpleAuthClient with timeouts and the circuit breaker
+
+        :return:
+        """
+        mock_clock.return_value = 100
+        mock_post = mock_requests.Session.return_value.post
+        mock_post.side_effect = OSError('timeout')
+
+        class Client(SimpleAuthClient):
+            breaker_failure_threshold = 2
+            breaker_recovery_timeout = 10
+
+        client = Client(url_server_auth='http://localhost')
+        for _ in range(2):
+            self.assertEqual(client.get_identifier()['msg'],
+                             'Transfer data error')
+        self.assertEqual(mock_post.call_args[1]['timeout'], (3.05, 10))
+
+        # fail fast
+        self.assertFalse(client.is_available())
+        self.assertEqual(
+            Client(url_server_auth='http://localhost').get_identifier(),
+            {'error': True, 'msg': 'Auth server is unavailable',
+             'result': None})
+        self.assertEqual(mock_post.call_count, 2)
+
+        # the probe closes the breaker
+        mock_clock.return_value = 110
+
+        class FakeResponse:
+            text = json.dumps({'error': False, 'msg': '', 'result': None})
+
+        mock_post.side_effect = None
+        mock_post.return_value = FakeResponse()
+        self.assertFalse(client.get_identifier()['error'])
+        self.assertTrue(client.is_available())
+
+    @mock.patch('simple_auth.core.client.clock')
+    @mock.patch('simple_auth.core.client.requests')
+    def test_deadline(self, mock_requests, mock_clock):
+        """
+        Timeouts are limited by the deadline of the scope
+
+        :return:
+        """
+
+        class FakeResponse:
+            text = json.dumps({'error': False, 'msg': '', 'result': None})
+
+        mock_post = mock_requests.Session.return_value.post
+        mock_post.return_value = FakeResponse()
+
+        mock_clock.return_value = 100
+        client = SimpleAuthClient(url_server_auth='http://localhost')
+
+        with deadline(5):
+            mock_clock.return_value = 103
+            client.get_identifier()
+            self.assertEqual(mock_post.call_args[1]['timeout'], (2, 2))
+
+            # a nested scope keeps the earlier deadline
+            with deadline(10):
+                client.get_identifier()
+                self.assertEqual(mock_post.call_args[1]['timeout'], (2, 2))
+
+            mock_clock.return_value = 105
+            self.assertEqual(
+                client.get_identifier()['msg'], 'Deadline exceeded')
+            self.assertEqual(mock_post.call_count, 2)
+
+        # the long-lived client has got no deadline out of the scope ...
+        client.get_identifier()
+        self.assertEqual(
+            mock_post.call_args[1]['timeout'],
+            (client.connect_timeout, client.read_timeout))
+
+        # ... and a new budget in a new scope
+        with deadline(1):
+            client.get_identifier()
+            self.assertEqual(mock_post.call_args[1]['timeout'], (1, 1))
+        self.assertEqual(mock_post.call_count, 4)
+
+    @mock.patch('simple_auth.core.client.clock')
+    @mock.patch('simple_auth.core.client.requests')
+    def test_deadline_timeout(self, mock_requests, mock_clock):
+        """
+        A timeout cut by the deadline is not a failure of the server
+
+        :return:
+        """
+        def post(**kwargs):
+            mock_clock.return_value = 102
+            raise TimeoutError()
+
+        mock_requests.Session.return_value.post.side_effect = post
+        mock_clock.return_value = 100
+        client = SimpleAuthClient(url_server_auth='http://localhost')
+
+        for _ in range(client.breaker_failure_threshold):
+            mock_clock.return_value = 100
+            with deadline(1):
+                self.assertEqual(
+                    client.get_identifier()['msg'], 'Deadline exceeded')
+        self.assertEqual(client.circuit_breaker.state, 'closed')
+
+        # without the deadline the timeout is a failure
+        client.get_identifier()
+        self.assertEqual(client.circuit_breaker.failures, 1)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
@@ -2,13 +2,21 @@
 Test simple_auth.SimpleAuthServer
 
 """
+import http.client
+import io
 import json
+import threading
+import time
 
 import unittest
 from unittest import mock
 
+import requests
 
-from simple_auth.core.client import SimpleAuthClient
+from simple_auth.core import client as client_module
+from simple_auth.core.cache import TTLCache
+from simple_auth.core.client import SimpleAuthClient, close_sessions, \
+    get_session
 
 
 USER_DATA = {
@@ -33,6 +41,11 @@ FAKE_RESPONSE_GET_TOKEN = {
 
 class MyTestCase(unittest.TestCase):
 
+    def setUp(self):
+        # clients share the session, a new mock of requests
+        # needs a new session
+        close_sessions()
+
     def test_init(self):
         """
         SimpleAuthClient.__init__
@@ -100,7 +113,7 @@ class MyTestCase(unittest.TestCase):
         class FakeResponse:
             text = json.dumps(mock_response)
 
-        mock_requests.post = mock.MagicMock(
+        mock_requests.Session.return_value.post = mock.MagicMock(
             return_value=FakeResponse())
 
         client = SimpleAuthClient(url_server_auth='http://localhost')
@@ -236,7 +249,7 @@ class MyTestCase(unittest.TestCase):
             def __init__(self, data):
                 self.text = json.dumps(data)
 
-        mock_requests.post = mock.MagicMock(
+        mock_requests.Session.return_value.post = mock.MagicMock(
             return_value=FakeResponse(mock_response))
 
         # init
@@ -250,7 +263,7 @@ class MyTestCase(unittest.TestCase):
 
         # mocks
         mock_response = {'error': True, 'msg': '', 'result': None}
-        mock_requests.post = mock.MagicMock(
+        mock_requests.Session.return_value.post = mock.MagicMock(
             return_value=FakeResponse(mock_response))
 
         # init
@@ -260,12 +273,225 @@ class MyTestCase(unittest.TestCase):
         # check
         self.assertEqual(result, False)
 
+    @mock.patch('simple_auth.core.client.time')
+    @mock.patch('simple_auth.core.client.requests')
+    def test_validation_cache(self, mock_requests, mock_time):
+        """
+        SimpleAuthClient.validation_cache
+
+        :return:
+        """
+        mock_time.time = lambda: 100
+
+        class FakeResponse:
+            def __init__(self, data):
+                self.text = json.dumps(data)
+
+        mock_post = mock_requests.Session.return_value.post = \
+            mock.MagicMock(return_value=FakeResponse(
+                {'error': False, 'msg': '',
+                 'result': {'identifier': 'fake_identifier',
+                            'expired_identifier': 150}}))
+
+        class CachedSimpleAuthClient(SimpleAuthClient):
+            validation_cache = TTLCache(maxsize=10, ttl=60)
+
+        client = CachedSimpleAuthClient(url_server_auth='http://localhost')
+        self.assertTrue(client.is_valid_identifier('fake_identifier'))
+        self.assertTrue(client.is_valid_identifier('fake_identifier'))
+        self.assertEqual(mock_post.call_count, 1)
+
+        # the answer lives until the server rejects the identifier
+        key = ('http://localhost/api', 'fake_identifier')
+        self.assertAlmostEqual(
+            CachedSimpleAuthClient.validation_cache._data[key][0] -
+            time.monotonic(), 49, delta=0.5)
+
+        # answers of another auth server are not shared
+        other_client = CachedSimpleAuthClient(
+            url_server_auth='http://other')
+        self.assertTrue(other_client.is_valid_identifier('fake_identifier'))
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertTrue(other_client.invalidate_identifier('fake_identifier'))
+        self.assertTrue(client.is_valid_identifier('fake_identifier'))
+        self.assertEqual(mock_post.call_count, 2)
+
+        self.assertTrue(client.invalidate_identifier('fake_identifier'))
+        self.assertFalse(client.invalidate_identifier('fake_identifier'))
+        self.assertTrue(client.is_valid_identifier('fake_identifier'))
+        self.assertEqual(mock_post.call_count, 3)
+
+        # the redeemed identifier is removed
+        mock_post.return_value = FakeResponse(FAKE_RESPONSE_GET_TOKEN)
+        client.get_token('fake_identifier')
+        self.assertEqual(len(CachedSimpleAuthClient.validation_cache), 0)
+
+        # errors and expired identifiers are not kept
+        mock_post.return_value = FakeResponse(
+            {'error': True, 'msg': '', 'result': None})
+        self.assertFalse(client.is_valid_identifier('fake_identifier'))
+        mock_post.return_value = FakeResponse(
+            {'error': False, 'msg': '',
+             'result': {'identifier': 'fake_identifier',
+                        'expired_identifier': 101}})
+        self.assertTrue(client.is_valid_identifier('fake_identifier'))
+        self.assertEqual(len(CachedSimpleAuthClient.validation_cache), 0)
+
+    @mock.patch('simple_auth.core.client.requests')
+    def test_update_token_single_flight(self, mock_requests):
+        """
+        Concurrent SimpleAuthClient.update_token with one update token
+        make one request, the response is shared for update_token_grace
+        sec after it
+
+        :return:
+        """
+        # the request returns when the other threads wait for it
+        barrier = threading.Barrier(10, timeout=5)
+
+        class Flight(client_module._Flight):
+            def wait(self):
+                barrier.wait()
+                super().wait()
+
+        new_token = dict(FAKE_RESPONSE_GET_TOKEN['result']['token'],
+                         expired_access_token=int(time.time()) + 30)
+        mock_response = dict(FAKE_RESPONSE_GET_TOKEN, result=dict(
+            FAKE_RESPONSE_GET_TOKEN['result'], token=new_token))
+
+        class FakeResponse:
+            text = json.dumps(mock_response)
+
+        def post(**kwargs):
+            barrier.wait()
+            return FakeResponse()
+
+        mock_post = mock_requests.Session.return_value.post = \
+            mock.MagicMock(side_effect=post)
 
+        token = FAKE_RESPONSE_GET_TOKEN['result']['token']
+        responses = []
 
+        def update():
+            client = SimpleAuthClient(url_server_auth='http://localhost')
+            responses.append(client.update_token(token=dict(token)))
 
+        threads = [threading.Thread(target=update) for _ in range(10)]
+        with mock.patch.object(client_module, '_Flight', Flight):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
 
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(len(responses), 10)
+        for response in responses:
+            self.assertIs(response, responses[0])
+        self.assertEqual(responses[0], mock_response)
+
+        # a late call with the used update token gets the same response
+        client = SimpleAuthClient(url_server_auth='http://localhost')
+        self.assertIs(client.update_token(token=token), responses[0])
+        self.assertEqual(mock_post.call_count, 1)
+
+        # after the grace period the update is a new request
+        mock_post.side_effect = None
+        mock_post.return_value = FakeResponse()
+        with mock.patch.object(client_module, 'clock',
+                               lambda: time.monotonic() + 10):
+            client.update_token(token=token)
+        self.assertEqual(mock_post.call_count, 2)
+
+        # a response with the expired access token is not shared
+        FakeResponse.text = json.dumps(FAKE_RESPONSE_GET_TOKEN)
+        token = dict(token, update_token='other_update_token')
+        client.update_token(token=token)
+        client.update_token(token=token)
+        self.assertEqual(mock_post.call_count, 4)
 
+    @mock.patch('simple_auth.core.client.requests')
+    def test_batch(self, mock_requests):
+        """
+        SimpleAuthClient.get_tokens, check_tokens, update_tokens
 
+        :return:
+        """
+
+        mock_response = {'error': False, 'msg': '', 'result': []}
+
+        class FakeResponse:
+            text = json.dumps(mock_response)
+
+        mock_post = mock_requests.Session.return_value.post = \
+            mock.MagicMock(return_value=FakeResponse())
+
+        client = SimpleAuthClient(url_server_auth='http://localhost')
+        token = FAKE_RESPONSE_GET_TOKEN['result']['token']
+
+        self.assertEqual(
+            client.get_tokens(identifiers=['id_1', 'id_2']), mock_response)
+        self.assertEqual(client.check_tokens(tokens=[token]), mock_response)
+        self.assertEqual(client.update_tokens(tokens=[token]), mock_response)
+
+        # one request per batch
+        self.assertEqual(
+            [call[1]['json'] for call in mock_post.call_args_list],
+            [{'command': 'get_tokens', 'identifiers': ['id_1', 'id_2']},
+             {'command': 'check_tokens', 'tokens': [token]},
+             {'command': 'update_tokens', 'tokens': [token]}])
+
+    @mock.patch('simple_auth.core.client.requests')
+    def test_session(self, mock_requests):
+        """
+        Clients share one pooled session
+
+        :return:
+        """
+
+        class FakeResponse:
+            text = json.dumps(FAKE_RESPONSE_GET_TOKEN)
+
+        mock_requests.Session.return_value.post = mock.MagicMock(
+            return_value=FakeResponse())
+
+        class PooledSimpleAuthClient(SimpleAuthClient):
+            pool_maxsize = 32
+
+        for _ in range(3):
+            client = PooledSimpleAuthClient(
+                url_server_auth='http://localhost')
+            client.get_token(identifier='mock_uud4')
+
+        mock_requests.Session.assert_called_once_with()
+        mock_requests.adapters.HTTPAdapter.assert_called_once_with(
+            pool_connections=10, pool_maxsize=32, pool_block=False)
+        self.assertEqual(
+            mock_requests.Session.return_value.post.call_count, 3)
+
+        close_sessions()
+        mock_requests.Session.return_value.close.assert_called_once_with()
+
+    def test_session_cookies(self):
+        """
+        The shared session doesn't keep cookies of responses
+
+        :return:
+        """
+        close_sessions()
+        self.addCleanup(close_sessions)
+        session = get_session(1, 1, False)
+
+        request = requests.Request(
+            'POST', 'http://localhost/api').prepare()
+        response = mock.MagicMock()
+        response._original_response.msg = http.client.parse_headers(
+            io.BytesIO(b'Set-Cookie: session=user_1; Path=/\r\n\r\n'))
+        requests.cookies.extract_cookies_to_jar(
+            session.cookies, request, response)
+        self.assertEqual(len(session.cookies), 0)
+        # the next request has got no cookie of the response
+        self.assertNotIn('Cookie', session.prepare_request(
+            requests.Request('POST', 'http://localhost/api')).headers)
 
 
 if __name__ == '__main__':
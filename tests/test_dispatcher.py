@@ -0,0 +1,182 @@
+"""
+Test simple_auth.core.dispatcher
+
+"""
+import asyncio
+
+import unittest
+from unittest import mock
+
+from simple_auth.core.async_server import AsyncSimpleAuthServer
+from simple_auth.core.dispatcher import CommandDispatcher, CommandRejected
+from simple_auth.core.rate_limit import TokenBucketRateLimiter
+from simple_auth.core.server import SimpleAuthServer
+
+
+class FakeSimpleAuthUser:
+    id: int = 10
+
+    @property
+    def is_simple_auth_user(self):
+        return True
+
+    def to_storage_dict(self):
+        return dict(id=self.id)
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+class SimpleAuthServer(SimpleAuthServer):
+    user_model = FakeSimpleAuthUser
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_dispatch(self):
+        """
+        Test CommandDispatcher.dispatch
+
+        :return:
+        """
+        server = SimpleAuthServer()
+        dispatcher = CommandDispatcher(server)
+
+        response = dispatcher.dispatch({'command': 'get_identifier'})
+        self.assertFalse(response['error'])
+        identifier = response['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=1)
+
+        request = {'command': 'get_token', 'identifier': identifier}
+        response = dispatcher.dispatch(request)
+        self.assertEqual(response['result']['user'], {'id': 1})
+        # the request is not changed
+        self.assertEqual(request['command'], 'get_token')
+
+        response = dispatcher.dispatch(
+            {'command': 'get_token', 'identifier': identifier})
+        self.assertEqual(response['msg'], 'The identifier is wrong')
+
+        with mock.patch.object(server, 'session_storage') as mock_storage:
+            for request in (None, [], {}, {'command': 1},
+                            {'command': '__init__'},
+                            {'command': 'add_user_data'}):
+                self.assertEqual(
+                    dispatcher.dispatch(request)['error'], True)
+
+            for request in ({'command': 'get_token'},
+                            {'command': 'get_token', 'identifier': 1},
+                            {'command': 'get_token', 'identifier': 'a',
+                             'user_id': 1}):
+                self.assertEqual(
+                    dispatcher.dispatch(request)['msg'],
+                    'The parameters of the command are wrong')
+            # items of tokens and batches are checked as well
+            token = {'access_token': 'a', 'update_token': 'b',
+                     'expired_access_token': 1}
+            for request in (
+                    {'command': 'update_token',
+                     'token': {'update_token': [1]}},
+                    {'command': 'check_token', 'token': {'access_token': {}}},
+                    {'command': 'check_token', 'token': {}},
+                    {'command': 'get_tokens', 'identifiers': ['a', 1]},
+                    {'command': 'check_tokens',
+                     'tokens': [token, {'access_token': None}]},
+                    {'command': 'update_tokens', 'tokens': [token, 'b']}):
+                self.assertEqual(
+                    dispatcher.dispatch(request)['msg'],
+                    'The parameters of the command are wrong')
+            # rejected before the storage
+            self.assertEqual(mock_storage.mock_calls, [])
+
+        for command in ('check_token', 'update_token'):
+            self.assertEqual(dispatcher.route(
+                {'command': command, 'token': token})[2], {'token': token})
+
+        counters = dispatcher.counters()
+        self.assertEqual(counters['get_identifier'],
+                         {'calls': 1, 'errors': 0, 'rejected': 0,
+                          'limited': 0})
+        self.assertEqual(counters['get_token'],
+                         {'calls': 2, 'errors': 1, 'rejected': 3,
+                          'limited': 0})
+        self.assertEqual(counters['unknown'], 6)
+
+        with self.assertRaises(CommandRejected) as context:
+            dispatcher.route({'command': 'unknown'})
+        self.assertEqual(context.exception.response['msg'],
+                         'The command is unknown')
+
+    @mock.patch('simple_auth.core.rate_limit.time')
+    def test_rate_limit(self, mock_time):
+        """
+        CommandDispatcher with TokenBucketRateLimiter
+
+        :return:
+        """
+
+        class RateLimiter(TokenBucketRateLimiter):
+            limits = {'get_identifier': (1, 2)}
+            default_limit = None
+            max_buckets = 2
+
+        mock_time.monotonic = lambda: 100
+        server = SimpleAuthServer()
+        dispatcher = CommandDispatcher(server, rate_limiter=RateLimiter())
+        request = {'command': 'get_identifier'}
+
+        responses = [dispatcher.dispatch(request, client='client_1')
+                     for _ in range(3)]
+        self.assertEqual([response['error'] for response in responses],
+                         [False, False, True])
+        self.assertEqual(responses[2], {
+            'error': True, 'msg': 'Too many requests', 'result': None})
+        # over the limit before the storage
+        self.assertEqual(len(server.session_storage), 2)
+
+        # other client and command without limit
+        self.assertFalse(
+            dispatcher.dispatch(request, client='client_2')['error'])
+        self.assertNotEqual(dispatcher.dispatch(
+            {'command': 'check_identifier', 'identifier': 'a'},
+            client='client_1')['msg'], 'Too many requests')
+
+        # one token per second
+        mock_time.monotonic = lambda: 101.5
+        self.assertFalse(
+            dispatcher.dispatch(request, client='client_1')['error'])
+        self.assertTrue(
+            dispatcher.dispatch(request, client='client_1')['error'])
+
+        self.assertEqual(dispatcher.counters()['get_identifier'], {
+            'calls': 4, 'errors': 0, 'rejected': 0, 'limited': 2})
+
+        # the least recently used bucket is removed
+        dispatcher.dispatch(request, client='client_3')
+        self.assertEqual(len(dispatcher.rate_limiter), 2)
+
+    def test_dispatch_async(self):
+        """
+        Test CommandDispatcher.dispatch_async
+
+        :return:
+        """
+        dispatcher = CommandDispatcher(AsyncSimpleAuthServer())
+        # batch commands are not in AsyncSimpleAuthServer
+        self.assertNotIn('get_tokens', dispatcher.routes)
+
+        response = asyncio.run(
+            dispatcher.dispatch_async({'command': 'get_identifier'}))
+        self.assertFalse(response['error'])
+        response = asyncio.run(
+            dispatcher.dispatch_async({'command': 'get_tokens'}))
+        self.assertEqual(response['msg'], 'The command is unknown')
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
@@ -0,0 +1,194 @@
+"""
+Test simple_auth.core.file_storage.FileSessionStorage
+
+"""
+import os
+import shutil
+import tempfile
+
+import unittest
+from unittest import mock
+
+from simple_auth.core.file_storage import FileSessionStorage
+from simple_auth.core.server import SimpleAuthServer
+
+
+class FakeSimpleAuthUser:
+    id: int = 10
+
+    def to_storage_dict(self):
+        return dict(id=self.id, name='User name')
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+def render_entry(timestamp_expired, **kwargs):
+    entry = dict(timestamp=100, timestamp_expired=timestamp_expired,
+                 main_token='fake_main_token', action='identifier')
+    entry.update(kwargs)
+    return entry
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sessions.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open_storage(self):
+        storage = FileSessionStorage(path=self.path)
+        self.addCleanup(storage.close)
+        return storage
+
+    @mock.patch('simple_auth.core.file_storage.time')
+    def test_restart(self, mock_time):
+        """
+        Entries survive restart, expired entries are skipped
+
+        :return:
+        """
+        mock_time.time = lambda: 100
+
+        storage = self.open_storage()
+        storage['key_1'] = render_entry(150, user={'id': 1})
+        storage['key_2'] = render_entry(120)
+        storage['key_3'] = render_entry(150)
+        del storage['key_3']
+        storage.close()
+
+        mock_time.time = lambda: 130
+        storage = self.open_storage()
+
+        self.assertEqual(
+            dict(storage), {'key_1': render_entry(150, user={'id': 1})})
+
+    def test_broken_tail(self):
+        """
+        Broken tail of the log is cut off
+
+        :return:
+        """
+        storage = self.open_storage()
+        storage['key_1'] = render_entry(2 ** 40)
+        storage.close()
+
+        with open(self.path, 'ab') as file:
+            file.write(b'{"k":"key_2","v":{"times')
+
+        storage = self.open_storage()
+        self.assertEqual(list(storage), ['key_1'])
+        storage['key_2'] = render_entry(2 ** 40)
+        storage.close()
+
+        storage = self.open_storage()
+        self.assertEqual(sorted(storage), ['key_1', 'key_2'])
+
+    @mock.patch('simple_auth.core.file_storage.time')
+    def test_compact(self, mock_time):
+        """
+        Compaction drops expired and overwritten records
+
+        :return:
+        """
+        mock_time.time = lambda: 100
+
+        storage = self.open_storage()
+        for i in range(10):
+            storage['key'] = render_entry(200 + i)
+        storage['expired_key'] = render_entry(110)
+
+        mock_time.time = lambda: 120
+        storage.flush()
+        size = os.path.getsize(self.path)
+        storage.compact()
+
+        self.assertLess(os.path.getsize(self.path), size)
+        self.assertEqual(dict(storage), {'key': render_entry(209)})
+
+        storage['new_key'] = render_entry(300)
+        storage.close()
+
+        storage = self.open_storage()
+        self.assertEqual(
+            dict(storage),
+            {'key': render_entry(209), 'new_key': render_entry(300)})
+
+    @mock.patch('simple_auth.core.file_storage.time')
+    def test_expired_logins(self, mock_time):
+        """
+        Expired entries leave the index and their records are compacted
+
+        :return:
+        """
+        mock_time.time = lambda: 100
+
+        class SessionStorage(FileSessionStorage):
+            background = False
+            compaction_min_records = 100
+
+        storage = SessionStorage(path=self.path)
+        self.addCleanup(storage.close)
+
+        # records of logins: identifier, user data, get_token
+        for i in range(300):
+            storage['identifier_%s' % i] = render_entry(110)
+            storage['identifier_%s' % i] = render_entry(110, user={})
+            del storage['identifier_%s' % i]
+            storage['access_%s' % i] = render_entry(110, action='access')
+            storage['update_%s' % i] = render_entry(110, action='update')
+        self.assertEqual(storage.dead_records, 900)
+        self.assertFalse(storage.need_compaction())
+
+        mock_time.time = lambda: 120
+        self.assertEqual(storage.sweep(), 600)
+        self.assertEqual(len(storage), 0)
+        self.assertEqual(storage.dead_records, 1500)
+        self.assertTrue(storage.need_compaction())
+
+        storage.compact()
+        storage.flush()
+        self.assertEqual(storage.dead_records, 0)
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_server(self):
+        """
+        SimpleAuthServer with FileSessionStorage
+
+        :return:
+        """
+        path = self.path
+
+        class SessionStorage(FileSessionStorage):
+            pass
+
+        SessionStorage.path = path
+
+        class Server(SimpleAuthServer):
+            session_storage_type = SessionStorage
+            user_model = FakeSimpleAuthUser
+
+        server = Server()
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=1)
+        token = server.get_token(identifier=identifier)['result']['token']
+        server.session_storage.close()
+
+        server = Server()
+        self.addCleanup(server.session_storage.close)
+        self.assertEqual(
+            server.check_token(token=token),
+            {'error': False, 'msg': '', 'result': None})
+        self.assertNotIn(identifier, server.session_storage)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
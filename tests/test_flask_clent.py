@@ -8,9 +8,10 @@ import copy
 import unittest
 from unittest import mock
 
+import flask
 
 from simple_auth.core import flask_client
-from simple_auth.core.client import SimpleAuthClient
+from simple_auth.core.client import SimpleAuthClient, close_sessions
 
 
 EXAMPLE_USER = {'user_id': '123', 'level': [1, 2, 3]}
@@ -209,6 +210,36 @@ class MyTestCase(unittest.TestCase):
             {}
         )
 
+    @mock.patch("simple_auth.core.flask_client.SimpleAuthClient")
+    @mock.patch("simple_auth.core.flask_client.flask")
+    def test_check_auth_identifier_5(self, mock_flask, mock_SimpleAuthClient):
+        """
+        Test function: flask_client.check_auth_identifier
+        auth server is unavailable (the circuit breaker is open)
+
+        :return:
+        """
+
+        mock_is_valid_identifier = mock.MagicMock(return_value=True)
+        mock_SimpleAuthClient.return_value = mock.MagicMock(
+            is_available=mock.MagicMock(return_value=False),
+            is_valid_identifier=mock_is_valid_identifier
+        )
+
+        mock_flask.g = FakeG()
+        mock_flask.current_app.config = {
+            'URL_IF_AUTH_SERVER_UNAVAILABLE': 'mock_unavailable_url'}
+
+        mock_flask.g.auth_identifier = 'fake_identifier'
+        flask_client.check_auth_identifier()
+
+        self.assertEqual(
+            mock_flask.g.get_store(),
+            {'auth_identifier': 'fake_identifier',
+             'auth_redirect': 'mock_unavailable_url'}
+        )
+        mock_is_valid_identifier.assert_not_called()
+
     @mock.patch("simple_auth.core.client.time")
     @mock.patch("simple_auth.core.flask_client.SimpleAuthClient")
     @mock.patch("simple_auth.core.flask_client.flask")
@@ -226,6 +257,7 @@ class MyTestCase(unittest.TestCase):
             is_valid_token=SimpleAuthClient.is_valid_token)
 
         mock_flask.g = FakeG()
+        mock_flask.current_app.config = {}
 
         with self.assertRaises(KeyError):
             flask_client.check_auth_token()
@@ -292,6 +324,7 @@ class MyTestCase(unittest.TestCase):
         )
 
         mock_flask.g = FakeG()
+        mock_flask.current_app.config = {}
 
         # work with time - expired access token
         mock_time.time = lambda: 130
@@ -423,6 +456,52 @@ class MyTestCase(unittest.TestCase):
         )
 
 
+    @mock.patch('simple_auth.core.flask_client.clock')
+    @mock.patch('simple_auth.core.client.clock')
+    @mock.patch('simple_auth.core.client.requests')
+    def test_page_deadline(self, mock_requests, mock_client_clock,
+                           mock_clock):
+        """
+        Test function: flask_client.page_deadline
+        Requests of the page share AUTH_DEADLINE_BUDGET
+
+        :return:
+        """
+        close_sessions()
+        self.addCleanup(close_sessions)
+        mock_post = mock_requests.Session.return_value.post
+        mock_post.return_value = type('Response', (object,), dict(
+            text=json.dumps({'error': False, 'msg': '', 'result': None})))
+
+        app = flask.Flask(__name__)
+        app.config['AUTH_DEADLINE_BUDGET'] = 5
+        client = SimpleAuthClient(url_server_auth='http://url1.fake')
+
+        with app.test_request_context():
+            mock_clock.return_value = 100
+            with flask_client.page_deadline():
+                mock_client_clock.return_value = 103
+                client.get_identifier()
+                self.assertEqual(mock_post.call_args[1]['timeout'], (2, 2))
+
+            # the second helper of the page gets the rest of the budget
+            mock_clock.return_value = 104
+            with flask_client.page_deadline():
+                self.assertEqual(flask.g.auth_deadline, 105)
+                mock_client_clock.return_value = 105
+                self.assertEqual(
+                    client.get_identifier()['msg'], 'Deadline exceeded')
+
+        # a new page gets a new budget
+        with app.test_request_context():
+            with flask_client.page_deadline():
+                self.assertEqual(flask.g.auth_deadline, 109)
+                client.get_identifier()
+                self.assertEqual(
+                    mock_post.call_args[1]['timeout'], (3.05, 4))
+        self.assertEqual(mock_post.call_count, 2)
+
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
     runner = unittest.TextTestRunner(verbosity=2)
@@ -0,0 +1,185 @@
+"""
+Test simple_auth.core.metrics
+
+"""
+import unittest
+from unittest import mock
+
+from simple_auth.core import server as simple_auth_server
+from simple_auth.core.metrics import MetricsRegistry
+from simple_auth.core.server import SimpleAuthServer, TTLSessionStorage, \
+    StripedSessionStorage, SessionEntry, SessionAction
+
+
+class FakeSimpleAuthUser:
+    id: int = 10
+
+    def to_storage_dict(self):
+        return dict(id=self.id)
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+class SimpleAuthServer(SimpleAuthServer):
+    user_model = FakeSimpleAuthUser
+    metrics_type = MetricsRegistry
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_registry(self):
+        """
+        Test MetricsRegistry.export
+
+        :return:
+        """
+
+        class Registry(MetricsRegistry):
+            buckets = (0.1, 1.0)
+
+        registry = Registry()
+        registry.describe('requests_total', 'counter', 'Requests')
+        registry.inc('requests_total', (('path', 'a"b\\c'),))
+        registry.inc('requests_total', (('path', 'a"b\\c'),), 2)
+        registry.observe('duration_seconds', 0.1)
+        registry.observe('duration_seconds', 0.5)
+        registry.observe('duration_seconds', 5)
+        registry.add_collector(lambda: [
+            ('size', 'gauge', 'Size', {(): 7})])
+
+        self.assertEqual(registry.export(), '\n'.join((
+            '# HELP requests_total Requests',
+            '# TYPE requests_total counter',
+            'requests_total{path="a\\"b\\\\c"} 3',
+            '# HELP duration_seconds duration_seconds',
+            '# TYPE duration_seconds histogram',
+            'duration_seconds_bucket{le="0.1"} 1',
+            'duration_seconds_bucket{le="1"} 2',
+            'duration_seconds_bucket{le="+Inf"} 3',
+            'duration_seconds_sum 5.6',
+            'duration_seconds_count 3',
+            '# HELP size Size',
+            '# TYPE size gauge',
+            'size 7',
+        )) + '\n')
+        self.assertEqual(registry.value('duration_seconds'), (3, 5.6))
+
+    def test_server_metrics(self):
+        """
+        Latency, errors and storage gauges of SimpleAuthServer
+
+        :return:
+        """
+        server = SimpleAuthServer()
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=1)
+        server.get_token(identifier=identifier)
+        server.get_token(identifier=identifier)
+        server.get_identifier()
+
+        metrics = server.metrics
+        count, _ = metrics.value(
+            'simple_auth_command_duration_seconds',
+            (('command', 'get_token'),))
+        self.assertEqual(count, 2)
+        self.assertEqual(metrics.value(
+            'simple_auth_command_errors_total',
+            (('command', 'get_token'),
+             ('reason', 'The identifier is wrong'))), 1)
+        # commands called by get_token are measured as nested
+        self.assertIsNone(metrics.value(
+            'simple_auth_command_duration_seconds',
+            (('command', 'check_identifier'),)))
+        count, _ = metrics.value(
+            'simple_auth_nested_command_duration_seconds',
+            (('command', 'check_identifier'),))
+        self.assertEqual(count, 2)
+        count, _ = metrics.value(
+            'simple_auth_nested_command_duration_seconds',
+            (('command', 'check_key'),))
+        self.assertEqual(count, 2)
+        self.assertEqual(metrics.value(
+            'simple_auth_nested_command_errors_total',
+            (('command', 'check_identifier'),
+             ('reason', 'The identifier is wrong'))), 1)
+
+        server.get_tokens(identifiers=[identifier, identifier])
+        count, _ = metrics.value(
+            'simple_auth_command_duration_seconds',
+            (('command', 'get_token'),))
+        self.assertEqual(count, 2)
+        count, _ = metrics.value(
+            'simple_auth_command_duration_seconds',
+            (('command', 'get_tokens'),))
+        self.assertEqual(count, 1)
+        count, _ = metrics.value(
+            'simple_auth_nested_command_duration_seconds',
+            (('command', 'get_token'),))
+        self.assertEqual(count, 2)
+
+        self.assertEqual(server.session_storage.count_by_action(), {
+            'identifier': 1, 'main': 1, 'access': 1, 'update': 1})
+
+        exported = server.export_metrics()
+        self.assertIn(
+            'simple_auth_storage_entries{action="identifier"} 1',
+            exported)
+        self.assertIn(
+            'simple_auth_command_duration_seconds_count'
+            '{command="get_identifier"} 2', exported)
+
+        # storages without counts are not scanned at export
+        storage = mock.MagicMock(spec=['get', '__len__'])
+        server.session_storage = storage
+        self.assertNotIn('simple_auth_storage_entries',
+                         server.export_metrics())
+        storage.__len__.assert_not_called()
+
+        # metrics are off by default
+        self.assertEqual(
+            simple_auth_server.SimpleAuthServer().export_metrics(), '')
+
+    @mock.patch('simple_auth.core.server.time')
+    def test_expired_counts(self, mock_time):
+        """
+        Expired entries by action in TTLSessionStorage and shards
+
+        :return:
+        """
+
+        class StripedTTLSessionStorage(StripedSessionStorage):
+            shard_type = TTLSessionStorage
+
+        class TTLSimpleAuthServer(SimpleAuthServer):
+            session_storage_type = StripedTTLSessionStorage
+
+        mock_time.time = lambda: 100
+        server = TTLSimpleAuthServer()
+        for i in range(3):
+            server.session_storage['identifier_%s' % i] = SessionEntry(
+                timestamp=100, timestamp_expired=150,
+                main_token='main_token_%s' % i,
+                action=SessionAction.identifier)
+
+        mock_time.time = lambda: 200
+        for shard in server.session_storage._shards:
+            shard.sweep()
+
+        self.assertEqual(
+            server.session_storage.count_expired_by_action()['identifier'],
+            3)
+        self.assertEqual(
+            server.session_storage.count_by_action()['identifier'], 0)
+        self.assertIn(
+            'simple_auth_storage_expired_total{action="identifier"} 3',
+            server.export_metrics())
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
@@ -0,0 +1,363 @@
+"""
+Test simple_auth.core.redis_storage.RedisSessionStorage
+
+Tests use an in-process stand-in of the Redis server
+"""
+import fnmatch
+import socketserver
+import threading
+import time
+
+import unittest
+
+import schema
+
+from simple_auth.core.redis_storage import RedisSessionStorage, \
+    RedisConnection, RedisConnectionPool
+from simple_auth.core.server import SimpleAuthServer, SessionAction, \
+    SessionStorageConflict
+
+
+class FakeSimpleAuthUser:
+    id: int = 10
+
+    def to_storage_dict(self):
+        return dict(id=self.id, name='User name')
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """
+    Subset of the Redis protocol for the tests
+    """
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        command = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            command.append(self.rfile.read(length + 2)[:-2].decode())
+        return command
+
+    @staticmethod
+    def encode(reply) -> bytes:
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, Exception):
+            return b'-ERR %s\r\n' % str(reply).encode()
+        if isinstance(reply, int):
+            return b':%d\r\n' % reply
+        if isinstance(reply, list):
+            return b'*%d\r\n' % len(reply) + b''.join(
+                map(FakeRedisHandler.encode, reply))
+        if reply == 'OK' or reply == 'QUEUED':
+            return b'+%s\r\n' % reply.encode()
+        reply = reply.encode()
+        return b'$%d\r\n%s\r\n' % (len(reply), reply)
+
+    def handle(self):
+        self.watched = {}
+        self.queued = None
+        while True:
+            command = self.read_command()
+            if command is None:
+                return
+            with self.server.lock:
+                reply = self.execute(command)
+            self.wfile.write(self.encode(reply))
+
+    def execute(self, command):
+        data = self.server.data
+        name, arguments = command[0].upper(), command[1:]
+        self.server.commands.append(name)
+
+        if self.queued is not None and name not in ('EXEC', 'MULTI'):
+            self.queued.append(command)
+            return 'QUEUED'
+
+        if name == 'MULTI':
+            self.queued = []
+            return 'OK'
+        if name == 'EXEC':
+            queued, self.queued = self.queued, None
+            watched, self.watched = self.watched, {}
+            for key, version in watched.items():
+                if self.server.versions.get(key, 0) != version:
+                    return None
+            return [self.execute(queued_command)
+                    for queued_command in queued]
+        if name == 'WATCH':
+            for key in arguments:
+                self.watched[key] = self.server.versions.get(key, 0)
+            return 'OK'
+        if name == 'UNWATCH':
+            self.watched = {}
+            return 'OK'
+
+        self.server.expire()
+        if name in ('PING', 'SELECT'):
+            return 'OK'
+        if name == 'GET':
+            return data.get(arguments[0], (None,))[0]
+        if name == 'MGET':
+            return [data.get(key, (None,))[0] for key in arguments]
+        if name == 'SET':
+            self.server.touch(arguments[0])
+            data[arguments[0]] = (arguments[1], None)
+            return 'OK'
+        if name == 'EXPIREAT':
+            if arguments[0] not in data:
+                return 0
+            value, expire_at = data[arguments[0]]
+            option = arguments[2] if len(arguments) > 2 else None
+            if option == 'NX' and expire_at is not None or \
+                    option == 'GT' and (
+                        expire_at is None or expire_at >= int(arguments[1])):
+                return 0
+            self.server.touch(arguments[0])
+            data[arguments[0]] = (value, int(arguments[1]))
+            return 1
+        if name == 'SADD':
+            self.server.touch(arguments[0])
+            value, expire_at = data.get(arguments[0], (set(), None))
+            value.add(arguments[1])
+            data[arguments[0]] = (value, expire_at)
+            return 1
+        if name == 'SREM':
+            self.server.touch(arguments[0])
+            value, expire_at = data.get(arguments[0], (set(), None))
+            value.discard(arguments[1])
+            if not value:
+                data.pop(arguments[0], None)
+            return 1
+        if name == 'SMEMBERS':
+            return sorted(data.get(arguments[0], (set(),))[0])
+        if name == 'DEL':
+            self.server.touch(arguments[0])
+            return int(data.pop(arguments[0], None) is not None)
+        if name == 'SCAN':
+            pattern = arguments[arguments.index('MATCH') + 1]
+            return ['0', [key for key in data
+                          if fnmatch.fnmatchcase(key, pattern)]]
+        return Exception('unknown command {}'.format(name))
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.lock = threading.Lock()
+        self.data = {}
+        self.versions = {}
+        self.commands = []
+
+    def touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def expire(self):
+        current_time = time.time()
+        for key, (value, expire_at) in list(self.data.items()):
+            if expire_at is not None and expire_at <= current_time:
+                del self.data[key]
+                self.touch(key)
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedisServer()
+        thread = threading.Thread(target=self.redis.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.redis.server_close)
+        self.addCleanup(self.redis.shutdown)
+
+    def open_storage(self):
+        host, port = self.redis.server_address
+
+        class SessionStorage(RedisSessionStorage):
+            pass
+
+        SessionStorage.host = host
+        SessionStorage.port = port
+
+        storage = SessionStorage()
+        self.addCleanup(storage.close)
+        return storage
+
+    def render_entry(self, delta=60, **kwargs):
+        timestamp = int(time.time())
+        entry = dict(timestamp=timestamp, timestamp_expired=timestamp + delta,
+                     main_token='fake_main_token', action='identifier')
+        entry.update(kwargs)
+        return entry
+
+    def test_mapping(self):
+        """
+        RedisSessionStorage as a mapping
+
+        :return:
+        """
+        storage = self.open_storage()
+
+        entry = self.render_entry(user={'id': 1})
+        storage['key_1'] = entry
+        storage['key_2'] = self.render_entry()
+        storage['expired_key'] = self.render_entry(delta=-10)
+
+        with self.assertRaises(schema.SchemaError):
+            storage['key_3'] = self.render_entry(action='wrong')
+
+        self.assertEqual(storage['key_1'], entry)
+        self.assertEqual(sorted(storage), ['key_1', 'key_2'])
+        self.assertNotIn('expired_key', storage)
+
+        del storage['key_2']
+        with self.assertRaises(KeyError):
+            del storage['key_2']
+        self.assertEqual(len(storage), 1)
+        self.assertEqual(
+            self.redis.data['simple_auth:key_1'][1],
+            entry['timestamp_expired'])
+
+    def test_lock(self):
+        """
+        RedisSessionStorage.lock is one MULTI/EXEC pipeline
+
+        :return:
+        """
+        storage = self.open_storage()
+        storage['key_1'] = self.render_entry()
+
+        with storage.lock('key_1', 'key_2'):
+            del storage['key_1']
+            storage['key_2'] = self.render_entry()
+            self.assertNotIn('key_1', storage)
+            self.assertIn('key_2', storage)
+            self.assertNotIn('simple_auth:key_2', self.redis.data)
+
+        self.assertEqual(list(storage), ['key_2'])
+
+        with self.assertRaises(SessionStorageConflict):
+            with storage.lock('key_2'):
+                self.open_storage()['key_2'] = self.render_entry()
+                storage['key_2'] = self.render_entry(delta=100)
+
+    def test_connection_pool(self):
+        """
+        RedisConnectionPool reuses connections
+
+        :return:
+        """
+        host, port = self.redis.server_address
+        pool = RedisConnectionPool(host=host, port=port, max_connections=2)
+        self.addCleanup(pool.close)
+
+        with pool.connection() as connection1:
+            with pool.connection() as connection2:
+                self.assertIsNot(connection1, connection2)
+        with pool.connection() as connection3:
+            self.assertIn(connection3, (connection1, connection2))
+
+        self.assertEqual(
+            pool.execute(('SET', 'key', 'value'), ('GET', 'key')),
+            ['OK', 'value'])
+        self.assertEqual(
+            RedisConnection.encode(('SET', 'key', 10)),
+            b'*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$2\r\n10\r\n')
+
+    def test_server(self):
+        """
+        SimpleAuthServer with RedisSessionStorage
+
+        :return:
+        """
+        storage = self.open_storage()
+
+        class Server(SimpleAuthServer):
+            session_storage_type = type(storage)
+            user_model = FakeSimpleAuthUser
+
+        server = Server()
+        self.addCleanup(server.session_storage.close)
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=1)
+
+        del self.redis.commands[:]
+        token = server.get_token(identifier=identifier)['result']['token']
+
+        # writes of get_token are one transaction
+        self.assertEqual(self.redis.commands.count('MULTI'), 1)
+        self.assertEqual(self.redis.commands.count('EXEC'), 1)
+
+        self.assertEqual(len(storage), 3)
+        self.assertNotIn(identifier, storage)
+        self.assertEqual(
+            storage[token['update_token']].action, SessionAction.update)
+        self.assertEqual(
+            server.get_token(identifier=identifier)['msg'],
+            'The identifier is wrong')
+
+        main_token = storage[token['access_token']].main_token
+        self.assertEqual(
+            storage.keys_of_main_token(main_token),
+            {main_token, token['access_token'], token['update_token']})
+        self.assertEqual(
+            server.revoke_main_token(main_token)['result'], {'removed': 3})
+        self.assertEqual(len(storage), 0)
+        self.assertEqual(storage.keys_of_main_token(main_token), set())
+
+    def test_one_connection(self):
+        """
+        update_token reads and removes the access token in the
+        transaction, one connection of the pool is enough
+
+        :return:
+        """
+        storage_type = type(self.open_storage())
+
+        class SessionStorage(storage_type):
+            max_connections = 1
+
+        class Server(SimpleAuthServer):
+            session_storage_type = SessionStorage
+            user_model = FakeSimpleAuthUser
+
+        server = Server()
+        storage = server.session_storage
+        self.addCleanup(storage.close)
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=1)
+        token = server.get_token(identifier=identifier)['result']['token']
+
+        responses = []
+        thread = threading.Thread(target=lambda: responses.append(
+            server.update_token(token=token)), daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive(), 'update_token hangs')
+        self.assertFalse(responses[0]['error'])
+        self.assertNotIn(token['access_token'], storage)
+        self.assertNotIn(token['update_token'], storage)
+
+        # a key read in the transaction is watched
+        with self.assertRaises(SessionStorageConflict):
+            with storage.lock('key_1'):
+                self.assertNotIn('key_2', storage)
+                self.open_storage()['key_2'] = self.render_entry()
+                storage['key_1'] = self.render_entry()
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
@@ -3,11 +3,16 @@ Test simple_auth.SimpleAuthServer
 
 """
 
+import threading
 import unittest
 from unittest import mock
 
+import schema
 
-from simple_auth.core.server import SimpleAuthServer
+from simple_auth.core.server import SimpleAuthServer, TTLSessionStorage, \
+    DictSessionStorage, validate_session_storage_entry, \
+    schema_session_storage_entry, SessionEntry, SessionAction, \
+    StripedSessionStorage, LockedSessionStorage
 
 
 class FakeSimpleAuthUser:
@@ -243,9 +248,354 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(
             response,
             {'error': False, 'msg': '', 'result':
-                {'identifier': 'fake_identifier'}}
+                {'identifier': 'fake_identifier',
+                 'expired_identifier': 150}}
         )
 
+    @mock.patch('simple_auth.core.server.time')
+    def test_ttl_session_storage(self, mock_time):
+        """
+        Test TTLSessionStorage
+
+        :return:
+        """
+
+        mock_time.time = lambda: 100
+
+        storage = TTLSessionStorage()
+        storage.sweep_batch_size = 2
+
+        for i in range(5):
+            storage['key_%s' % i] = {
+                'timestamp': 100,
+                'timestamp_expired': 110 + i,
+                'main_token': 'fake_main_token',
+                'action': 'identifier'}
+
+        # rewrite the key with a new expiry
+        entry = storage['key_0']
+        entry['timestamp_expired'] = 200
+        storage['key_0'] = entry
+
+        self.assertEqual(len(storage), 5)
+
+        mock_time.time = lambda: 113
+
+        # one write processes at most sweep_batch_size heap entries,
+        # the stale entry of key_0 is one of them
+        storage['key_5'] = {
+            'timestamp': 113,
+            'timestamp_expired': 150,
+            'main_token': 'fake_main_token',
+            'action': 'identifier'}
+
+        self.assertEqual(
+            sorted(storage), ['key_0', 'key_2', 'key_3', 'key_4', 'key_5'])
+
+        self.assertEqual(storage.sweep(limit=10), 1)
+        self.assertEqual(
+            sorted(storage), ['key_0', 'key_3', 'key_4', 'key_5'])
+
+    def test_validate_session_storage_entry(self):
+        """
+        Test validate_session_storage_entry
+
+        :return:
+        """
+
+        entry = dict(USER_DATA, token={'access_token': 'fake'})
+        self.assertEqual(
+            validate_session_storage_entry(entry),
+            schema_session_storage_entry.validate(entry))
+        self.assertIsNot(validate_session_storage_entry(entry), entry)
+
+        wrong_entries = [
+            None,
+            dict(USER_DATA, action='wrong_action'),
+            dict(USER_DATA, timestamp='100'),
+            dict(USER_DATA, user=[]),
+            dict(USER_DATA, unknown_key=1),
+            {'timestamp': 100, 'action': 'identifier'},
+        ]
+        for wrong_entry in wrong_entries:
+            with self.assertRaises(schema.SchemaError) as fast_error:
+                validate_session_storage_entry(wrong_entry)
+            with self.assertRaises(schema.SchemaError) as schema_error:
+                schema_session_storage_entry.validate(wrong_entry)
+            self.assertEqual(
+                str(fast_error.exception), str(schema_error.exception))
+
+        storage = DictSessionStorage()
+        with self.assertRaises(schema.SchemaError):
+            storage['fake_key'] = dict(USER_DATA, action='wrong_action')
+
+        entry = SessionEntry.from_dict(USER_DATA)
+        storage.set_trusted('fake_key', entry)
+        self.assertIs(storage['fake_key'], entry)
+
+        # initial entries are validated and converted
+        for storage_type in (DictSessionStorage, TTLSessionStorage):
+            with self.assertRaises(schema.SchemaError):
+                storage_type(fake_key=dict(USER_DATA, action='wrong'))
+
+            # not expired for TTLSessionStorage
+            entry = dict(USER_DATA, timestamp_expired=4102444800)
+            storage = storage_type({'fake_key': entry})
+            self.assertIsInstance(storage['fake_key'], SessionEntry)
+            self.assertEqual(storage['fake_key'], entry)
+            self.assertEqual(
+                storage.keys_of_main_token('fake_main_token'), {'fake_key'})
+
+    def test_session_entry(self):
+        """
+        Test SessionEntry
+
+        :return:
+        """
+
+        storage = DictSessionStorage()
+        storage['fake_key'] = USER_DATA
+        entry = storage['fake_key']
+
+        self.assertIsInstance(entry, SessionEntry)
+        self.assertIs(entry.action, SessionAction.identifier)
+        self.assertIs(entry.user, USER_DATA['user'])
+        self.assertFalse(hasattr(entry, '__dict__'))
+
+        self.assertEqual(entry.to_dict(), USER_DATA)
+        self.assertEqual(entry, USER_DATA)
+        self.assertEqual(entry['action'], 'identifier')
+        self.assertIn('user', entry)
+        self.assertNotIn('token', entry)
+
+        self.assertEqual(
+            entry.to_response(),
+            {'timestamp': 100, 'timestamp_expired': 150,
+             'user': USER_DATA['user']})
+
+    def test_striped_session_storage(self):
+        """
+        Test SimpleAuthServer with StripedSessionStorage and
+        LockedSessionStorage: one identifier gives only one token for
+        concurrent requests
+
+        :return:
+        """
+
+        class LockedTTLSessionStorage(LockedSessionStorage,
+                                      TTLSessionStorage):
+            pass
+
+        for storage_type in (StripedSessionStorage, LockedSessionStorage,
+                             LockedTTLSessionStorage):
+            with self.subTest(storage_type=storage_type.__name__):
+                self._check_concurrent_get_token(storage_type)
+
+    def _check_concurrent_get_token(self, storage_type):
+
+        class ThreadedSimpleAuthServer(SimpleAuthServer):
+            session_storage_type = storage_type
+
+        server = ThreadedSimpleAuthServer()
+        identifiers = []
+        for i in range(50):
+            identifier = server.get_identifier()['result']['identifier']
+            server.add_user_data(identifier=identifier, user_id=i)
+            identifiers.append(identifier)
+
+        responses = []
+        barrier = threading.Barrier(4)
+
+        def get_tokens():
+            barrier.wait()
+            for identifier in identifiers:
+                responses.append(server.get_token(identifier=identifier))
+
+        threads = [threading.Thread(target=get_tokens) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        tokens = [response['result']['token'] for response in responses
+                  if not response['error']]
+        self.assertEqual(len(tokens), len(identifiers))
+
+        # identifiers -> access, update and main tokens
+        self.assertEqual(len(server.session_storage), 3 * len(identifiers))
+        for token in tokens:
+            self.assertEqual(
+                server.session_storage[token['access_token']].action,
+                SessionAction.access)
+
+    def test_revoke_main_token(self):
+        """
+        Test SimpleAuthServer.revoke_main_token
+
+        :return:
+        """
+
+        class DictSimpleAuthServer(SimpleAuthServer):
+            session_storage_type = dict
+
+        for server in (SimpleAuthServer(), DictSimpleAuthServer()):
+            identifier1 = server.get_identifier()['result']['identifier']
+            server.add_user_data(identifier=identifier1, user_id=1)
+            token = server.get_token(identifier1)['result']['token']
+            access_token = token['access_token']
+            main_token = server.session_storage[access_token].main_token
+
+            identifier2 = server.get_identifier()['result']['identifier']
+            server.merge_main_tokens(key1=access_token, key2=identifier2)
+            identifier3 = server.get_identifier()['result']['identifier']
+
+            if isinstance(server.session_storage, DictSessionStorage):
+                self.assertEqual(
+                    server.session_storage.keys_of_main_token(main_token),
+                    {main_token, access_token, token['update_token'],
+                     identifier2})
+
+            response = server.revoke_main_token(main_token=main_token)
+
+            self.assertEqual(
+                response,
+                {'error': False, 'msg': '', 'result': {'removed': 4}})
+            self.assertEqual(list(server.session_storage), [identifier3])
+
+    def test_get_token_shares_user(self):
+        """
+        SimpleAuthServer.get_token doesn't copy the user for the entries,
+        the response has got its own user and token
+
+        :return:
+        """
+
+        server = SimpleAuthServer()
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=1)
+        user = server.session_storage[identifier].user
+
+        response = server.get_token(identifier=identifier)
+        token = response['result']['token']
+
+        self.assertIs(server.session_storage[token['access_token']].user, user)
+        self.assertIs(server.session_storage[token['update_token']].user, user)
+
+        # changes of the response don't reach the sessions
+        response['result']['user']['id'] = 2
+        response['result']['token']['expired_access_token'] = 0
+        entry = server.session_storage[token['access_token']]
+        self.assertEqual(entry.user['id'], 1)
+        self.assertNotEqual(entry.token['expired_access_token'], 0)
+
+    def test_signed_access_token(self):
+        """
+        SimpleAuthServer with token_secret: access tokens are signed
+        and are not kept in the storage
+
+        :return:
+        """
+
+        class SignedSimpleAuthServer(SimpleAuthServer):
+            token_secret = 'secret'
+
+        server = SignedSimpleAuthServer()
+        identifier = server.get_identifier()['result']['identifier']
+        main_token = server.session_storage[identifier].main_token
+        server.add_user_data(identifier=identifier, user_id=7)
+
+        response = server.get_token(identifier=identifier)
+        token = response['result']['token']
+
+        self.assertEqual(response['result']['user']['id'], 7)
+        self.assertNotIn(token['access_token'], server.session_storage)
+        self.assertEqual(
+            server.session_storage[token['update_token']].action,
+            SessionAction.update)
+
+        response = server.check_token(token=token)
+        self.assertFalse(response['error'])
+        self.assertEqual(response['result'], {
+            'user_id': 7, 'exp': token['expired_access_token'],
+            'main_token': main_token})
+
+        token = dict(token, access_token=token['access_token'][:-1])
+        self.assertTrue(server.check_token(token=token)['error'])
+
+    def test_batch(self):
+        """
+        Test SimpleAuthServer.get_tokens, check_tokens, update_tokens
+
+        :return:
+        """
+
+        server = SimpleAuthServer()
+        identifiers = []
+        for user_id in range(3):
+            identifier = server.get_identifier()['result']['identifier']
+            server.add_user_data(identifier=identifier, user_id=user_id)
+            identifiers.append(identifier)
+
+        response = server.get_tokens(
+            identifiers=identifiers + ['wrong_identifier', 1])
+
+        self.assertFalse(response['error'])
+        result = response['result']
+        self.assertEqual(
+            [item['error'] for item in result],
+            [False, False, False, True, True])
+        self.assertEqual(
+            [item['result']['user']['id'] for item in result[:3]],
+            [0, 1, 2])
+        self.assertEqual(result[4]['msg'], 'The item of the batch is wrong')
+
+        tokens = [item['result']['token'] for item in result[:3]]
+        response = server.check_tokens(
+            tokens=tokens + [{'access_token': 'wrong'}])
+        self.assertEqual(
+            [item['error'] for item in response['result']],
+            [False, False, False, True])
+
+        response = server.update_tokens(
+            tokens=tokens + [{'update_token': 'wrong'}, 'wrong'])
+        self.assertFalse(response['error'])
+        result = response['result']
+        self.assertEqual(
+            [item['error'] for item in result],
+            [False, False, False, True, True])
+        self.assertEqual(
+            [item['result']['user']['id'] for item in result[:3]],
+            [0, 1, 2])
+        self.assertEqual(result[3]['msg'], 'The update token is wrong')
+        self.assertEqual(result[4]['msg'], 'The item of the batch is wrong')
+
+        # new pairs, the old ones are consumed
+        new_tokens = [item['result']['token'] for item in result[:3]]
+        for token, new_token in zip(tokens, new_tokens):
+            self.assertNotEqual(
+                new_token['update_token'], token['update_token'])
+            self.assertEqual(
+                server.session_storage[new_token['update_token']].main_token,
+                server.session_storage[new_token['access_token']].main_token)
+        self.assertEqual(
+            [item['error'] for item in server.check_tokens(
+                tokens=tokens + new_tokens)['result']],
+            [True, True, True, False, False, False])
+        self.assertEqual(
+            [item['msg'] for item in server.update_tokens(
+                tokens=tokens)['result']],
+            ['The update token is wrong'] * 3)
+
+        self.assertEqual(
+            server.check_tokens(tokens={}),
+            {'error': True, 'msg': 'The batch has to be a list',
+             'result': None})
+
+        server.max_batch_size = 2
+        self.assertEqual(
+            server.check_tokens(tokens=tokens)['msg'],
+            'The batch is too big')
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
@@ -0,0 +1,245 @@
+"""
+Test simple_auth.core.shm_storage.SharedMemorySessionStorage
+
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import unittest
+from unittest import mock
+
+import schema
+
+from simple_auth.core.shm_storage import SharedMemorySessionStorage, \
+    SessionStorageFull
+from simple_auth.core.server import SimpleAuthServer
+
+
+class FakeSimpleAuthUser:
+    id: int = 10
+
+    def to_storage_dict(self):
+        return dict(id=self.id, name='User name')
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+def render_entry(delta=60, **kwargs):
+    timestamp = int(time.time())
+    entry = dict(timestamp=timestamp, timestamp_expired=timestamp + delta,
+                 main_token='fake_main_token', action='identifier')
+    entry.update(kwargs)
+    return entry
+
+
+def write_in_other_process(name, key):
+    storage = SharedMemorySessionStorage(name=name)
+    storage[key] = render_entry(user={'id': 2})
+    storage.close()
+
+
+def lock_in_forked_process(storage, locked):
+    with storage.lock():
+        locked.set()
+
+
+class SessionStorage(SharedMemorySessionStorage):
+    slot_count = 8
+    slot_size = 512
+
+
+class MyTestCase(unittest.TestCase):
+
+    def open_storage(self, name=None):
+        if name is None:
+            name = 'test_simple_auth_%s' % uuid.uuid4().hex[:8]
+            storage = SessionStorage(name=name)
+            self.addCleanup(storage.unlink)
+        else:
+            storage = SessionStorage(name=name)
+        self.addCleanup(storage.close)
+        return storage
+
+    def test_mapping(self):
+        """
+        SharedMemorySessionStorage as a mapping
+
+        :return:
+        """
+        storage = self.open_storage()
+
+        for i in range(8):
+            storage['key_%s' % i] = render_entry(user={'id': i})
+
+        with self.assertRaises(SessionStorageFull):
+            storage['key_8'] = render_entry()
+        with self.assertRaises(schema.SchemaError):
+            storage['key_0'] = render_entry(action='wrong')
+        with self.assertRaises(ValueError):
+            storage['key_0'] = render_entry(user={'name': 'x' * 512})
+
+        self.assertEqual(len(storage), 8)
+        self.assertEqual(storage['key_3'], render_entry(user={'id': 3}))
+
+        del storage['key_3']
+        self.assertNotIn('key_3', storage)
+        with self.assertRaises(KeyError):
+            del storage['key_3']
+
+        # deleted and expired slots are used again
+        storage['key_8'] = render_entry()
+        storage['key_0'] = render_entry(delta=-10)
+        storage['key_9'] = render_entry()
+
+        self.assertEqual(
+            sorted(storage),
+            ['key_1', 'key_2', 'key_4', 'key_5', 'key_6', 'key_7',
+             'key_8', 'key_9'])
+
+    def test_processes(self):
+        """
+        Entries are shared between processes
+
+        :return:
+        """
+        storage = self.open_storage()
+        self.assertEqual(self.open_storage(storage.name).slot_count, 8)
+
+        process = multiprocessing.get_context('fork').Process(
+            target=write_in_other_process, args=(storage.name, 'key'))
+        process.start()
+        process.join()
+
+        self.assertEqual(storage['key'].user, {'id': 2})
+
+    def test_process_exit(self):
+        """
+        The segment outlives the process which has created it
+
+        :return:
+        """
+        name = 'test_simple_auth_%s' % uuid.uuid4().hex[:8]
+        code = (
+            'from simple_auth.core.shm_storage import '
+            'SharedMemorySessionStorage\n'
+            'storage = SharedMemorySessionStorage(name={!r})\n'
+            'storage["key"] = {!r}\n'.format(name, render_entry()))
+        subprocess.run(
+            [sys.executable, '-c', code], check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        storage = SharedMemorySessionStorage(name=name)
+        self.addCleanup(storage.close)
+        self.addCleanup(storage.unlink)
+        self.assertEqual(list(storage), ['key'])
+
+    def test_forked_lock(self):
+        """
+        A worker forked after the storage is created is excluded by lock
+
+        :return:
+        """
+        storage = self.open_storage()
+        context = multiprocessing.get_context('fork')
+        locked = context.Event()
+
+        with storage.lock():
+            process = context.Process(
+                target=lock_in_forked_process, args=(storage, locked))
+            process.start()
+            self.assertFalse(locked.wait(0.3))
+
+        self.assertTrue(locked.wait(5))
+        process.join()
+
+    def test_tombstones(self):
+        """
+        Deleted slots are reclaimed by rehash
+
+        :return:
+        """
+        storage = self.open_storage()
+        storage['live'] = render_entry()
+
+        for i in range(100):
+            storage['key_%s' % i] = render_entry()
+            del storage['key_%s' % i]
+            used, deleted = storage._counts()
+            self.assertEqual(used, 1)
+            self.assertLessEqual(deleted * 2, storage.slot_count - used)
+
+        self.assertEqual(list(storage), ['live'])
+
+        # expired entries are dropped by rehash
+        storage['expired'] = render_entry(delta=-10)
+        storage._rehash()
+        self.assertEqual(storage._counts(), (1, 0))
+        self.assertEqual(list(storage), ['live'])
+        self.assertEqual(storage.count_entries(), 1)
+
+    def test_server(self):
+        """
+        SimpleAuthServer with SharedMemorySessionStorage
+
+        :return:
+        """
+        storage = self.open_storage()
+
+        class Server(SimpleAuthServer):
+            user_model = FakeSimpleAuthUser
+
+            @staticmethod
+            def session_storage_type():
+                return storage
+
+        server = Server()
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=1)
+        token = server.get_token(identifier=identifier)['result']['token']
+
+        self.assertEqual(
+            server.check_token(token=token),
+            {'error': False, 'msg': '', 'result': None})
+        self.assertEqual(len(storage), 3)
+
+        # get_token changes nothing when the new entries don't fit
+        for i in range(3):
+            storage['key_%s' % i] = render_entry()
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=1)
+        self.assertEqual(
+            server.get_token(identifier=identifier),
+            {'error': True, 'msg': 'The session storage is full',
+             'result': None})
+        self.assertEqual(storage[identifier].user, {'id': 1,
+                                                    'name': 'User name'})
+
+        del storage['key_0']
+        del storage['key_1']
+        self.assertFalse(server.get_token(identifier=identifier)['error'])
+        self.assertNotIn(identifier, storage)
+
+        # a profile bigger than slot_size is an error response
+        identifier = server.get_identifier()['result']['identifier']
+        with mock.patch.object(
+                FakeSimpleAuthUser, 'to_storage_dict',
+                lambda user: dict(id=user.id, name='x' * 1000)):
+            self.assertEqual(
+                server.add_user_data(identifier=identifier, user_id=2),
+                {'error': True, 'msg': 'The session storage is full',
+                 'result': None})
+        self.assertIsNone(storage[identifier].user)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
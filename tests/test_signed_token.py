@@ -0,0 +1,72 @@
+"""
+Test simple_auth.core.signed_token
+
+"""
+import unittest
+from unittest import mock
+
+from simple_auth.core.signed_token import sign_token, verify_token
+from simple_auth.core.client import SimpleAuthClient
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_sign_token(self):
+        """
+        Test sign_token and verify_token
+
+        :return:
+        """
+        access_token = sign_token('secret', 10, 150, 'fake_main_token')
+
+        self.assertEqual(
+            verify_token('secret', access_token, current_time=100),
+            {'user_id': 10, 'exp': 150, 'main_token': 'fake_main_token'})
+
+        # expired
+        self.assertIsNone(
+            verify_token('secret', access_token, current_time=150))
+        # other secret
+        self.assertIsNone(
+            verify_token(b'other', access_token, current_time=100))
+
+        # changed claims
+        payload, signature = access_token.split('.')
+        other_payload = sign_token(
+            'other', 10, 10 ** 10, 'fake_main_token').split('.')[0]
+        self.assertIsNone(verify_token(
+            'secret', other_payload + '.' + signature, current_time=100))
+
+        for wrong_token in (None, 1, '', 'a.b', 'a.b.c', access_token + 'é'):
+            self.assertIsNone(
+                verify_token('secret', wrong_token, current_time=100))
+
+    @mock.patch('simple_auth.core.signed_token.time')
+    def test_client_verify_token(self, mock_time):
+        """
+        Test SimpleAuthClient.verify_token
+
+        :return:
+        """
+        mock_time.time = lambda: 100
+        token = {'access_token': sign_token(
+            'secret', 10, 150, 'fake_main_token')}
+
+        client = SimpleAuthClient(
+            url_server_auth='http://localhost', token_secret='secret')
+        self.assertEqual(client.verify_token(token)['user_id'], 10)
+        self.assertIsNone(client.verify_token({'access_token': 'wrong'}))
+        self.assertIsNone(client.verify_token(None))
+
+        mock_time.time = lambda: 150
+        self.assertIsNone(client.verify_token(token))
+
+        client = SimpleAuthClient(url_server_auth='http://localhost')
+        with self.assertRaises(ValueError):
+            client.verify_token(token)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
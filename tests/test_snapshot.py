@@ -0,0 +1,130 @@
+"""
+Test simple_auth.core.snapshot
+
+"""
+import io
+import os
+import shutil
+import tempfile
+
+import unittest
+from unittest import mock
+
+from simple_auth.core.server import SimpleAuthServer, DictSessionStorage, \
+    SessionAction
+from simple_auth.core import snapshot
+
+
+class FakeSimpleAuthUser:
+    id: int = 10
+
+    def to_storage_dict(self):
+        return dict(id=self.id, name='User name', access=[1, 2, 3])
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+class SimpleAuthServer(SimpleAuthServer):
+    user_model = FakeSimpleAuthUser
+
+
+class MyTestCase(unittest.TestCase):
+
+    def login(self, server, user_id):
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=user_id)
+        return server.get_token(identifier=identifier)['result']['token']
+
+    def test_dump_load(self):
+        """
+        Snapshot keeps all entries, UUID and other keys
+
+        :return:
+        """
+        server = SimpleAuthServer()
+        tokens = [self.login(server, user_id) for user_id in range(3)]
+        server.session_storage['not_uuid_key'] = {
+            'timestamp': 100, 'timestamp_expired': 2 ** 40,
+            'main_token': 'not_uuid_main_token', 'action': 'identifier'}
+        identifier = server.get_identifier()['result']['identifier']
+
+        file = io.BytesIO()
+        snapshot.dump_session_storage(server.session_storage, file)
+        file.seek(0)
+
+        storage = DictSessionStorage()
+        count = snapshot.load_session_storage(file, storage)
+
+        self.assertEqual(count, 11)
+        self.assertEqual(storage, server.session_storage)
+        self.assertEqual(
+            storage[identifier].action, SessionAction.identifier)
+
+        # entries of one login share user and token
+        access_entry = storage[tokens[0]['access_token']]
+        update_entry = storage[tokens[0]['update_token']]
+        self.assertIs(access_entry.user, update_entry.user)
+        self.assertIs(access_entry.token, update_entry.token)
+
+        # the index of main tokens is restored too
+        self.assertEqual(
+            storage.keys_of_main_token(access_entry.main_token),
+            {access_entry.main_token, tokens[0]['access_token'],
+             tokens[0]['update_token']})
+
+    @mock.patch('simple_auth.core.snapshot.time')
+    def test_skip_expired(self, mock_time):
+        """
+        Expired entries are skipped
+
+        :return:
+        """
+        storage = DictSessionStorage()
+        for i, timestamp_expired in enumerate((110, 130, 150)):
+            storage['key_%s' % i] = {
+                'timestamp': 100, 'timestamp_expired': timestamp_expired,
+                'main_token': 'main_token', 'action': 'identifier'}
+
+        file = io.BytesIO()
+        snapshot.dump_session_storage(storage, file)
+        file.seek(0)
+
+        mock_time.time = lambda: 130
+        restored = {}
+        self.assertEqual(snapshot.load_session_storage(file, restored), 2)
+        self.assertEqual(sorted(restored), ['key_1', 'key_2'])
+
+        with self.assertRaises(ValueError):
+            snapshot.load_session_storage(io.BytesIO(b'wrong'), restored)
+
+    def test_save_restore(self):
+        """
+        save_snapshot and restore_snapshot
+
+        :return:
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'sessions.snapshot')
+
+        server = SimpleAuthServer()
+        token = self.login(server, user_id=1)
+        self.assertEqual(
+            snapshot.save_snapshot(server.session_storage, path), 3)
+
+        new_server = SimpleAuthServer()
+        self.assertEqual(
+            snapshot.restore_snapshot(new_server.session_storage, path), 3)
+        self.assertEqual(
+            new_server.check_token(token=token),
+            {'error': False, 'msg': '', 'result': None})
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
@@ -0,0 +1,164 @@
+"""
+Test simple_auth.core.sqlite_storage.SQLiteSessionStorage
+
+"""
+import os
+import shutil
+import tempfile
+
+import unittest
+from unittest import mock
+
+import schema
+
+from simple_auth.core.sqlite_storage import SQLiteSessionStorage
+from simple_auth.core.server import SimpleAuthServer
+
+
+class FakeSimpleAuthUser:
+    id: int = 10
+
+    def to_storage_dict(self):
+        return dict(id=self.id, name='User name')
+
+    @classmethod
+    def get(cls, user_id):
+        user = cls()
+        user.id = user_id
+        return user
+
+
+def render_entry(timestamp_expired, **kwargs):
+    entry = dict(timestamp=100, timestamp_expired=timestamp_expired,
+                 main_token='fake_main_token', action='identifier')
+    entry.update(kwargs)
+    return entry
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sessions.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open_storage(self):
+        storage = SQLiteSessionStorage(path=self.path)
+        self.addCleanup(storage.close)
+        return storage
+
+    def test_mapping(self):
+        """
+        SQLiteSessionStorage as a mapping
+
+        :return:
+        """
+        storage = self.open_storage()
+
+        storage['key_1'] = render_entry(150, user={'id': 1})
+        storage['key_2'] = render_entry(150)
+        storage['key_2'] = render_entry(160)
+
+        with self.assertRaises(schema.SchemaError):
+            storage['key_3'] = render_entry(150, action='wrong')
+
+        self.assertEqual(
+            dict(storage),
+            {'key_1': render_entry(150, user={'id': 1}),
+             'key_2': render_entry(160)})
+
+        del storage['key_1']
+        with self.assertRaises(KeyError):
+            del storage['key_1']
+        self.assertNotIn('key_1', storage)
+        self.assertEqual(len(storage), 1)
+
+    def test_lock(self):
+        """
+        SQLiteSessionStorage.lock is a transaction
+
+        :return:
+        """
+        storage = self.open_storage()
+
+        with self.assertRaises(RuntimeError):
+            with storage.lock('key_1'):
+                storage['key_1'] = render_entry(150)
+                with storage.lock('key_2'):
+                    storage['key_2'] = render_entry(150)
+                raise RuntimeError()
+
+        self.assertEqual(len(storage), 0)
+
+        with storage.lock('key_1'):
+            storage['key_1'] = render_entry(150)
+        self.assertEqual(list(self.open_storage()), ['key_1'])
+
+    @mock.patch('simple_auth.core.sqlite_storage.time')
+    def test_purge_expired(self, mock_time):
+        """
+        SQLiteSessionStorage.purge_expired
+
+        :return:
+        """
+        mock_time.time = lambda: 130
+        storage = self.open_storage()
+        for i in range(5):
+            storage['key_%s' % i] = render_entry(128 + i)
+
+        self.assertEqual(storage.purge_expired(limit=1), 1)
+        self.assertEqual(storage.purge_expired(), 1)
+        self.assertEqual(sorted(storage), ['key_2', 'key_3', 'key_4'])
+
+        # writes purge in batches
+        storage.purge_every = 2
+        storage.purge_batch_size = 2
+        mock_time.time = lambda: 200
+        for i in range(5, 9):
+            storage['key_%s' % i] = render_entry(300)
+        self.assertEqual(
+            sorted(storage), ['key_5', 'key_6', 'key_7', 'key_8'])
+
+    def test_server(self):
+        """
+        SimpleAuthServer with SQLiteSessionStorage
+
+        :return:
+        """
+        path = self.path
+
+        class SessionStorage(SQLiteSessionStorage):
+            pass
+
+        SessionStorage.path = path
+
+        class Server(SimpleAuthServer):
+            session_storage_type = SessionStorage
+            user_model = FakeSimpleAuthUser
+
+        server = Server()
+        self.addCleanup(server.session_storage.close)
+        identifier = server.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=1)
+        token = server.get_token(identifier=identifier)['result']['token']
+
+        server = Server()
+        self.addCleanup(server.session_storage.close)
+        self.assertEqual(
+            server.check_token(token=token),
+            {'error': False, 'msg': '', 'result': None})
+        self.assertNotIn(identifier, server.session_storage)
+        self.assertEqual(len(server.session_storage), 3)
+
+        main_token = server.session_storage[token['access_token']].main_token
+        self.assertEqual(
+            server.revoke_main_token(main_token)['result'], {'removed': 3})
+        self.assertEqual(len(server.session_storage), 0)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
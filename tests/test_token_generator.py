@@ -0,0 +1,95 @@
+"""
+Test simple_auth.core.token_generator
+
+"""
+import re
+import threading
+import uuid
+
+import unittest
+
+from simple_auth.core import token_generator
+from simple_auth.core.token_generator import BufferedUUIDTokenGenerator, \
+    URLSafeTokenGenerator
+from simple_auth.core.server import SimpleAuthServer
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_buffered_uuid(self):
+        """
+        Test BufferedUUIDTokenGenerator
+
+        :return:
+        """
+        generator = BufferedUUIDTokenGenerator()
+        tokens = [generator() for _ in range(3000)]
+
+        self.assertEqual(len(set(tokens)), 3000)
+        for token in tokens:
+            value = uuid.UUID(token)
+            self.assertEqual(str(value), token)
+            self.assertEqual(value.version, 4)
+            self.assertEqual(value.variant, uuid.RFC_4122)
+
+    def test_url_safe(self):
+        """
+        Test URLSafeTokenGenerator
+
+        :return:
+        """
+        generator = URLSafeTokenGenerator()
+        tokens = [generator() for _ in range(3000)]
+
+        self.assertEqual(len(set(tokens)), 3000)
+        for token in tokens:
+            self.assertRegex(token, re.compile(r'^[A-Za-z0-9_-]{22}$'))
+
+    def test_threads_and_fork(self):
+        """
+        Threads get different tokens, buffers are dropped after fork
+
+        :return:
+        """
+        generator = URLSafeTokenGenerator()
+        tokens = []
+
+        def generate():
+            tokens.extend(generator() for _ in range(2000))
+
+        threads = [threading.Thread(target=generate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(tokens)), 8000)
+
+        self.assertTrue(generator._tokens)
+        token_generator._clear_after_fork()
+        self.assertEqual(generator._tokens, [])
+
+    def test_server(self):
+        """
+        SimpleAuthServer with token_generator_type
+
+        :return:
+        """
+
+        class URLSafeSimpleAuthServer(SimpleAuthServer):
+            token_generator_type = URLSafeTokenGenerator
+
+        server = URLSafeSimpleAuthServer()
+        identifier = server.get_identifier()['result']['identifier']
+        self.assertEqual(len(identifier), 22)
+        self.assertEqual(
+            len(server.session_storage[identifier].main_token), 22)
+
+        token = server.render_token()
+        self.assertEqual(len(token['access_token']), 22)
+        self.assertEqual(len(token['update_token']), 22)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(MyTestCase)
+    runner = unittest.TextTestRunner(verbosity=2)
+    result_test = runner.run(suite)
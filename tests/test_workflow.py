@@ -8,7 +8,7 @@ import json
 import unittest
 from unittest import mock
 
-from simple_auth.core.client import SimpleAuthClient
+from simple_auth.core.client import SimpleAuthClient, close_sessions
 from simple_auth.core.server import SimpleAuthServer
 
 
@@ -112,6 +112,11 @@ def render_requests_redirect(server):
 
 class MyTestCase(unittest.TestCase):
 
+    def setUp(self):
+        # clients share the session, a new mock of requests
+        # needs a new session
+        close_sessions()
+
     @mock.patch('simple_auth.core.client.requests')
     @mock.patch('simple_auth.core.server.time')
     @mock.patch('simple_auth.core.server.uuid')
@@ -122,7 +127,7 @@ class MyTestCase(unittest.TestCase):
 
         # mocks
         requests_redirect = render_requests_redirect(server)
-        mock_requests.post = requests_redirect
+        mock_requests.Session.return_value.post = requests_redirect
         mock_uuid.uuid4 = lambda: 'mock_uud4'
         mock_time.time = lambda: 100
 
@@ -195,7 +200,7 @@ class MyTestCase(unittest.TestCase):
 
         requests_redirect = render_requests_redirect(server)
 
-        mock_requests.post = requests_redirect
+        mock_requests.Session.return_value.post = requests_redirect
         mock_uuid.uuid4 = mock.MagicMock(
             side_effect=['mock_uud4_0', 'mock_uud4_1'])
         mock_time.time = lambda: 100
@@ -230,6 +235,78 @@ class MyTestCase(unittest.TestCase):
                          {'error': True, 'msg': 'This identifier has expired',
                           'result': None})
 
+    @mock.patch('simple_auth.core.client.requests')
+    @mock.patch('simple_auth.core.server.time')
+    @mock.patch('simple_auth.core.server.uuid')
+    def test_update_token(self, mock_uuid, mock_time, mock_requests):
+        server = SimpleAuthServer()
+        client = SimpleAuthClient(url_server_auth='http://localhost')
+
+        mock_requests.Session.return_value.post = \
+            render_requests_redirect(server)
+        mock_uuid.uuid4 = mock.MagicMock(
+            side_effect=['mock_uud4_%s' % i for i in range(1000)])
+        mock_time.time = lambda: 100
+
+        identifier = client.get_identifier()['result']['identifier']
+        server.add_user_data(identifier=identifier, user_id=1)
+        token = client.get_token(identifier=identifier)['result']['token']
+        self.assertEqual(token['access_token'], 'mock_uud4_2')
+        self.assertEqual(token['update_token'], 'mock_uud4_3')
+
+        # the update token is redeemed for a new pair of the same login
+        mock_time.time = lambda: 140
+        response = client.update_token(token=token)
+        self.assertEqual(response, {
+            'error': False,
+            'msg': '',
+            'result': {
+                'timestamp': 100,
+                'timestamp_expired': 170,
+                'token': {
+                    'access_token': 'mock_uud4_4',
+                    'expired_access_token': 170,
+                    'expired_update_token': 200,
+                    'update_token': 'mock_uud4_5'
+                },
+                'user': USER_DATA['user']
+            }})
+        new_token = response['result']['token']
+
+        # the old pair is consumed
+        self.assertNotIn(token['access_token'], server.session_storage)
+        self.assertNotIn(token['update_token'], server.session_storage)
+        self.assertEqual(
+            client.update_token(token=token),
+            {'error': True, 'msg': 'The update token is wrong',
+             'result': None})
+
+        # the new pair belongs to the login
+        self.assertEqual(
+            client.check_tokens(tokens=[new_token])['result'],
+            [{'error': False, 'msg': '', 'result': None}])
+        self.assertEqual(
+            server.session_storage['mock_uud4_1'],
+            {'timestamp': 100, 'timestamp_expired': 200,
+             'main_token': 'mock_uud4_1', 'action': 'main'})
+        self.assertEqual(
+            server.session_storage[new_token['update_token']]['main_token'],
+            'mock_uud4_1')
+
+        # an access token or an identifier is not an update token
+        response = client.update_token(
+            token=dict(update_token=new_token['access_token']))
+        self.assertEqual(
+            response,
+            {'error': True, 'msg': 'The update token is wrong',
+             'result': None})
+
+        # the update token has expired
+        mock_time.time = lambda: 200
+        self.assertEqual(
+            client.update_token(token=new_token),
+            {'error': True, 'msg': 'This key has expired', 'result': None})
+
     @mock.patch('simple_auth.core.client.requests')
     @mock.patch('simple_auth.core.server.time')
     @mock.patch('simple_auth.core.server.uuid')
@@ -238,7 +315,8 @@ class MyTestCase(unittest.TestCase):
         client1 = SimpleAuthClient(url_server_auth='http://localhost')
         client2 = SimpleAuthClient(url_server_auth='http://localhost')
 
-        mock_requests.post = render_requests_redirect(server)
+        mock_requests.Session.return_value.post = \
+            render_requests_redirect(server)
         mock_uuid.uuid4 = mock.MagicMock(
             side_effect=['mock_uud4_%s' % i for i in range(1000)])
 